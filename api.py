@@ -0,0 +1,335 @@
+"""API HTTP leve com os rankings e métricas pré-calculados.
+
+Serve os snapshots diários gravados pelo app (RankingSnapshotStore), sem recalcular nada
+por requisição: as respostas ficam prontas em memória (JSON e gzip) e são validadas pela
+versão do diretório de snapshots, com ETag/Last-Modified para respostas 304.
+
+Uso:
+    python api.py --port 8502 [--snapshot-dir snapshots]
+
+Endpoints:
+    GET /rankings/{universo}?period=1y&limit=50&date=AAAA-MM-DD
+    GET /symbol/{ticker}/metrics?period=1y&days=30
+    GET /universes
+    GET /health
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+from ranking_store import PERIOD_ORDER, SNAPSHOT_DIR, RankingSnapshotStore
+
+API_CACHE_ENTRIES = 1024
+API_RANKING_ENTRIES = 256  # rankings lidos dos snapshots mantidos em memória
+API_MAX_AGE = 60  # segundos de cache permitidos aos clientes (revalidação por ETag depois disso)
+GZIP_MIN_BYTES = 512
+DEFAULT_TREND_DAYS = 30
+
+class ApiError(Exception):
+    """Erro de requisição com status HTTP"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class Response:
+    """Resposta pronta para envio: corpo JSON, versão gzip e validadores de cache.
+
+    Cada representação tem o seu ETag (o da versão gzip leva o sufixo -gzip), como pede
+    o RFC 9110 para validadores fortes de corpos diferentes.
+    """
+
+    __slots__ = ('status', 'body', 'gzip_body', 'etag', 'gzip_etag', 'last_modified')
+
+    def __init__(self, status, payload, last_modified=None):
+        self.status = status
+        self.body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.gzip_body = gzip.compress(self.body, 6) if len(self.body) >= GZIP_MIN_BYTES else None
+        digest = hashlib.sha1(self.body).hexdigest()[:16]
+        self.etag = f'"{digest}"'
+        self.gzip_etag = f'"{digest}-gzip"'
+        self.last_modified = last_modified
+
+def _clean(value):
+    """Converte valores numpy/NaN para JSON (NaN e infinitos viram null)"""
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+def _records(frame):
+    return [{key: _clean(value) for key, value in row.items()} for row in frame.to_dict('records')]
+
+class RankingApi:
+    """Rotas da API sobre o armazenamento de snapshots, com cache de respostas por versão"""
+
+    ROUTES = [
+        (re.compile(r'^/rankings/(?P<universe>[\w-]+)/?$'), 'rankings'),
+        (re.compile(r'^/symbol/(?P<ticker>[\w.^-]+)/metrics/?$'), 'symbol_metrics'),
+        (re.compile(r'^/universes/?$'), 'universes'),
+        (re.compile(r'^/health/?$'), 'health'),
+    ]
+
+    def __init__(self, store, cache_entries=API_CACHE_ENTRIES, ranking_entries=API_RANKING_ENTRIES):
+        self.store = store
+        self.cache_entries = cache_entries
+        self.ranking_entries = ranking_entries
+        self._cache = OrderedDict()
+        self._rankings = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, params):
+        """Resposta para GET path?params, reaproveitada enquanto os snapshots não mudarem"""
+        for pattern, name in self.ROUTES:
+            match = pattern.match(path)
+            if match:
+                break
+        else:
+            raise ApiError(404, f"Rota não encontrada: {path}")
+
+        handler = getattr(self, name)
+        args = match.groupdict()
+        revision = self._revision(name, args, params)
+        key = (name, tuple(sorted(args.items())), tuple(sorted(params.items())))
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] == revision:
+                self._cache.move_to_end(key)
+                return cached[1]
+
+        response = handler(params, **args)
+        with self._lock:
+            self._cache[key] = (revision, response)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+        return response
+
+    def _period(self, params):
+        period = params.get('period', '1y')
+        if period not in PERIOD_ORDER:
+            raise ApiError(400, f"Período inválido: {period} (use {', '.join(PERIOD_ORDER)})")
+        return period
+
+    def _int_param(self, params, name, default):
+        try:
+            value = int(params.get(name, default))
+        except ValueError:
+            raise ApiError(400, f"Parâmetro {name} deve ser inteiro")
+        if value < 0:
+            raise ApiError(400, f"Parâmetro {name} deve ser positivo")
+        return value
+
+    def _revision(self, name, args, params):
+        """Versão dos dados de que a rota depende (o cache é descartado quando ela muda)"""
+        if name == 'rankings':
+            return self.store.revision(args['universe'], params.get('period', '1y'))
+        if name == 'health':
+            return time.time()
+        # Rotas que olham todos os universos: só stat dos diretórios, sem ler os snapshots
+        try:
+            universes = sorted(os.listdir(self.store.base_dir))
+        except OSError:
+            return ()
+        return tuple((u, p, self.store.revision(u, p)) for u in universes for p in PERIOD_ORDER)
+
+    def _ranking(self, universe, period, date=None):
+        """Ranking do dia lido do snapshot (LRU memoizado por versão do diretório).
+
+        date deve ser uma data com snapshot (rankings() valida a data pedida pelo cliente).
+        """
+        key = (universe, period, date)
+        revision = self.store.revision(universe, period)
+        with self._lock:
+            cached = self._rankings.get(key)
+            if cached is not None and cached[0] == revision:
+                self._rankings.move_to_end(key)
+                return cached[1], cached[2]
+        snapshot_date, frame = self.store.ranking(universe, period, date)
+        # Colunas float32 do snapshot: arredondar evita ruído de precisão no JSON
+        frame = frame.round({'price': 2, 'change': 2, 'volatility': 2})
+        with self._lock:
+            self._rankings[key] = (revision, snapshot_date, frame)
+            self._rankings.move_to_end(key)
+            while len(self._rankings) > self.ranking_entries:
+                self._rankings.popitem(last=False)
+        return snapshot_date, frame
+
+    def rankings(self, params, universe):
+        period = self._period(params)
+        limit = self._int_param(params, 'limit', 0)
+        date = params.get('date')
+        if date is not None:
+            try:
+                date = pd.Timestamp(date)
+            except ValueError:
+                raise ApiError(400, f"Data inválida: {date}")
+            if date not in self.store.dates(universe, period):
+                raise ApiError(404, f"Sem snapshot para {universe} ({period}) em {date:%Y-%m-%d}")
+
+        snapshot_date, frame = self._ranking(universe, period, date)
+        if frame.empty:
+            raise ApiError(404, f"Sem snapshot para {universe} ({period})")
+        if limit:
+            frame = frame.head(limit)
+        return Response(200, {
+            'universe': universe,
+            'period': period,
+            'date': f"{snapshot_date:%Y-%m-%d}",
+            'count': len(frame),
+            'rankings': _records(frame),
+        }, last_modified=self.store.revision(universe, period) / 1e9)
+
+    def symbol_metrics(self, params, ticker):
+        period = self._period(params)
+        days = self._int_param(params, 'days', DEFAULT_TREND_DAYS)
+        symbol = ticker.upper().replace('.SA', '')
+
+        universes = {}
+        last_modified = None
+        for universe, periods in self.store.universes().items():
+            if period not in periods:
+                continue
+            snapshot_date, frame = self._ranking(universe, period)
+            rows = frame[frame['symbol'] == symbol]
+            if rows.empty:
+                continue
+            row = _records(rows.head(1))[0]
+            row.pop('symbol')
+            trend = self.store.score_trend(universe, period, symbol + '.SA', days=days) if days else pd.Series(dtype=float)
+            universes[universe] = dict(
+                row, date=f"{snapshot_date:%Y-%m-%d}", of=len(frame),
+                trend=[{'date': f"{d:%Y-%m-%d}", 'score': _clean(float(v))} for d, v in trend.items()],
+            )
+            modified = self.store.revision(universe, period) / 1e9
+            last_modified = max(last_modified or 0, modified)
+
+        if not universes:
+            raise ApiError(404, f"Ativo {symbol} não encontrado nos snapshots ({period})")
+        return Response(200, {'symbol': symbol, 'period': period, 'universes': universes},
+                        last_modified=last_modified)
+
+    def universes(self, params):
+        universes = self.store.universes()
+        return Response(200, {
+            universe: {period: f"{self.store.dates(universe, period)[-1]:%Y-%m-%d}" for period in periods}
+            for universe, periods in universes.items()
+        })
+
+    def health(self, params):
+        return Response(200, {'status': 'ok'})
+
+class ApiHandler(BaseHTTPRequestHandler):
+    """Handler HTTP/1.1 (keep-alive) com gzip e respostas condicionais (304)"""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'InvestimentosAPI/1.0'
+    # Cabeçalhos e corpo saem numa única escrita (flush ao fim de cada requisição): sem isso o
+    # Nagle + ACK atrasado do keep-alive somam ~40 ms por resposta
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def _serve(self, send_body):
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            response = self.server.api.get(url.path, params)
+        except ApiError as e:
+            response = Response(e.status, {'error': str(e)})
+        except Exception as e:
+            response = Response(500, {'error': f"Erro interno: {str(e)}"})
+
+        use_gzip = response.gzip_body is not None and 'gzip' in self.headers.get('Accept-Encoding', '')
+        etag = response.gzip_etag if use_gzip else response.etag
+        if response.status == 200 and self._not_modified(response, etag):
+            self.send_response(304)
+            self.send_header('Vary', 'Accept-Encoding')
+            self._validator_headers(response, etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = response.gzip_body if use_gzip else response.body
+
+        self.send_response(response.status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Vary', 'Accept-Encoding')
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        if response.status == 200:
+            self._validator_headers(response, etag)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def _validator_headers(self, response, etag):
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', f'public, max-age={API_MAX_AGE}')
+        if response.last_modified:
+            self.send_header('Last-Modified', formatdate(response.last_modified, usegmt=True))
+
+    def _not_modified(self, response, etag):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            tags = [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+            return '*' in tags or etag in tags
+
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since and response.last_modified:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(response.last_modified) <= since
+        return False
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+def create_server(host='127.0.0.1', port=8502, snapshot_dir=SNAPSHOT_DIR, verbose=False):
+    """Servidor HTTP multithread pronto para serve_forever()"""
+    server = ThreadingHTTPServer((host, port), ApiHandler)
+    server.daemon_threads = True
+    server.api = RankingApi(RankingSnapshotStore(snapshot_dir))
+    server.verbose = verbose
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="API HTTP de rankings e métricas pré-calculados")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8502)
+    parser.add_argument('--snapshot-dir', default=SNAPSHOT_DIR)
+    parser.add_argument('--verbose', action='store_true', help="registra cada requisição")
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, args.snapshot_dir, args.verbose)
+    print(f"API em http://{args.host}:{args.port} (snapshots em {args.snapshot_dir})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
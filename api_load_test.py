@@ -0,0 +1,151 @@
+"""Teste de carga da API (api.py) com um provedor de dados fixo, sem rede.
+
+Gera snapshots sintéticos pelo mesmo caminho do app (CompactHistory, compute_score_history
+e RankingSnapshotStore), sobe a API em uma porta local e dispara requisições concorrentes
+com conexões keep-alive, medindo vazão e latência.
+
+Uso:
+    python api_load_test.py --clients 8 --requests 2000 [--revalidate] [--no-gzip]
+"""
+import os
+
+os.environ.setdefault('STREAMLIT_LOGGER_LEVEL', 'error')
+
+import argparse
+import http.client
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import api
+from app import CompactHistory, compute_score_history, FII_FETCH_PERIOD
+from ranking_store import RankingSnapshotStore
+
+FIXTURE_DAYS = 1300
+FIXTURE_UNIVERSES = {
+    'ibovespa': (['PETR4', 'VALE3', 'ITUB4', 'BBDC4', 'ABEV3', 'WEGE3', 'RENT3', 'LREN3', 'B3SA3',
+                  'SUZB3', 'GGBR4', 'BBAS3', 'ELET3', 'CSNA3', 'RADL3', 'EQTL3', 'PRIO3', 'VIVT3'], "default"),
+    'b3': ([f'B3X{i:03d}' for i in range(400)], "default"),
+    'fiis': ([f'FII{i:03d}11' for i in range(117)], "fii"),
+    'agro': ([f'AGR{i:02d}11' for i in range(20)], "fii"),
+}
+
+class FixtureProvider:
+    """Provedor determinístico no formato do yfinance (history/info) para testes sem rede"""
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+
+    def history(self, period='5y', timeout=10):
+        rng = np.random.default_rng(sum(map(ord, self.symbol)))
+        index = pd.bdate_range(end='2026-10-16', periods=FIXTURE_DAYS, tz='America/Sao_Paulo')
+        close = 50 * np.exp(np.cumsum(rng.normal(0.0003, 0.015, FIXTURE_DAYS)))
+        dividends = np.zeros(FIXTURE_DAYS)
+        if self.symbol.endswith('11.SA'):
+            month_start = ~pd.Series(index.to_period('M')).duplicated().to_numpy()
+            dividends[month_start] = close[month_start] * 0.008
+        return pd.DataFrame({
+            'Open': close, 'High': close, 'Low': close, 'Close': close,
+            'Volume': rng.integers(10_000, 2_000_000, FIXTURE_DAYS).astype(float),
+            'Dividends': dividends, 'Stock Splits': 0.0,
+        }, index=index)
+
+    @property
+    def info(self):
+        return {'trailingPE': 14.0, 'bookValue': 45.0}
+
+def build_fixture_store(directory, period='1y', days=90):
+    """Grava snapshots dos universos de teste e devolve o armazenamento"""
+    store = RankingSnapshotStore(directory)
+    for universe, (symbols, score_model) in FIXTURE_UNIVERSES.items():
+        data = {}
+        for symbol in symbols:
+            provider = FixtureProvider(symbol + '.SA')
+            record = CompactHistory.from_history(provider.history(FII_FETCH_PERIOD), provider.info)
+            data[symbol + '.SA'] = record.to_stock_data()
+        store.save_history(universe, period, compute_score_history(data, period, score_model), days)
+    return store
+
+def fixture_paths():
+    """Mistura de requisições: rankings completos e paginados, métricas por ativo e índice"""
+    paths = ['/rankings/ibovespa?period=1y', '/rankings/b3?period=1y', '/rankings/b3?period=1y&limit=50',
+             '/rankings/fiis?period=1y&limit=20', '/rankings/agro?period=1y', '/universes']
+    paths += [f'/symbol/{symbol}/metrics?period=1y' for symbol in FIXTURE_UNIVERSES['ibovespa'][0]]
+    return paths
+
+def run_client(host, port, paths, requests, use_gzip, revalidate, results, seed):
+    """Um cliente keep-alive: envia requisições em sequência e registra status e latência"""
+    rng = np.random.default_rng(seed)
+    connection = http.client.HTTPConnection(host, port, timeout=10)
+    etags = {}
+    latencies = np.empty(requests)
+    statuses = {}
+    received = 0
+    for i in range(requests):
+        path = paths[rng.integers(len(paths))]
+        headers = {'Accept-Encoding': 'gzip'} if use_gzip else {}
+        if revalidate and path in etags:
+            headers['If-None-Match'] = etags[path]
+
+        start = time.perf_counter()
+        connection.request('GET', path, headers=headers)
+        response = connection.getresponse()
+        body = response.read()
+        latencies[i] = time.perf_counter() - start
+
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+        received += len(body)
+        if response.getheader('ETag'):
+            etags[path] = response.getheader('ETag')
+    connection.close()
+    results.append((latencies, statuses, received))
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga da API com dados fixos")
+    parser.add_argument('--clients', type=int, default=8, help="conexões simultâneas")
+    parser.add_argument('--requests', type=int, default=2000, help="requisições por cliente")
+    parser.add_argument('--revalidate', action='store_true', help="envia If-None-Match (respostas 304)")
+    parser.add_argument('--no-gzip', action='store_true', help="não pede compressão gzip")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        build_fixture_store(directory)
+        print(f"Snapshots de teste gerados em {time.perf_counter() - start:.1f}s")
+
+        server = api.create_server(port=0, snapshot_dir=directory)
+        host, port = server.server_address
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        paths = fixture_paths()
+        results = []
+        clients = [threading.Thread(target=run_client,
+                                    args=(host, port, paths, args.requests, not args.no_gzip,
+                                          args.revalidate, results, seed))
+                   for seed in range(args.clients)]
+        start = time.perf_counter()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = time.perf_counter() - start
+        server.shutdown()
+        server.server_close()
+
+    latencies = np.concatenate([r[0] for r in results]) * 1000
+    statuses = {}
+    for _, client_statuses, _ in results:
+        for status, count in client_statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+    received = sum(r[2] for r in results)
+
+    print(f"{len(latencies)} requisições em {elapsed:.2f}s: {len(latencies) / elapsed:.0f} req/s")
+    print(f"Latência (ms): p50 {np.percentile(latencies, 50):.2f} | p95 {np.percentile(latencies, 95):.2f} "
+          f"| p99 {np.percentile(latencies, 99):.2f}")
+    print(f"Status: {dict(sorted(statuses.items()))} | {received / 1024 ** 2:.1f} MB recebidos")
+
+if __name__ == "__main__":
+    main()
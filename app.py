@@ -1,14 +1,53 @@
 import streamlit as st
-import yfinance as yf
 import pandas as pd
 import numpy as np
-import plotly.graph_objects as go
-import plotly.express as px
-from plotly.subplots import make_subplots
 import warnings
 warnings.filterwarnings('ignore')
 from datetime import datetime, timedelta
 import time
+import os
+import importlib
+import threading
+import uuid
+import hashlib
+import json
+import re
+from collections import OrderedDict, deque
+from email.utils import parsedate_to_datetime
+from contextlib import contextmanager
+from typing import NamedTuple
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+import tempfile
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos (uso local com um único servidor)
+    fcntl = None
+
+from ranking_store import PERIOD_ORDER, RankingSnapshotStore
+
+# Bibliotecas de rede e de gráficos só carregam no primeiro uso: a primeira renderização
+# da página não espera por elas (LAZY_IMPORTS=0 volta a importar tudo na partida)
+LAZY_IMPORTS = os.environ.get('LAZY_IMPORTS', '1') != '0'
+
+class LazyModule:
+    """Módulo importado no primeiro acesso a um atributo"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+def lazy_import(name):
+    """Módulo sob demanda (ou imediato com LAZY_IMPORTS=0)"""
+    return LazyModule(name) if LAZY_IMPORTS else importlib.import_module(name)
+
+yf = lazy_import('yfinance')
+go = lazy_import('plotly.graph_objects')
 
 # Configuração da página
 st.set_page_config(
@@ -63,457 +102,3672 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-class InvestmentAnalyzer:
+# Benchmarks usados nas métricas de risco ajustado
+BENCHMARK_SYMBOL = '^BVSP'
+CDI_CSV_PATH = os.environ.get(
+    'CDI_CSV_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'cdi.csv')
+)
+DEFAULT_CDI_ANUAL = 10.5  # % a.a., usado quando não há arquivo local do CDI
+TRADING_DAYS = 252
+
+def to_daily_index(index):
+    """Normaliza um DatetimeIndex (com ou sem fuso) para datas sem horário"""
+    index = pd.DatetimeIndex(index)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    return index.normalize()
+
+def build_close_matrix(data, field='Close'):
+    """Monta a matriz (datas x ativos) de fechamentos (ou outro campo) alinhados pelo calendário"""
+    closes = {}
+    for symbol, stock_data in data.items():
+        close = stock_data['history'][field]
+        close = pd.Series(close.values, index=to_daily_index(close.index))
+        closes[symbol] = close[~close.index.duplicated(keep='last')]
+
+    if not closes:
+        return pd.DataFrame()
+    return pd.DataFrame(closes).sort_index()
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def fetch_benchmark_history(period="1y"):
+    """Baixa o histórico do Ibovespa uma única vez por período (cache compartilhado).
+
+    Falhas levantam exceção, que o cache não guarda: a próxima chamada tenta de novo.
+    """
+    hist = yf.Ticker(BENCHMARK_SYMBOL, session=provider_session()).history(period=period, timeout=10)
+    if hist.empty:
+        raise ValueError(f"Sem dados para {BENCHMARK_SYMBOL}")
+
+    close = hist['Close'].copy()
+    close.index = to_daily_index(close.index)
+    close.name = BENCHMARK_SYMBOL
+    return close[~close.index.duplicated(keep='last')]
+
+def load_benchmark_history(period="1y"):
+    """Histórico do Ibovespa, ou série vazia se o provedor falhar (sem guardar a falha no cache)"""
+    try:
+        return fetch_benchmark_history(period)
+    except Exception:
+        return pd.Series(dtype=float, name=BENCHMARK_SYMBOL)
+
+@st.cache_data(show_spinner=False)
+def load_cdi_series(path, mtime):
+    """Lê a série diária do CDI (% a.d.) exportada do SGS/BCB (série 12).
+
+    O parâmetro mtime entra apenas na chave do cache, para recarregar o arquivo quando ele mudar.
+    """
+    raw = pd.read_csv(path, sep=';', decimal=',')
+    raw.columns = [str(col).strip().strip('"').lower() for col in raw.columns]
+    dates = pd.to_datetime(raw['data'], dayfirst=True, errors='coerce')
+    values = pd.to_numeric(raw['valor'], errors='coerce') / 100
+    cdi = pd.Series(values.values, index=dates, name='CDI').dropna()
+    cdi = cdi[cdi.index.notna()].sort_index()
+    return cdi[~cdi.index.duplicated(keep='last')]
+
+def calculate_risk_metrics(closes, benchmark_close, risk_free_daily):
+    """Calcula beta, alfa, Sharpe, Sortino e tracking error para todos os ativos de uma vez.
+
+    closes: DataFrame (datas x ativos) de preços de fechamento alinhados.
+    benchmark_close: Series com o fechamento do benchmark (Ibovespa).
+    risk_free_daily: Series com a taxa livre de risco diária (CDI) em fração.
+    """
+    columns = ['Beta', 'Alfa (%)', 'Sharpe', 'Sortino', 'Tracking Error (%)']
+    if closes.empty or benchmark_close is None or benchmark_close.empty:
+        return pd.DataFrame(np.nan, index=closes.columns, columns=columns)
+
+    # Alinhar ativos, benchmark e CDI no mesmo calendário
+    index = closes.index
+    asset_returns = closes.pct_change(fill_method=None).to_numpy(dtype=float)
+    bench_returns = benchmark_close.reindex(index).ffill().pct_change(fill_method=None).to_numpy(dtype=float)
+    rf = risk_free_daily.reindex(index).ffill().fillna(0.0).to_numpy(dtype=float)
+
+    excess = asset_returns - rf[:, None]
+    bench_excess = (bench_returns - rf)[:, None]
+
+    # Máscara de observações válidas por ativo (ativos com históricos de tamanhos diferentes)
+    valid = ~np.isnan(excess) & ~np.isnan(bench_excess)
+    n = valid.sum(axis=0).astype(float)
+    n[n < 2] = np.nan
+
+    r = np.where(valid, excess, 0.0)
+    b = np.where(valid, bench_excess, 0.0)
+    mean_r = r.sum(axis=0) / n
+    mean_b = b.sum(axis=0) / n
+
+    dr = np.where(valid, r - mean_r, 0.0)
+    db = np.where(valid, b - mean_b, 0.0)
+    cov_rb = (dr * db).sum(axis=0) / (n - 1)
+    var_b = (db ** 2).sum(axis=0) / (n - 1)
+    var_r = (dr ** 2).sum(axis=0) / (n - 1)
+
+    active = np.where(valid, r - b, 0.0)
+    mean_active = active.sum(axis=0) / n
+    var_active = (np.where(valid, active - mean_active, 0.0) ** 2).sum(axis=0) / (n - 1)
+    downside = np.sqrt((np.minimum(r, 0.0) ** 2).sum(axis=0) / n)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        beta = cov_rb / var_b
+        alpha = (mean_r - beta * mean_b) * TRADING_DAYS * 100
+        sharpe = mean_r / np.sqrt(var_r) * np.sqrt(TRADING_DAYS)
+        sortino = mean_r / downside * np.sqrt(TRADING_DAYS)
+        tracking_error = np.sqrt(var_active) * np.sqrt(TRADING_DAYS) * 100
+
+    result = pd.DataFrame(
+        np.column_stack([beta, alpha, sharpe, sortino, tracking_error]),
+        index=closes.columns, columns=columns
+    )
+    return result.replace([np.inf, -np.inf], np.nan)
+
+PERIOD_OFFSETS = {
+    '6mo': pd.DateOffset(months=6),
+    '1y': pd.DateOffset(years=1),
+    '2y': pd.DateOffset(years=2),
+    '5y': pd.DateOffset(years=5),
+}
+# FIIs são baixados uma única vez no maior período: trocar o período não gera novos downloads
+FII_FETCH_PERIOD = '5y'
+
+# Calendário compartilhado: cada pregão é a sua posição em dias úteis desde uma data-base fixa,
+# então todos os ativos usam o mesmo índice sem precisar remapear quando chegam novas datas
+CALENDAR_EPOCH = np.datetime64('2000-01-03', 'D')
+
+def calendar_positions(index):
+    """Posições (int32) das datas no calendário compartilhado de dias úteis"""
+    if not isinstance(index, pd.DatetimeIndex):
+        index = pd.DatetimeIndex(index)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    # Truncar para dias equivale ao normalize(), sem a inferência de frequência do pandas
+    days = index.values.astype('datetime64[D]')
+    return np.busday_count(CALENDAR_EPOCH, days).astype(np.int32)
+
+def calendar_dates(positions):
+    """Datas (sem horário) correspondentes às posições do calendário compartilhado"""
+    return pd.DatetimeIndex(np.busday_offset(CALENDAR_EPOCH, positions).astype('datetime64[ns]'))
+
+class Fundamentals(NamedTuple):
+    """Fundamentos usados nas análises (no lugar do dict info completo do provedor)"""
+    trailing_pe: float = np.nan
+    book_value: float = np.nan
+    price_to_book: float = np.nan
+
+    @classmethod
+    def from_info(cls, info):
+        info = info or {}
+        return cls(_positive_number(info.get('trailingPE')),
+                   _positive_number(info.get('bookValue')),
+                   _positive_number(info.get('priceToBook')))
+
+class CompactHistory:
+    """Histórico de um ativo guardado no cache em arrays tipados.
+
+    Mantém só as colunas usadas (fechamento float32, volume int64, proventos e desdobramentos
+    esparsos) sobre o calendário compartilhado, mais os fundamentos tipados. O registro completo
+    (DataFrame e métricas) é montado sob demanda por to_stock_data.
+    """
+
+    __slots__ = ('positions', 'close', 'volume', 'dividend_positions', 'dividend_values',
+                 'split_positions', 'split_ratios', 'fundamentals')
+
+    def __init__(self, positions, close, volume, dividend_positions, dividend_values,
+                 split_positions, split_ratios, fundamentals):
+        self.positions = positions
+        self.close = close
+        self.volume = volume
+        self.dividend_positions = dividend_positions
+        self.dividend_values = dividend_values
+        self.split_positions = split_positions
+        self.split_ratios = split_ratios
+        self.fundamentals = fundamentals
+
+    @classmethod
+    def from_history(cls, hist, info):
+        """Registro compacto a partir do histórico e do info baixados do provedor"""
+        hist = hist[~to_daily_index(hist.index).duplicated(keep='last')]
+        positions = calendar_positions(hist.index)
+        if 'Dividends' in hist:
+            dividends = hist['Dividends'].to_numpy(dtype=float)
+        else:
+            dividends = np.zeros(len(hist))
+        paid = dividends > 0
+        # Desdobramentos informados pelo provedor (0 nos pregões sem evento)
+        if 'Stock Splits' in hist:
+            ratios = np.nan_to_num(hist['Stock Splits'].to_numpy(dtype=float))
+        else:
+            ratios = np.zeros(len(hist))
+        split = (ratios > 0) & (ratios != 1)
+        return cls(
+            positions,
+            hist['Close'].to_numpy(dtype=np.float32),
+            np.nan_to_num(hist['Volume'].to_numpy(dtype=float)).astype(np.int64),
+            positions[paid],
+            dividends[paid].astype(np.float32),
+            positions[split],
+            ratios[split].astype(np.float32),
+            Fundamentals.from_info(info),
+        )
+
+    @property
+    def nbytes(self):
+        """Memória própria dos arrays do registro (fatias de matrizes mapeadas não contam)"""
+        return sum(getattr(self, name).nbytes for name in self.__slots__[:-1]
+                   if not isinstance(getattr(self, name), np.memmap))
+
+    def to_stock_data(self, period=None):
+        """Registro completo do ativo, recortado para o período pedido (None se curto demais)"""
+        positions, close, volume = self.positions, self.close, self.volume
+        # Registros vindos da matriz compartilhada têm NaN nos pregões sem negócio
+        traded = ~np.isnan(close)
+        if not traded.all():
+            positions, close, volume = positions[traded], close[traded], volume[traded]
+        if len(positions) == 0:
+            return None
+
+        dates = calendar_dates(positions)
+        first = 0
+        if period is not None:
+            first = dates.searchsorted(dates[-1] - PERIOD_OFFSETS[period])
+        if len(dates) - first <= 5:
+            return None
+
+        positions = positions[first:]
+        dividends = np.zeros(len(positions))
+        in_window = (self.dividend_positions >= positions[0]) & np.isin(self.dividend_positions, positions)
+        dividends[np.searchsorted(positions, self.dividend_positions[in_window])] = self.dividend_values[in_window]
+        close = close[first:].astype(float)
+        volume = volume[first:]
+        hist = pd.DataFrame({'Close': close, 'Volume': volume, 'Dividends': dividends}, index=dates[first:])
+
+        returns = close[1:] / close[:-1] - 1
+        return {
+            'history': hist,
+            'fundamentals': self.fundamentals,
+            # Proventos mantêm o histórico completo para o DY de 12 meses mesmo em períodos curtos
+            'dividends': pd.Series(np.asarray(self.dividend_values, dtype=float),
+                                   index=calendar_dates(self.dividend_positions)),
+            'splits': pd.Series(np.asarray(self.split_ratios, dtype=float),
+                                index=calendar_dates(self.split_positions)),
+            'current_price': close[-1],
+            'price_change': (close[-1] / close[0] - 1) * 100,
+            'volatility': np.nanstd(returns, ddof=1) * np.sqrt(252) * 100,
+            'volume_avg': volume.mean(),
+        }
+
+# Etapa de qualidade dos dados entre a coleta e calculate_metrics
+QUALITY_MAX_GAP = 10            # pregões seguidos sem cotação dentro do histórico do ativo
+QUALITY_MAX_STALE = 10          # pregões seguidos com o mesmo fechamento
+QUALITY_MAX_ZERO_VOLUME = 10    # pregões seguidos sem negócios
+QUALITY_MAX_LAG = 5             # pregões de atraso da última cotação em relação ao universo
+QUALITY_OUTLIER_Z = 10.0        # retorno atípico: acima de 10x a escala robusta do ativo...
+QUALITY_OUTLIER_MIN = 0.2       # ...e variação de mais de 20% no pregão
+QUALITY_SPIKE_REVERSAL = 0.05   # pico desfeito no pregão seguinte (até 5%) é erro de cotação
+QUALITY_SPLIT_FACTORS = np.log([2, 3, 4, 5, 8, 10, 20, 50, 100])
+QUALITY_SPLIT_TOLERANCE = 0.03  # distância (em log) entre o salto e o fator de desdobramento
+QUALITY_SPLIT_WINDOW = 3        # pregões entre o salto e o desdobramento informado pelo provedor
+QUALITY_MAX_DIVIDEND_YIELD = 0.3  # provento acima de 30% do preço é inconsistente
+
+def _longest_runs(mask):
+    """Maior sequência de True em cada coluna de uma matriz booleana"""
+    if len(mask) == 0:
+        return np.zeros(mask.shape[1], dtype=int)
+    counts = np.cumsum(mask, axis=0)
+    resets = np.maximum.accumulate(np.where(mask, 0, counts), axis=0)
+    return (counts - resets).max(axis=0)
+
+def validate_stock_data(data):
+    """Valida os históricos de uma vez sobre a matriz (pregões x ativos) alinhada.
+
+    Verifica lacunas, preços parados, sequências sem negócios, atraso da última cotação,
+    retornos atípicos e a consistência de desdobramentos e proventos. Cotações isoladas
+    desfeitas no pregão seguinte são descartadas, desdobramentos/grupamentos não refletidos
+    no histórico são ajustados para trás (só com evento do provedor próximo ao salto; sem
+    ele o salto é uma queda ou alta real e fica em alerta) e proventos incompatíveis com o
+    preço são removidos; ativos com dados inutilizáveis saem da análise.
+    Retorna (dados validados, DataFrame de flags por ativo).
+    """
+    symbols = list(data)
+    if not symbols:
+        return data, pd.DataFrame()
+
+    # Matriz sobre o calendário compartilhado: cada ativo ocupa uma coluna
+    positions = [calendar_positions(data[symbol]['history'].index) for symbol in symbols]
+    start = min(int(p[0]) for p in positions)
+    rows = max(int(p[-1]) for p in positions) - start + 1
+    close = np.full((rows, len(symbols)), np.nan)
+    volume = np.zeros((rows, len(symbols)))
+    dividends = np.zeros((rows, len(symbols)))
+    split_events = []
+    for j, (symbol, pos) in enumerate(zip(symbols, positions)):
+        split_events.append(calendar_positions(data[symbol]['splits'].index))
+        hist = data[symbol]['history']
+        # Uma conversão por ativo: acessar coluna a coluna custa mais que a validação inteira
+        values = hist.to_numpy(dtype=float)
+        columns = list(hist.columns)
+        close[pos - start, j] = values[:, columns.index('Close')]
+        volume[pos - start, j] = values[:, columns.index('Volume')]
+        if 'Dividends' in columns:
+            dividends[pos - start, j] = values[:, columns.index('Dividends')]
+
+    # Pregões sem nenhuma cotação no universo (feriados) saem do calendário
+    active = ~np.isnan(close).all(axis=1)
+    calendar = np.flatnonzero(active) + start
+    close, volume, dividends = close[active], volume[active], dividends[active]
+    valid = ~np.isnan(close)
+    row_index = np.arange(len(close))
+
+    # Lacunas: pregões do universo sem cotação entre a primeira e a última do ativo
+    started = np.cumsum(valid, axis=0) > 0
+    pending = np.cumsum(valid[::-1], axis=0)[::-1] > 0
+    max_gap = _longest_runs(started & pending & ~valid)
+    lag = np.argmax(valid[::-1], axis=0)
+
+    # Retornos em log sobre o último fechamento conhecido (lacunas não quebram a série)
+    filled = close[np.maximum.accumulate(np.where(valid, row_index[:, None], 0), axis=0),
+                   np.arange(len(symbols))]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_returns = np.diff(np.log(filled), axis=0)
+    log_returns[~np.isfinite(log_returns)] = np.nan
+    traded = valid[1:] & ~np.isnan(log_returns)
+
+    max_stale = _longest_runs(traded & (log_returns == 0))
+    max_zero_volume = _longest_runs(valid & (volume <= 0))
+
+    # Retornos atípicos: escala robusta por ativo (mediana do retorno absoluto, centrado em
+    # zero) tirada de uma única ordenação da matriz, com piso absoluto para ativos pouco voláteis
+    deviation = np.where(traded, np.abs(log_returns), np.nan)
+    ordered = np.sort(deviation, axis=0)
+    counts = np.maximum(traded.sum(axis=0), 1)
+    columns = np.arange(len(symbols))
+    scale = (ordered[(counts - 1) // 2, columns] + ordered[counts // 2, columns]) / 2 * 1.4826
+    with np.errstate(invalid='ignore'):
+        outlier = traded & (deviation > QUALITY_OUTLIER_Z * scale) & (deviation > np.log1p(QUALITY_OUTLIER_MIN))
+
+    # Pico desfeito no pregão seguinte: a cotação do meio é um erro do provedor
+    next_returns = np.vstack([log_returns[1:], np.full((1, len(symbols)), np.nan)])
+    next_outlier = np.vstack([outlier[1:], np.zeros((1, len(symbols)), dtype=bool)])
+    spike = outlier & next_outlier & (np.abs(log_returns + next_returns) < np.log1p(QUALITY_SPIKE_REVERSAL))
+    reversal = np.vstack([np.zeros((1, len(symbols)), dtype=bool), spike[:-1]])
+
+    # Desdobramentos informados pelo provedor, no retorno do pregão em que passam a valer
+    events = np.zeros_like(log_returns, dtype=bool)
+    for j, event_positions in enumerate(split_events):
+        event_rows = np.searchsorted(calendar, event_positions) - 1
+        events[event_rows[(event_rows >= 0) & (event_rows < len(events))], j] = True
+    event_counts = np.vstack([np.zeros((1, len(symbols)), dtype=int), np.cumsum(events, axis=0)])
+
+    # Desdobramento/grupamento não ajustado: salto persistente que casa com um fator usual e
+    # com um evento do provedor próximo; sem o evento, quedas como -50% ou -90% são reais
+    split = np.zeros_like(outlier)
+    rows_out, cols_out = np.nonzero(outlier & ~spike & ~reversal)
+    jumps_signed = log_returns[rows_out, cols_out]
+    jumps = np.abs(jumps_signed)
+    factor_match = np.abs(jumps[:, None] - QUALITY_SPLIT_FACTORS).min(axis=1) < QUALITY_SPLIT_TOLERANCE
+    near_event = (event_counts[np.minimum(rows_out + QUALITY_SPLIT_WINDOW + 1, len(events)), cols_out]
+                  - event_counts[np.maximum(rows_out - QUALITY_SPLIT_WINDOW, 0), cols_out]) > 0
+    matched = factor_match & near_event
+    split[rows_out[matched], cols_out[matched]] = True
+    unconfirmed = np.zeros(len(symbols), dtype=int)
+    np.add.at(unconfirmed, cols_out[factor_match & ~near_event], 1)
+    remaining = outlier & ~spike & ~reversal & ~split
+
+    # Fator de ajuste de cada pregão: produto dos saltos dos desdobramentos posteriores
+    # O salto do pregão mistura o fator com o retorno do dia: ajusta-se só pelo fator casado
+    factors = QUALITY_SPLIT_FACTORS[np.abs(jumps[matched, None] - QUALITY_SPLIT_FACTORS).argmin(axis=1)]
+    steps = np.ones_like(log_returns)
+    steps[rows_out[matched], cols_out[matched]] = np.exp(np.copysign(factors, jumps_signed[matched]))
+    adjustment = np.vstack([np.cumprod(steps[::-1], axis=0)[::-1], np.ones((1, len(symbols)))])
+    adjusted_close = close * adjustment
+    adjusted_close[1:][spike] = np.nan
+    adjusted_dividends = dividends * adjustment
+
+    # Proventos incompatíveis com o preço (tipicamente não ajustados por desdobramento)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inconsistent = adjusted_dividends > QUALITY_MAX_DIVIDEND_YIELD * filled * adjustment
+    adjusted_dividends[inconsistent] = 0.0
+
+    excluded = ((max_gap > QUALITY_MAX_GAP) | (max_stale >= QUALITY_MAX_STALE)
+                | (max_zero_volume >= QUALITY_MAX_ZERO_VOLUME) | (lag > QUALITY_MAX_LAG))
+    splits = split.sum(axis=0)
+    spikes = spike.sum(axis=0)
+    dropped_dividends = inconsistent.sum(axis=0)
+    adjusted = ~excluded & ((splits > 0) | (spikes > 0) | (dropped_dividends > 0))
+
+    reasons = []
+    for j in range(len(symbols)):
+        reason = []
+        if max_gap[j] > QUALITY_MAX_GAP:
+            reason.append(f"lacuna de {max_gap[j]} pregões")
+        if max_stale[j] >= QUALITY_MAX_STALE:
+            reason.append(f"preço parado por {max_stale[j]} pregões")
+        if max_zero_volume[j] >= QUALITY_MAX_ZERO_VOLUME:
+            reason.append(f"{max_zero_volume[j]} pregões sem negócios")
+        if lag[j] > QUALITY_MAX_LAG:
+            reason.append(f"última cotação {lag[j]} pregões atrás")
+        if unconfirmed[j] and not excluded[j]:
+            reason.append(f"{unconfirmed[j]} salto(s) do tamanho de um desdobramento sem evento do provedor "
+                          f"(preços mantidos)")
+        reasons.append(", ".join(reason))
+
+    status = np.where(excluded, "Excluído", np.where(adjusted, "Ajustado",
+                      np.where(remaining.any(axis=0), "Alerta", "OK")))
+    flags = pd.DataFrame({
+        'Status': status,
+        'Maior Lacuna': max_gap,
+        'Preço Parado': max_stale,
+        'Sem Negócios': max_zero_volume,
+        'Atraso': lag,
+        'Retornos Atípicos': remaining.sum(axis=0),
+        'Cotações Descartadas': spikes,
+        'Desdobramentos Ajustados': splits,
+        'Proventos Removidos': dropped_dividends,
+        'Motivo': reasons,
+    }, index=pd.Index(symbols, name='Ativo'))
+
+    validated = {}
+    for j, symbol in enumerate(symbols):
+        if excluded[j]:
+            continue
+        if not adjusted[j]:
+            validated[symbol] = data[symbol]
+            continue
+        # Só os ativos ajustados são remontados (mesmo caminho do cache compacto)
+        stock_data = data[symbol]
+        rows_j = valid[:, j]
+        paid = adjusted_dividends[:, j] > 0
+        # Proventos fora dos pregões da matriz (histórico completo do DY) seguem o mesmo ajuste
+        traded_positions = calendar[rows_j]
+        other_positions = calendar_positions(stock_data['dividends'].index)
+        outside = ~np.isin(other_positions, traded_positions)
+        factors = adjustment[rows_j, j][np.minimum(np.searchsorted(traded_positions, other_positions[outside]),
+                                                   len(traded_positions) - 1)]
+        dividend_positions = np.concatenate([other_positions[outside], calendar[paid]])
+        dividend_values = np.concatenate([stock_data['dividends'].to_numpy(dtype=float)[outside] * factors,
+                                          adjusted_dividends[paid, j]])
+        order = np.argsort(dividend_positions, kind='stable')
+        record = CompactHistory(
+            traded_positions.astype(np.int32),
+            adjusted_close[rows_j, j].astype(np.float32),
+            np.round(volume[rows_j, j] / adjustment[rows_j, j]).astype(np.int64),
+            dividend_positions[order].astype(np.int32), dividend_values[order].astype(np.float32),
+            split_events[j], stock_data['splits'].to_numpy(dtype=np.float32),
+            stock_data['fundamentals'])
+        rebuilt = record.to_stock_data()
+        if rebuilt is None:
+            flags.loc[symbol, 'Status'] = "Excluído"
+            flags.loc[symbol, 'Motivo'] = "histórico curto após os ajustes"
+            continue
+        validated[symbol] = rebuilt
+    return validated, flags
+
+# Matrizes de preços compartilhadas entre processos do servidor (e réplicas no mesmo disco)
+SHARED_MATRIX_DIR = os.environ.get(
+    'SHARED_MATRIX_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shared_prices')
+)
+# Réplicas somente leitura usam SHARED_MATRIX_PUBLISH=0 e apenas mapeiam o que outro processo publica
+SHARED_MATRIX_PUBLISH = os.environ.get('SHARED_MATRIX_PUBLISH', '1') != '0'
+SHARED_MATRIX_KEEP_VERSIONS = 3
+# Idade máxima (s) dos preços compartilhados: depois disso o ativo volta a ser baixado
+SHARED_MATRIX_MAX_AGE = int(os.environ.get('SHARED_MATRIX_MAX_AGE', '3600'))
+
+class SharedPriceMatrix:
+    """Matrizes (ativos x pregões) de fechamento, volume, proventos e desdobramentos em arquivos .npy mapeados.
+
+    Um escritor por vez (trava de arquivo) publica a versão N em v<N>/ e troca o arquivo
+    CURRENT com os.replace; os leitores mapeiam os arquivos somente leitura, sem cópia, e
+    passam para a nova versão na próxima leitura de CURRENT. Cada ativo ocupa uma linha
+    contígua, então o seu histórico é uma fatia direta do mapa (a matriz datas x ativos é
+    a transposta, também sem cópia). Cada linha guarda quando o ativo foi baixado: versões
+    e registros mais antigos que max_age são ignorados.
+    """
+
+    ARRAYS = ('positions', 'close', 'volume', 'dividends', 'splits', 'fundamentals', 'first', 'periods',
+              'fetched_at')
+
+    def __init__(self, base_dir=SHARED_MATRIX_DIR, max_age=SHARED_MATRIX_MAX_AGE):
+        self.base_dir = base_dir
+        self.max_age = max_age
+        self._loaded = None
+        self._lock = threading.Lock()
+
+    def _read_current(self):
+        try:
+            with open(os.path.join(self.base_dir, 'CURRENT'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _expired(self, timestamp):
+        return time.time() - timestamp > self.max_age
+
+    def snapshot(self):
+        """Versão publicada mais recente, mapeada somente leitura (None se não houver ou se vencida)"""
+        current = self._read_current()
+        if current is None or self._expired(current['published_at']):
+            return None
+        loaded = self._loaded
+        if loaded is not None and loaded['version'] == current['version']:
+            return loaded
+
+        directory = os.path.join(self.base_dir, f"v{current['version']}")
+        try:
+            arrays = {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+                      for name in self.ARRAYS}
+            with open(os.path.join(directory, 'symbols.json'), encoding='utf-8') as f:
+                symbols = json.load(f)
+        except (OSError, ValueError):
+            return loaded
+
+        loaded = dict(arrays, version=current['version'], published_at=current['published_at'],
+                      symbols={symbol: row for row, symbol in enumerate(symbols)})
+        self._loaded = loaded
+        return loaded
+
+    def record(self, snapshot, symbol, period=None):
+        """Registro do ativo como fatias do mapa (None se ausente, vencido ou baixado com período menor)"""
+        row = snapshot['symbols'].get(symbol)
+        if row is None or (period is not None and snapshot['periods'][row] < PERIOD_ORDER.index(period)):
+            return None
+        if self._expired(snapshot['fetched_at'][row]):
+            return None
+
+        first = int(snapshot['first'][row])
+        dividends = snapshot['dividends'][row, first:]
+        paid = np.flatnonzero(dividends > 0)
+        splits = snapshot['splits'][row, first:]
+        split = np.flatnonzero(splits > 0)
+        return CompactHistory(
+            snapshot['positions'][first:],
+            snapshot['close'][row, first:],
+            snapshot['volume'][row, first:],
+            snapshot['positions'][first:][paid],
+            np.asarray(dividends[paid]),
+            snapshot['positions'][first:][split],
+            np.asarray(splits[split]),
+            Fundamentals(*(float(v) for v in snapshot['fundamentals'][row])),
+        )
+
+    def published_period(self, snapshot, symbol):
+        """Período com que o ativo foi baixado por quem publicou (o registro cobre esse período)"""
+        return PERIOD_ORDER[snapshot['periods'][snapshot['symbols'][symbol]]]
+
+    @contextmanager
+    def _writer_lock(self):
+        os.makedirs(self.base_dir, exist_ok=True)
+        with self._lock, open(os.path.join(self.base_dir, 'publish.lock'), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def publish(self, records):
+        """Publica uma nova versão com os registros {símbolo: (CompactHistory, período baixado)}
+        mesclados aos ainda válidos da versão atual; devolve o número da versão publicada"""
+        with self._writer_lock():
+            current = self.snapshot()
+            now = time.time()
+            merged, fetched = {}, {}
+            if current is not None:
+                for symbol, row in current['symbols'].items():
+                    if symbol not in records:
+                        record = self.record(current, symbol)
+                        if record is not None:
+                            merged[symbol] = (record, PERIOD_ORDER[current['periods'][row]])
+                            fetched[symbol] = float(current['fetched_at'][row])
+            merged.update(records)
+            if not merged:
+                return None
+
+            positions = np.unique(np.concatenate([record.positions for record, _ in merged.values()]))
+            n = len(merged)
+            close = np.full((n, len(positions)), np.nan, dtype=np.float32)
+            volume = np.zeros((n, len(positions)), dtype=np.int64)
+            dividends = np.zeros((n, len(positions)), dtype=np.float32)
+            splits = np.zeros((n, len(positions)), dtype=np.float32)
+            fundamentals = np.empty((n, len(Fundamentals._fields)), dtype=float)
+            first = np.empty(n, dtype=np.int32)
+            periods = np.empty(n, dtype=np.int8)
+            fetched_at = np.array([fetched.get(symbol, now) for symbol in merged], dtype=float)
+
+            for row, (record, period) in enumerate(merged.values()):
+                columns = np.searchsorted(positions, record.positions)
+                close[row, columns] = record.close
+                volume[row, columns] = record.volume
+                dividends[row, np.searchsorted(positions, record.dividend_positions)] = record.dividend_values
+                splits[row, np.searchsorted(positions, record.split_positions)] = record.split_ratios
+                fundamentals[row] = record.fundamentals
+                first[row] = columns[0]
+                periods[row] = PERIOD_ORDER.index(period)
+
+            version = (self._read_current() or {}).get('version', 0) + 1
+            directory = os.path.join(self.base_dir, f"v{version}")
+            tmp_dir = directory + '.tmp'
+            os.makedirs(tmp_dir, exist_ok=True)
+            arrays = dict(positions=positions, close=close, volume=volume, dividends=dividends, splits=splits,
+                          fundamentals=fundamentals, first=first, periods=periods, fetched_at=fetched_at)
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp_dir, f'{name}.npy'), array)
+            with open(os.path.join(tmp_dir, 'symbols.json'), 'w', encoding='utf-8') as f:
+                json.dump(list(merged), f)
+            os.replace(tmp_dir, directory)
+
+            # Troca atômica da versão vista pelos leitores
+            current_tmp = os.path.join(self.base_dir, 'CURRENT.tmp')
+            with open(current_tmp, 'w', encoding='utf-8') as f:
+                json.dump({'version': version, 'published_at': now}, f)
+            os.replace(current_tmp, os.path.join(self.base_dir, 'CURRENT'))
+
+            self._remove_old_versions(version)
+            return version
+
+    def _remove_old_versions(self, version):
+        """Apaga versões antigas (mapas já abertos continuam válidos até serem liberados)"""
+        for old in range(version - SHARED_MATRIX_KEEP_VERSIONS, 0, -1):
+            directory = os.path.join(self.base_dir, f"v{old}")
+            if not os.path.isdir(directory):
+                break
+            try:
+                for name in os.listdir(directory):
+                    os.remove(os.path.join(directory, name))
+                os.rmdir(directory)
+            except OSError:
+                break
+
+@st.cache_resource
+def get_shared_prices():
+    """Matriz compartilhada única por processo: mapas abertos e trava preservados entre reruns"""
+    return SharedPriceMatrix()
+
+SHARED_PRICES = get_shared_prices()
+
+class SingleFlight:
+    """Coalescência de chamadas concorrentes: para cada chave só a primeira executa a função,
+    as demais (outras sessões/threads do servidor) esperam e recebem o mesmo resultado."""
+
     def __init__(self):
-        # Cache simples para evitar downloads repetidos
-        if 'data_cache' not in st.session_state:
-            st.session_state.data_cache = {}
-        
-        # Ações da B3 - Lista completa por segmentos (400+ ações)
-        self.b3_stocks = [
-            # Petróleo, Gás e Combustíveis
-            'PETR3.SA', 'PETR4.SA', 'PRIO3.SA', 'RRRP3.SA', 'RECV3.SA', '3R11.SA',
-            'UGPA3.SA', 'BRDT3.SA', 'VIBR3.SA', 'CSAN3.SA', 'DMVF3.SA',
-            
-            # Mineração e Siderurgia
-            'VALE3.SA', 'CSNA3.SA', 'GGBR4.SA', 'USIM5.SA', 'GOAU4.SA', 'FESA4.SA',
-            'JHSF3.SA', 'FHER3.SA', 'COCE5.SA', 'CGRA4.SA', 'BAUH4.SA',
-            
-            # Bancos
-            'ITUB4.SA', 'BBDC4.SA', 'BBAS3.SA', 'SANB11.SA', 'BPAC11.SA', 'BRFS3.SA',
-            'BMGB4.SA', 'BIDI11.SA', 'PINE4.SA', 'BPAN4.SA', 'BGIP4.SA', 'BRSR6.SA',
-            
-            # Seguros e Previdência
-            'SULA11.SA', 'BBSE3.SA', 'PSSA3.SA', 'WIZS3.SA', 'IRFM3.SA',
-            
-            # Varejo e Comércio
-            'MGLU3.SA', 'LREN3.SA', 'AMER3.SA', 'PCAR3.SA', 'VVAR3.SA', 'GUAR3.SA',
-            'LJQQ3.SA', 'GRND3.SA', 'VIIA3.SA', 'AMAR3.SA', 'SOMA3.SA', 'TFCO4.SA',
-            'NTCO3.SA', 'SMFT3.SA', 'CEAB3.SA', 'HBSA3.SA', 'MLAS3.SA',
-            
-            # Alimentação e Bebidas
-            'ABEV3.SA', 'JBSS3.SA', 'BRFS3.SA', 'MRFG3.SA', 'SMLS3.SA', 'CAML3.SA',
-            'BEEF3.SA', 'PNVL3.SA', 'MDIA3.SA', 'JALL3.SA', 'VULC3.SA', 'AMBP3.SA',
-            
-            # Tecnologia e Telecomunicações
-            'VIVT3.SA', 'TIMS3.SA', 'DESK3.SA', 'TOTS3.SA', 'IFCM3.SA', 'LWSA3.SA',
-            'MOVI3.SA', 'OIBR3.SA', 'OIBR4.SA', 'TELE3.SA', 'WSON33.SA',
-            
-            # Energia Elétrica
-            'ELET3.SA', 'ELET6.SA', 'EQTL3.SA', 'CPFE3.SA', 'CMIG4.SA', 'CPLE6.SA',
-            'TAEE11.SA', 'COCE5.SA', 'CEPE6.SA', 'CESP6.SA', 'CEGR3.SA', 'CLSC4.SA',
-            'ENBR3.SA', 'ENGI11.SA', 'ENEV3.SA', 'NEOE3.SA', 'AURE3.SA',
-            
-            # Construção Civil e Materiais
-            'MRVE3.SA', 'CYRE3.SA', 'EVEN3.SA', 'GFSA3.SA', 'JHSF3.SA', 'HBTS5.SA',
-            'VIVR3.SA', 'PLPL3.SA', 'MOAR3.SA', 'TCSA3.SA', 'TRIS3.SA', 'RSID3.SA',
-            'EZTC3.SA', 'DIRR3.SA', 'LAVV3.SA', 'MULT3.SA', 'BRAP4.SA', 'CRDE3.SA',
-            'KLBN11.SA', 'SUZB3.SA', 'FIBR3.SA', 'DURA4.SA', 'TUPY3.SA',
-            
-            # Agronegócio
-            'SLC3.SA', 'TERA3.SA', 'SOJA3.SA', 'LAND3.SA', 'RUMO3.SA', 'RAIZ4.SA',
-            'FRAS3.SA', 'AGRO3.SA', 'MEAL3.SA', 'KEPL3.SA',
-            
-            # Transporte e Logística
-            'RAIL3.SA', 'CCRO3.SA', 'LOGN3.SA', 'AZUL4.SA', 'GOLL4.SA', 'EMBR3.SA',
-            'STBP3.SA', 'ECOR3.SA', 'ARML3.SA', 'JSLG3.SA', 'RLOG3.SA',
-            
-            # Papel e Celulose
-            'KLBN11.SA', 'SUZB3.SA', 'FIBR3.SA', 'MELK3.SA', 'KROT3.SA',
-            
-            # Químicos e Petroquímicos
-            'BRASKEM.SA', 'UNIP6.SA', 'UNIPAR.SA', 'OXTR3.SA', 'BRKM5.SA',
-            
-            # Saúde e Farmacêuticos
-            'RAIA3.SA', 'PARD3.SA', 'DASA3.SA', 'FLRY3.SA', 'GNDI3.SA', 'AALR3.SA',
-            'HAPV3.SA', 'QUAL3.SA', 'MATD3.SA', 'RDOR3.SA', 'ONCR3.SA', 'HYPE3.SA',
-            'BLAU3.SA', 'ODPV3.SA', 'YDUQ3.SA',
-            
-            # Educação
-            'COGN3.SA', 'YDUQ3.SA', 'SEER3.SA', 'ANIM3.SA', 'VIVA3.SA',
-            
-            # Têxtil e Vestuário
-            'GUAR3.SA', 'FRAS3.SA', 'CAMB3.SA', 'COTEMINAS.SA', 'TECN3.SA',
-            
-            # Serviços Financeiros
-            'B3SA3.SA', 'IRBR3.SA', 'CARD3.SA', 'RENT3.SA', 'LOCA3.SA',
-            'MILS3.SA', 'CASH3.SA', 'ATOM3.SA', 'CTKA4.SA',
-            
-            # Utilities e Saneamento
-            'SAPR11.SA', 'SBSP3.SA', 'CSMG3.SA', 'COPAS6.SA', 'SANE11.SA',
-            
-            # Metalurgia
-            'GERDAU.SA', 'GGBR4.SA', 'CSNA3.SA', 'USIM5.SA', 'FESA4.SA', 'COCE5.SA',
-            
-            # Automobilístico
-            'POMO4.SA', 'TUPY3.SA', 'LEVE3.SA', 'HBOR3.SA', 'RSID3.SA',
-            
-            # Madeira e Móveis
-            'EUCL3.SA', 'EUCA4.SA',
-            
-            # Diversos
-            'WEGE3.SA', 'RAPT4.SA', 'PSSA3.SA', 'TOTS3.SA', 'TPIS3.SA', 'SMTO3.SA',
-            'CVCB3.SA', 'SHOW3.SA', 'BAHI3.SA', 'TEND3.SA', 'MTRE3.SA', 'ESPA3.SA',
-            'JFEN3.SA', 'SOND6.SA', 'ITSA4.SA', 'BBDC3.SA', 'PETR3.SA', 'VALE5.SA',
-            'CMIG3.SA', 'LIGHT.SA', 'GOAU3.SA', 'USIM3.SA', 'GGBR3.SA', 'CSNA3.SA',
-            
-            # Small Caps e outras
-            'ABCB4.SA', 'ALPA4.SA', 'ALPK3.SA', 'ALUP11.SA', 'AMAR3.SA', 'AMBP3.SA',
-            'ARZZ3.SA', 'ATOM3.SA', 'BBDC3.SA', 'BEEF3.SA', 'BEES3.SA', 'BEES4.SA',
-            'BGIP3.SA', 'BMEB4.SA', 'BOBR4.SA', 'BRAP3.SA', 'BRDT3.SA', 'BRFS3.SA',
-            'BRKM3.SA', 'BRSR3.SA', 'CAML3.SA', 'CBAV3.SA', 'CCPR3.SA', 'CEAB3.SA',
-            'CGAS5.SA', 'CGRA3.SA', 'CHAP4.SA', 'CLSC3.SA', 'COCE3.SA', 'CORR4.SA',
-            'CPLE3.SA', 'CSMG3.SA', 'CTKA3.SA', 'DEXP3.SA', 'DOHL4.SA', 'EALT4.SA',
-            'EBTP4.SA', 'EEEL3.SA', 'ELET5.SA', 'ELPL4.SA', 'EMAE4.SA', 'ENMT4.SA',
-            'EQMA3B.SA', 'ESTR4.SA', 'EUCA3.SA', 'FESA3.SA', 'FHER3.SA', 'FIQE3.SA',
-            'FRTA3.SA', 'FVNA3.SA', 'GMAT3.SA', 'GOAU3.SA', 'GPAR3.SA', 'GRND3.SA',
-            'GSHP3.SA', 'HAGA4.SA', 'HBRE3.SA', 'HETA4.SA', 'HGTX3.SA', 'IGBR3.SA',
-            'IGTA3.SA', 'INEP4.SA', 'JOPA3.SA', 'KEPL3.SA', 'LEVE3.SA', 'LIGT3.SA',
-            'LIPR3.SA', 'LOGN3.SA', 'LUPA3.SA', 'LUXM4.SA', 'MAGG3.SA', 'MBLY3.SA',
-            'MEND6.SA', 'MMXM3.SA', 'MOAR3.SA', 'MYPK3.SA', 'NORD3.SA', 'OFSA3.SA',
-            'OSXB3.SA', 'PATI4.SA', 'PDGR3.SA', 'PEAB4.SA', 'PINE4.SA', 'PMAM3.SA',
-            'PNVL4.SA', 'POMO3.SA', 'PRBC4.SA', 'PSSA3.SA', 'RADL3.SA', 'RAPT3.SA',
-            'RCSL4.SA', 'REDE4.SA', 'RIPI4.SA', 'SANB3.SA', 'SAPR4.SA', 'SAPR3.SA',
-            'SBFG3.SA', 'SCAR3.SA', 'SHUL4.SA', 'SLCE3.SA', 'SLED4.SA', 'SMLS3.SA',
-            'SOND5.SA', 'SULA3.SA', 'TAEE4.SA', 'TEKA4.SA', 'TELB4.SA', 'TEND3.SA',
-            'TGMA3.SA', 'TIMP3.SA', 'TKNO4.SA', 'TOTS3.SA', 'TOYB4.SA', 'TRPL4.SA',
-            'UGPA3.SA', 'UNIP3.SA', 'USIM3.SA', 'VALE5.SA', 'VCPA4.SA', 'VIVR3.SA',
-            'VULC3.SA', 'WLMM4.SA', 'WIZS3.SA', 'YDUQ3.SA'
-        ]
-        
-        # Lista das principais ações do Ibovespa (para análise rápida) - Atualizada sem ações removidas
-        self.ibovespa_stocks = [
-            'PETR4.SA', 'VALE3.SA', 'ITUB4.SA', 'BBDC4.SA', 'ABEV3.SA',
-            'WEGE3.SA', 'RENT3.SA', 'LREN3.SA', 'MGLU3.SA', 'B3SA3.SA',
-            'JBSS3.SA', 'SUZB3.SA', 'RAIL3.SA', 'GGBR4.SA', 'BBAS3.SA',
-            'ELET3.SA', 'SANB11.SA', 'CSNA3.SA', 'USIM5.SA', 'BRAP4.SA'
-        ]
-        
-        # Fundos Imobiliários (FIIs) - Lista completa do IFIX (117 fundos)
-        self.real_estate_funds = [
-            "CACR11.SA", "AFHI11.SA", "AJFI11.SA", "ALZR11.SA", "RZAT11.SA", "FATN11.SA", 
-            "ARRI11.SA", "AIEC11.SA", "BARI11.SA", "BBIG11.SA", "BRCR11.SA", "BCIA11.SA", 
-            "BCRI11.SA", "BLMG11.SA", "BRCO11.SA", "BROF11.SA", "BTAL11.SA", "BTCI11.SA", 
-            "BPML11.SA", "BTHF11.SA", "BTLG11.SA", "CCME11.SA", "CPTS11.SA", "ICRI11.SA", 
-            "CLIN11.SA", "CPSH11.SA", "CVBI11.SA", "CYCR11.SA", "DEVA11.SA", "VRTA11.SA", 
-            "GTWR11.SA", "GZIT11.SA", "GGRC11.SA", "GARE11.SA", "HABT11.SA", "HCTR11.SA", 
-            "HGBS11.SA", "HGCR11.SA", "HGFF11.SA", "HGLG11.SA", "HGPO11.SA", "HGRE11.SA", 
-            "HGRU11.SA", "HTMX11.SA", "HSAF11.SA", "HSLG11.SA", "HSML11.SA", "HFOF11.SA", 
-            "IRDM11.SA", "ITRI11.SA", "JSAF11.SA", "JSRE11.SA", "KISU11.SA", "KNRI11.SA", 
-            "KCRE11.SA", "KNHF11.SA", "KNHY11.SA", "KNIP11.SA", "KNCR11.SA", "KNSC11.SA", 
-            "KNUQ11.SA", "KFOF11.SA", "KIVO11.SA", "KORE11.SA", "LIFE11.SA", "LVBI11.SA", 
-            "MALL11.SA", "MANA11.SA", "MCCI11.SA", "MCRE11.SA", "MXRF11.SA", "MFII11.SA", 
-            "OUJP11.SA", "PATL11.SA", "PMIS11.SA", "PORD11.SA", "PVBI11.SA", "RBRL11.SA", 
-            "RBRX11.SA", "RBRY11.SA", "RBRP11.SA", "RBRF11.SA", "RBRR11.SA", "RECR11.SA", 
-            "RBFF11.SA", "RCRB11.SA", "RBVA11.SA", "RZAK11.SA", "RZTR11.SA", "RVBI11.SA", 
-            "SARE11.SA", "TRBL11.SA", "SPXS11.SA", "SNCI11.SA", "SNEL11.SA", "SNFF11.SA", 
-            "TEPP11.SA", "TGAR11.SA", "TVRI11.SA", "TOPP11.SA", "TRXF11.SA", "URPR11.SA", 
-            "VGHF11.SA", "VGIP11.SA", "VGIR11.SA", "VCJR11.SA", "VGRI11.SA", "VIUR11.SA", 
-            "VILG11.SA", "VINO11.SA", "VISC11.SA", "VRTM11.SA", "WHGR11.SA", "XPCI11.SA", 
-            "XPLG11.SA", "XPML11.SA", "XPSF11.SA"
-        ]
-        
-        # Fundos de Investimento em Cadeias Produtivas Agroindustriais
-        self.agro_funds = [
-            'FIAG11.SA', 'AGRO11.SA', 'RBBV11.SA', 'SOJA11.SA', 'BEEF11.SA',
-            'CORN11.SA', 'FAIR11.SA', 'SCPF11.SA', 'FOFT11.SA', 'LFTT11.SA',
-            'PATC11.SA', 'GTWR11.SA', 'TEPP11.SA', 'SADI11.SA', 'VRTA11.SA',
-            'RFOF11.SA', 'FCFL11.SA', 'RBFF11.SA', 'KDIF11.SA', 'RBRD11.SA'
-        ]
+        self._lock = threading.Lock()
+        self._calls = {}
 
-    def clean_stock_lists(self):
-        """Remove ações que foram identificadas como problemáticas"""
-        problematic_stocks = []
-        
-        # Lista de ações conhecidas como removidas ou problemáticas
-        known_problematic = ['CIEL3.SA', 'OIBR3.SA', 'OIBR4.SA']
-        
-        # Remover da lista do Ibovespa
-        self.ibovespa_stocks = [stock for stock in self.ibovespa_stocks if stock not in known_problematic]
-        
-        # Remover da lista completa da B3
-        self.b3_stocks = [stock for stock in self.b3_stocks if stock not in known_problematic]
-        
-        return len(known_problematic)
+    def in_flight(self, key):
+        """Indica se já existe uma chamada em andamento para a chave"""
+        with self._lock:
+            return key in self._calls
 
-    def get_stock_data(self, symbols, period="1y"):
-        """Coleta dados das ações com otimização para grandes volumes e cache"""
-        data = {}
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        
-        successful_downloads = 0
-        failed_downloads = 0
-        cached_loads = 0
-        
-        # Criar chave de cache baseada nos símbolos e período
-        cache_key = f"{len(symbols)}_{period}_{hash(tuple(sorted(symbols)))}"
-        
-        for i, symbol in enumerate(symbols):
+    def do(self, key, fn):
+        """Executa fn (ou espera a execução em andamento); devolve (resultado, compartilhado)"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+
+        if not leader:
             try:
-                status_text.text(f"Analisando {symbol.replace('.SA', '')} ({i+1}/{len(symbols)})")
-                
-                # Verificar cache primeiro
-                symbol_cache_key = f"{symbol}_{period}"
-                if symbol_cache_key in st.session_state.data_cache:
-                    data[symbol] = st.session_state.data_cache[symbol_cache_key]
-                    cached_loads += 1
-                else:
-                    stock = yf.Ticker(symbol)
-                    
-                    # Tentar obter dados históricos com timeout
-                    try:
-                        hist = stock.history(period=period, timeout=10)
-                    except Exception as download_error:
-                        if "delisted" in str(download_error).lower() or "no data found" in str(download_error).lower():
-                            # Ação pode ter sido removida da bolsa
-                            pass
-                        failed_downloads += 1
-                        continue
-                    
-                    # Tentar obter informações da empresa
-                    try:
-                        info = stock.info if hasattr(stock, 'info') else {}
-                    except:
-                        info = {}
-                    
-                    if not hist.empty and len(hist) > 5:  # Mínimo de 5 dias de dados
-                        try:
-                            stock_data = {
-                                'history': hist,
-                                'info': info,
-                                'current_price': hist['Close'].iloc[-1],
-                                'price_change': ((hist['Close'].iloc[-1] / hist['Close'].iloc[0]) - 1) * 100,
-                                'volatility': hist['Close'].pct_change().std() * np.sqrt(252) * 100,
-                                'volume_avg': hist['Volume'].mean()
-                            }
-                            data[symbol] = stock_data
-                            # Salvar no cache
-                            st.session_state.data_cache[symbol_cache_key] = stock_data
-                            successful_downloads += 1
-                        except Exception as calc_error:
-                            failed_downloads += 1
-                            continue
-                    else:
-                        failed_downloads += 1
-                
-                progress_bar.progress((i + 1) / len(symbols))
-                
-                # Delay adaptativo baseado no número de símbolos
-                if i < len(symbols) - 1:  # Não fazer delay no último
-                    if len(symbols) > 100:
-                        time.sleep(0.02)  # Delay muito pequeno para análises grandes
-                    elif len(symbols) > 50:
-                        time.sleep(0.03)  # Delay pequeno
-                    else:
-                        time.sleep(0.05)  # Delay normal
-                
-            except Exception as e:
-                failed_downloads += 1
-                # Só mostrar warning se muitos falharem
-                if failed_downloads <= 3:  # Mostrar apenas os primeiros 3 erros
-                    error_msg = str(e)
-                    if "delisted" in error_msg.lower():
-                        st.info(f"📋 {symbol.replace('.SA', '')} pode ter sido removido da bolsa")
-                    elif "no data found" in error_msg.lower():
-                        st.info(f"📋 Sem dados disponíveis para {symbol.replace('.SA', '')}")
-                    else:
-                        st.warning(f"⚠️ Erro ao carregar {symbol.replace('.SA', '')}: {error_msg[:50]}...")
-                continue
-        
-        progress_bar.empty()
-        status_text.empty()
-        
-        if cached_loads > 0:
-            st.success(f"✅ Análise concluída: {successful_downloads} novos downloads, {cached_loads} do cache, {failed_downloads} falharam")
-        elif failed_downloads > 0:
-            st.info(f"📊 Análise concluída: {successful_downloads} ativos carregados com sucesso, {failed_downloads} falharam")
-            if failed_downloads > 5:
-                st.warning("⚠️ Muitas falhas detectadas. Algumas ações podem ter sido removidas da bolsa ou estar com problemas temporários.")
+                return future.result(), True
+            except CancelledError:
+                return self.do(key, fn)
+
+        try:
+            future.set_result(fn())
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+            if not future.done():
+                # Execução interrompida (ex.: rerun da sessão que baixava): quem espera tenta de novo
+                future.cancel()
+        return future.result(), False
+
+@st.cache_resource
+def get_provider_flights():
+    """Registro único por processo (o script é reexecutado a cada rerun, o recurso em cache não)"""
+    return SingleFlight()
+
+PROVIDER_FLIGHTS = get_provider_flights()
+
+# Sessão HTTP do provedor: conexões keep-alive em pool e cache de respostas em disco.
+# Opcional (HTTP_SESSION=1): é uma requests.Session comum, que o Yahoo limita mais que a sessão
+# curl_cffi (que imita um navegador) usada pelo yfinance por padrão
+HTTP_SESSION = os.environ.get('HTTP_SESSION', '0') == '1'
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', '10'))
+HTTP_CACHE_DIR = os.environ.get(
+    'HTTP_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'http_cache')
+)
+HTTP_CACHE_TTL = int(os.environ.get('HTTP_CACHE_TTL', '300'))  # validade de respostas sem Cache-Control/Expires
+HTTP_CACHE_MAX_STALE = int(os.environ.get('HTTP_CACHE_MAX_STALE', '0'))  # atraso aceito além da validade
+HTTP_CACHE_MAX_MB = float(os.environ.get('HTTP_CACHE_MAX_MB', '256'))
+HTTP_CACHE_PRUNE_EVERY = 50  # gravações entre verificações do tamanho do diretório
+# Status armazenáveis sem validade explícita (RFC 9111, 4.2.2)
+HTTP_CACHEABLE_STATUS = {200, 203, 300, 301, 404, 410}
+# Parâmetros que mudam a cada sessão sem mudar a resposta (o crumb do Yahoo)
+HTTP_CACHE_IGNORED_PARAMS = {'crumb'}
+# Cabeçalhos que não valem para o corpo guardado (já descomprimido) ou só para a conexão
+HTTP_UNSTORED_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'connection',
+                         'keep-alive', 'set-cookie', 'age'}
+HTTP_USER_AGENT = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+                   "(KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36")
+
+requests = lazy_import('requests')
+
+def parse_cache_control(value):
+    """Diretivas de um Cache-Control: {'max-age': 60, 'no-cache': True, ...}"""
+    directives = {}
+    for part in (value or '').split(','):
+        name, _, argument = part.strip().partition('=')
+        if not name:
+            continue
+        argument = argument.strip().strip('"')
+        try:
+            directives[name.lower()] = int(argument) if argument else True
+        except ValueError:
+            directives[name.lower()] = argument
+    return directives
+
+def _http_date(value):
+    """Data de um cabeçalho HTTP em segundos (None se ausente ou inválida)"""
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+class HttpResponseCache:
+    """Cache de respostas HTTP em disco, compartilhado entre sessões e processos.
+
+    Cada resposta fica em um arquivo (metadados JSON na primeira linha, corpo em seguida)
+    trocado atomicamente. A validade segue Cache-Control/Expires/Age da resposta (ou
+    default_ttl quando ausentes); respostas vencidas com ETag/Last-Modified são
+    revalidadas com requisições condicionais. Conta acertos, revalidações, downloads e
+    bytes economizados.
+    """
+
+    def __init__(self, directory, default_ttl=HTTP_CACHE_TTL, max_stale=HTTP_CACHE_MAX_STALE,
+                 max_bytes=HTTP_CACHE_MAX_MB * 1024 ** 2):
+        self.directory = directory
+        self.default_ttl = default_ttl
+        self.max_stale = max_stale
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._stores = 0
+        self._stats = {'hits': 0, 'revalidated': 0, 'misses': 0, 'bypassed': 0,
+                       'bytes_saved': 0, 'bytes_downloaded': 0}
+
+    @staticmethod
+    def key(url):
+        """Chave da resposta: URL com parâmetros ordenados, sem os voláteis"""
+        parts = urlsplit(url)
+        query = sorted((name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+                       if name not in HTTP_CACHE_IGNORED_PARAMS)
+        return urlunsplit((parts.scheme, parts.netloc.lower(), parts.path, urlencode(query), ''))
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha1(self.key(url).encode('utf-8')).hexdigest() + '.http')
+
+    def record(self, outcome, saved=0, downloaded=0):
+        with self._lock:
+            self._stats[outcome] += 1
+            self._stats['bytes_saved'] += saved
+            self._stats['bytes_downloaded'] += downloaded
+
+    def stats(self):
+        """Contadores desde o início do processo"""
+        with self._lock:
+            return dict(self._stats)
+
+    def lookup(self, url, request_headers):
+        """Resposta guardada para a URL (None se ausente, ilegível ou de outra variante)"""
+        try:
+            with open(self._path(url), 'rb') as f:
+                entry = json.loads(f.readline())
+                entry['body'] = f.read()
+        except (OSError, ValueError):
+            return None
+        if entry.get('key') != self.key(url) or len(entry['body']) != entry.get('size'):
+            return None
+        for name, value in entry.get('vary', {}).items():
+            if request_headers.get(name) != value:
+                return None
+        return entry
+
+    def is_fresh(self, entry, request_directives, now=None):
+        """Indica se a resposta guardada pode ser usada sem consultar o servidor"""
+        if 'no-cache' in request_directives:
+            return False
+        now = time.time() if now is None else now
+        age = entry['initial_age'] + max(0.0, now - entry['stored_at'])
+        lifetime = entry['lifetime']
+        if isinstance(request_directives.get('max-age'), int):
+            lifetime = min(lifetime, request_directives['max-age'])
+        if isinstance(request_directives.get('min-fresh'), int):
+            age += request_directives['min-fresh']
+        max_stale = 0
+        if not entry['must_revalidate']:
+            requested = request_directives.get('max-stale')
+            max_stale = max(self.max_stale, requested if isinstance(requested, int) else 0)
+        return age < lifetime + max_stale
+
+    @staticmethod
+    def validators(entry):
+        """Cabeçalhos da requisição condicional (vazio se a resposta não tiver validadores)"""
+        headers = {}
+        stored = {name.lower(): value for name, value in entry['headers']}
+        if 'etag' in stored:
+            headers['If-None-Match'] = stored['etag']
+        if 'last-modified' in stored:
+            headers['If-Modified-Since'] = stored['last-modified']
+        return headers
+
+    def _freshness(self, headers, now):
+        """(validade em segundos, idade inicial, exige revalidação) a partir dos cabeçalhos"""
+        directives = parse_cache_control(headers.get('cache-control'))
+        date = _http_date(headers.get('date')) or now
+        try:
+            age_header = max(0, int(headers.get('age', 0)))
+        except ValueError:
+            age_header = 0
+        initial_age = max(age_header, now - date, 0)
+
+        if 'no-cache' in directives:
+            lifetime = 0
+        elif isinstance(directives.get('max-age'), int):
+            lifetime = directives['max-age']
+        elif 'expires' in headers:
+            expires = _http_date(headers['expires'])
+            lifetime = max(0, expires - date) if expires is not None else 0
         else:
-            st.success(f"✅ Análise concluída: {successful_downloads} ativos carregados com sucesso!")
-        
-        return data
+            lifetime = self.default_ttl
+        return lifetime, initial_age, 'must-revalidate' in directives or 'no-cache' in directives
 
-    def calculate_metrics(self, data):
-        """Calcula métricas de análise com tratamento melhorado de dados"""
-        metrics = []
-        
-        for symbol, stock_data in data.items():
+    def store(self, url, request_headers, status, reason, headers, body):
+        """Grava a resposta se ela for armazenável; devolve se gravou"""
+        headers = {name.lower(): value for name, value in headers.items()}
+        directives = parse_cache_control(headers.get('cache-control'))
+        vary = [name.strip() for name in headers.get('vary', '').split(',') if name.strip()]
+        if (status not in HTTP_CACHEABLE_STATUS or 'no-store' in directives or 'set-cookie' in headers
+                or '*' in vary or 'no-store' in parse_cache_control(request_headers.get('Cache-Control'))):
+            return False
+
+        now = time.time()
+        lifetime, initial_age, must_revalidate = self._freshness(headers, now)
+        if lifetime <= 0 and 'etag' not in headers and 'last-modified' not in headers:
+            return False  # sem validade nem validadores: nunca seria reaproveitada
+        entry = {
+            'key': self.key(url), 'url': url, 'status': status, 'reason': reason,
+            'headers': [[name, value] for name, value in headers.items() if name not in HTTP_UNSTORED_HEADERS],
+            'vary': {name: request_headers.get(name) for name in vary if name.lower() != 'accept-encoding'},
+            'stored_at': now, 'initial_age': initial_age, 'lifetime': lifetime,
+            'must_revalidate': must_revalidate, 'size': len(body),
+        }
+        self._write(url, entry, body)
+        return True
+
+    def refresh(self, entry, headers):
+        """Atualiza a resposta guardada com os cabeçalhos de um 304 e renova a validade"""
+        merged = {name.lower(): value for name, value in entry['headers']}
+        merged.update({name.lower(): value for name, value in headers.items()
+                       if name.lower() not in HTTP_UNSTORED_HEADERS})
+        now = time.time()
+        lifetime, initial_age, must_revalidate = self._freshness(merged, now)
+        body = entry.pop('body')
+        entry.update(headers=[[name, value] for name, value in merged.items()], stored_at=now,
+                     initial_age=initial_age, lifetime=lifetime, must_revalidate=must_revalidate)
+        self._write(entry['url'], entry, body)
+        entry['body'] = body
+        return entry
+
+    def _write(self, url, entry, body):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(json.dumps(entry, ensure_ascii=False).encode('utf-8') + b'\n')
+                f.write(body)
+            os.replace(tmp_path, self._path(url))
+        except OSError:
             try:
-                info = stock_data['info']
-                hist = stock_data['history']
-                
-                # Calcula métricas técnicas
-                ma_20 = hist['Close'].rolling(20).mean().iloc[-1] if len(hist) >= 20 else hist['Close'].mean()
-                ma_50 = hist['Close'].rolling(50).mean().iloc[-1] if len(hist) >= 50 else hist['Close'].mean()
-                current_price = stock_data['current_price']
-                
-                # Score baseado em múltiplos indicadores
-                score = 0
-                
-                # Tendência de preço (30%)
-                if stock_data['price_change'] > 0:
-                    score += 30
-                
-                # Posição relativa às médias móveis (25%)
-                if current_price > ma_20:
-                    score += 12.5
-                if current_price > ma_50:
-                    score += 12.5
-                
-                # Volatilidade (20% - menor volatilidade = melhor)
-                if stock_data['volatility'] < 30:
-                    score += 20
-                elif stock_data['volatility'] < 50:
-                    score += 10
-                
-                # Volume (15%)
-                if stock_data['volume_avg'] > 1000000:
-                    score += 15
-                elif stock_data['volume_avg'] > 500000:
-                    score += 7.5
-                
-                # P/L Ratio (10%) - com tratamento de erros
-                pe_ratio = None
-                try:
-                    pe_ratio = info.get('trailingPE', None)
-                    if pe_ratio and isinstance(pe_ratio, (int, float)) and pe_ratio > 0:
-                        if 10 < pe_ratio < 20:
-                            score += 10
-                        elif pe_ratio < 30:
-                            score += 5
-                    else:
-                        pe_ratio = None
-                except:
-                    pe_ratio = None
-                
-                # Converter P/L para string consistente
-                pe_display = f"{pe_ratio:.2f}" if pe_ratio and pe_ratio > 0 else "N/A"
-                
-                metrics.append({
-                    'Symbol': symbol.replace('.SA', ''),
-                    'Preço Atual': f"R$ {current_price:.2f}",
-                    'Variação (%)': f"{stock_data['price_change']:.2f}%",
-                    'Volatilidade (%)': f"{stock_data['volatility']:.2f}%",
-                    'P/L': pe_display,
-                    'Volume Médio': f"{stock_data['volume_avg']:.0f}",
-                    'Score': round(score, 1),
-                    'MA20': ma_20,
-                    'MA50': ma_50,
-                    'raw_data': stock_data
-                })
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self._stores += 1
+            prune = self._stores % HTTP_CACHE_PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+    def prune(self):
+        """Apaga as respostas menos recentes quando o diretório passa do limite de tamanho"""
+        try:
+            files = [(e.stat().st_mtime, e.stat().st_size, e.path) for e in os.scandir(self.directory)
+                     if e.name.endswith('.http')]
+        except OSError:
+            return
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        """Remove todas as respostas guardadas"""
+        try:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.http'):
+                    os.remove(entry.path)
+        except OSError:
+            pass
+
+class CachingHttpAdapter:
+    """Adaptador de transporte do requests: HTTPAdapter com pool de conexões keep-alive,
+    respondendo do cache em disco quando a resposta guardada ainda vale."""
+
+    def __init__(self, cache=None, pool_size=HTTP_POOL_SIZE):
+        self.cache = cache
+        # pool_block: com mais threads que conexões, elas esperam uma conexão livre em vez de
+        # abrir conexões avulsas descartadas depois do uso
+        self.transport = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                                                       pool_block=True)
+
+    def send(self, request, **kwargs):
+        cache = self.cache
+        directives = parse_cache_control(request.headers.get('Cache-Control'))
+        conditional = 'If-None-Match' in request.headers or 'If-Modified-Since' in request.headers
+        if cache is None or request.method != 'GET' or conditional or 'no-store' in directives or kwargs.get('stream'):
+            if cache is not None:
+                cache.record('bypassed')
+            return self.transport.send(request, **kwargs)
+
+        entry = cache.lookup(request.url, request.headers)
+        if entry is not None:
+            if cache.is_fresh(entry, directives):
+                cache.record('hits', saved=entry['size'])
+                return self._cached_response(request, entry)
+            validators = cache.validators(entry)
+            if validators:
+                request = request.copy()
+                request.headers.update(validators)
+
+        response = self.transport.send(request, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            response.content  # consome o corpo vazio: a conexão volta ao pool em vez de ser fechada
+            entry = cache.refresh(entry, response.headers)
+            cache.record('revalidated', saved=entry['size'])
+            return self._cached_response(request, entry)
+
+        body = response.content
+        cache.record('misses', downloaded=len(body))
+        cache.store(request.url, request.headers, response.status_code, response.reason, response.headers, body)
+        return response
+
+    def _cached_response(self, request, entry):
+        response = requests.models.Response()
+        response.status_code = entry['status']
+        response.reason = entry['reason']
+        response.headers = requests.structures.CaseInsensitiveDict(entry['headers'])
+        response.headers['Age'] = str(int(entry['initial_age'] + max(0.0, time.time() - entry['stored_at'])))
+        response._content = entry['body']
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.elapsed = timedelta(0)
+        return response
+
+    def close(self):
+        self.transport.close()
+
+def create_http_session(cache=None, pool_size=HTTP_POOL_SIZE):
+    """Sessão do requests com pool keep-alive (pool_size conexões por host) e o cache informado"""
+    session = requests.Session()
+    session.headers['User-Agent'] = HTTP_USER_AGENT
+    adapter = CachingHttpAdapter(cache, pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+class ProviderHttpClient:
+    """Sessão HTTP única usada por todos os downloads do provedor, criada no primeiro uso"""
+
+    def __init__(self, cache, pool_size=HTTP_POOL_SIZE):
+        self.cache = cache
+        self.pool_size = pool_size
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = create_http_session(self.cache, self.pool_size)
+        return self._session
+
+@st.cache_resource
+def get_provider_http():
+    """Cliente HTTP único por processo (sessões e jobs em segundo plano compartilham o pool)"""
+    return ProviderHttpClient(HttpResponseCache(HTTP_CACHE_DIR))
+
+PROVIDER_HTTP = get_provider_http()
+
+def provider_session():
+    """Sessão passada ao yfinance (None sem HTTP_SESSION=1: o yfinance usa a sua própria)"""
+    return PROVIDER_HTTP.session if HTTP_SESSION else None
+
+def fetch_compact_history(symbol, period):
+    """Baixa histórico e fundamentos de um ativo (None se não houver dados suficientes)"""
+    stock = yf.Ticker(symbol, session=provider_session())
+    hist = stock.history(period=period, timeout=10)
+
+    # Tentar obter informações da empresa
+    try:
+        info = stock.info if hasattr(stock, 'info') else {}
+    except:
+        info = {}
+
+    if hist.empty or len(hist) <= 5:  # Mínimo de 5 dias de dados
+        return None
+    return CompactHistory.from_history(hist, info)
+
+def cached_stock_data(cache, symbol, period):
+    """Busca o ativo no cache, recortando um download de período maior quando existir"""
+    for cached_period in PERIOD_ORDER[PERIOD_ORDER.index(period):]:
+        cached = cache.get(f"{symbol}_{cached_period}")
+        if cached is not None:
+            return cached.to_stock_data(None if cached_period == period else period)
+    return None
+
+def collect_stock_data(symbols, period, fetch_period, cache, cleared_at=0, report=None, is_cancelled=None):
+    """Coleta os ativos do cache, das matrizes compartilhadas ou do provedor, sem usar a interface.
+
+    Roda tanto no script da sessão quanto em jobs em segundo plano: o progresso sai por
+    report(concluídos, total, texto) e is_cancelled() interrompe a coleta entre ativos.
+    Devolve (dados, estatísticas); os novos registros ficam em cache.
+    """
+    fetch_period = fetch_period or period
+    data = {}
+    stats = {'successful': 0, 'failed': 0, 'cached': 0, 'shared': 0, 'coalesced': 0,
+             'downloaded': {}, 'messages': []}
+    downloaded = stats['downloaded']
+
+    # Matrizes publicadas por outro processo (ignoradas se anteriores ao último "Limpar Cache")
+    shared = SHARED_PRICES.snapshot()
+    if shared is not None and shared['published_at'] <= cleared_at:
+        shared = None
+
+    for i, symbol in enumerate(symbols):
+        if is_cancelled is not None and is_cancelled():
+            raise JobCancelled()
+        try:
+            if report is not None:
+                report(i, len(symbols), f"Analisando {symbol.replace('.SA', '')} ({i+1}/{len(symbols)})")
+
+            # Verificar cache primeiro
+            symbol_cache_key = f"{symbol}_{fetch_period}"
+            cached_data = cached_stock_data(cache, symbol, period)
+            if cached_data is None and shared is not None:
+                # Fatias do mapa compartilhado: sem download e sem cópia dos arrays
+                # O registro pode cobrir um período maior que o pedido: fica no cache sob o período
+                # publicado e é recortado para o período da análise, como os demais do cache
+                record = SHARED_PRICES.record(shared, symbol, fetch_period)
+                if record is not None:
+                    published = SHARED_PRICES.published_period(shared, symbol)
+                    cache[f"{symbol}_{published}"] = record
+                    cached_data = record.to_stock_data(None if published == period else period)
+                    if cached_data is not None:
+                        stats['shared'] += 1
+            if cached_data is not None:
+                data[symbol] = cached_data
+                stats['cached'] += 1
+            else:
+                flight_key = (symbol, fetch_period)
+                if report is not None and PROVIDER_FLIGHTS.in_flight(flight_key):
+                    report(i, len(symbols), f"Aguardando {symbol.replace('.SA', '')} ({i+1}/{len(symbols)}) "
+                                            f"- download em andamento em outra sessão")
+
+                # Sessões concorrentes pedindo o mesmo (ativo, período) compartilham um único download
+                try:
+                    record, coalesced = PROVIDER_FLIGHTS.do(
+                        flight_key, lambda: fetch_compact_history(symbol, fetch_period))
+                except Exception as download_error:
+                    if "delisted" in str(download_error).lower() or "no data found" in str(download_error).lower():
+                        # Ação pode ter sido removida da bolsa
+                        pass
+                    stats['failed'] += 1
+                    continue
+
+                if record is not None:
+                    try:
+                        # Salvar no cache (no período baixado) em formato compacto
+                        cache[symbol_cache_key] = record
+                        if coalesced:
+                            stats['coalesced'] += 1
+                        else:
+                            downloaded[symbol] = (record, fetch_period)
+                        stock_data = record.to_stock_data(None if fetch_period == period else period)
+                        if stock_data is None:
+                            stats['failed'] += 1
+                            continue
+                        data[symbol] = stock_data
+                        stats['successful'] += 1
+                    except Exception as calc_error:
+                        stats['failed'] += 1
+                        continue
+                else:
+                    stats['failed'] += 1
+
+            # Delay adaptativo baseado no número de símbolos (apenas após downloads reais)
+            if i < len(symbols) - 1 and cached_data is None and symbol in downloaded:  # Não fazer delay no último
+                if len(symbols) > 100:
+                    time.sleep(0.02)  # Delay muito pequeno para análises grandes
+                elif len(symbols) > 50:
+                    time.sleep(0.03)  # Delay pequeno
+                else:
+                    time.sleep(0.05)  # Delay normal
+
+        except Exception as e:
+            stats['failed'] += 1
+            # Só mostrar aviso dos primeiros erros
+            if stats['failed'] <= 3:  # Mostrar apenas os primeiros 3 erros
+                error_msg = str(e)
+                if "delisted" in error_msg.lower():
+                    stats['messages'].append(('info', f"📋 {symbol.replace('.SA', '')} pode ter sido removido da bolsa"))
+                elif "no data found" in error_msg.lower():
+                    stats['messages'].append(('info', f"📋 Sem dados disponíveis para {symbol.replace('.SA', '')}"))
+                else:
+                    stats['messages'].append(('warning', f"⚠️ Erro ao carregar {symbol.replace('.SA', '')}: {error_msg[:50]}..."))
+            continue
+
+    if report is not None and symbols:
+        report(len(symbols), len(symbols), "Coleta concluída")
+    return data, stats
+
+def publish_downloads(stats):
+    """Publica os novos downloads para os demais processos do servidor e avalia os alertas neles.
+
+    Só o processo que baixou avalia: quem lê da matriz compartilhada não repete os disparos.
+    """
+    if not stats['downloaded']:
+        return
+    if SHARED_MATRIX_PUBLISH:
+        try:
+            SHARED_PRICES.publish(stats['downloaded'])
+        except Exception as e:
+            stats['messages'].append(('warning', f"⚠️ Não foi possível publicar as matrizes compartilhadas: {str(e)}"))
+    try:
+        by_period = {}
+        for symbol, (record, fetch_period) in stats['downloaded'].items():
+            stock_data = record.to_stock_data()
+            if stock_data is not None:
+                by_period.setdefault(fetch_period, {})[symbol] = stock_data
+        for fetch_period, data in by_period.items():
+            get_alert_manager().on_daily(fetch_period, data)
+    except Exception as e:
+        stats['messages'].append(('warning', f"⚠️ Não foi possível avaliar os alertas: {str(e)}"))
+    stats['downloaded'] = {}
+
+def show_load_summary(stats):
+    """Mostra o resumo da coleta (downloads, cache e falhas)"""
+    for level, message in stats['messages']:
+        getattr(st, level)(message)
+
+    successful_downloads, failed_downloads, cached_loads = stats['successful'], stats['failed'], stats['cached']
+    if cached_loads > 0:
+        shared_note = f" ({stats['shared']} compartilhados entre processos)" if stats['shared'] else ""
+        if stats['coalesced']:
+            shared_note += f", {stats['coalesced']} de downloads simultâneos de outras sessões"
+        st.success(f"✅ Análise concluída: {successful_downloads} novos downloads, {cached_loads} do cache{shared_note}, {failed_downloads} falharam")
+    elif failed_downloads > 0:
+        st.info(f"📊 Análise concluída: {successful_downloads} ativos carregados com sucesso, {failed_downloads} falharam")
+        if failed_downloads > 5:
+            st.warning("⚠️ Muitas falhas detectadas. Algumas ações podem ter sido removidas da bolsa ou estar com problemas temporários.")
+    else:
+        st.success(f"✅ Análise concluída: {successful_downloads} ativos carregados com sucesso!")
+
+def show_quality_report(flags):
+    """Mostra o resultado da etapa de qualidade (ativos ajustados, excluídos ou com alerta)"""
+    if flags.empty:
+        return
+    issues = flags[flags['Status'] != "OK"]
+    if issues.empty:
+        return
+
+    counts = issues['Status'].value_counts()
+    summary = ", ".join(f"{counts[status]} {label}" for status, label in
+                        [("Excluído", "excluídos"), ("Ajustado", "ajustados"), ("Alerta", "com alerta")]
+                        if status in counts)
+    with st.expander(f"🩺 Qualidade dos dados: {summary} de {len(flags)} ativos"):
+        st.dataframe(issues, use_container_width=True)
+        st.caption(f"Excluídos: lacuna acima de {QUALITY_MAX_GAP} pregões, preço parado ou sem negócios por "
+                   f"{QUALITY_MAX_STALE}+ pregões, ou última cotação com mais de {QUALITY_MAX_LAG} pregões de atraso. "
+                   f"Ajustados: cotações isoladas desfeitas no pregão seguinte descartadas, desdobramentos/grupamentos "
+                   f"não refletidos no histórico corrigidos e proventos acima de {QUALITY_MAX_DIVIDEND_YIELD:.0%} do "
+                   f"preço removidos. Alerta: retornos atípicos mantidos na análise.")
+
+# Jobs de análise em segundo plano, compartilhados entre as sessões do processo
+# Quatro workers: as seções da Análise Completa rodam todas ao mesmo tempo
+ANALYSIS_JOB_WORKERS = int(os.environ.get('ANALYSIS_JOB_WORKERS', '4'))
+JOB_RESULT_TTL = 30 * 60  # resultados concluídos podem ser reanexados por 30 minutos
+JOB_HISTORY = 20
+JOB_POLL_SECONDS = 0.5
+
+class JobCancelled(Exception):
+    """Job interrompido a pedido do usuário"""
+
+class AnalysisJob:
+    """Job em segundo plano: estado, progresso e resultado consultáveis por qualquer sessão"""
+
+    def __init__(self, job_id, key, description, params=None):
+        self.id = job_id
+        self.key = key
+        self.description = description
+        self.params = params
+        self.status = 'pendente'
+        self.progress = 0.0
+        self.message = "Na fila"
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.future = None
+        self._cancel = threading.Event()
+
+    @property
+    def done(self):
+        return self.status in ('concluído', 'cancelado', 'erro')
+
+    def report(self, progress, message):
+        """Atualiza o progresso (0 a 1) visto pelas sessões que acompanham o job"""
+        self.progress = progress
+        self.message = message
+
+    def cancelled(self):
+        return self._cancel.is_set()
+
+class AnalysisJobManager:
+    """Fila de jobs executada por um pool de threads, independente das execuções do script.
+
+    Fechar a aba ou mexer em widgets não interrompe o job; o resultado fica guardado para
+    ser reanexado pelo ID. Jobs idênticos (mesma chave) pendentes, em execução ou concluídos
+    há pouco são reaproveitados em vez de enfileirados de novo.
+    """
+
+    def __init__(self, workers=ANALYSIS_JOB_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='analysis-job')
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+
+    def submit(self, key, fn, description="", params=None):
+        """Enfileira fn(job) e devolve o job (ou o job idêntico já existente)"""
+        with self._lock:
+            self._prune()
+            for job in self._jobs.values():
+                if job.key == key and job.status in ('pendente', 'executando', 'concluído'):
+                    return job
+            job = AnalysisJob(uuid.uuid4().hex[:8], key, description, params)
+            self._jobs[job.id] = job
+            job.future = self._executor.submit(self._run, job, fn)
+            return job
+
+    def _run(self, job, fn):
+        if job.cancelled():
+            job.status, job.finished_at = 'cancelado', time.time()
+            return
+        job.status = 'executando'
+        try:
+            job.result = fn(job)
+            job.status = 'concluído'
+            job.report(1.0, "Concluído")
+        except Exception as e:
+            # JobCancelled de uma execução anterior do script é outra classe: vale o pedido de cancelamento
+            if job.cancelled():
+                job.status = 'cancelado'
+            else:
+                job.status, job.error = 'erro', str(e)
+        finally:
+            job.finished_at = time.time()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Pede o cancelamento: jobs na fila nem começam, os em execução param no próximo ativo"""
+        job = self.get(job_id)
+        if job is None or job.done:
+            return
+        job._cancel.set()
+        if job.future is not None and job.future.cancel():
+            job.status, job.finished_at = 'cancelado', time.time()
+
+    def _prune(self):
+        """Descarta resultados expirados e mantém só os últimos jobs encerrados"""
+        now = time.time()
+        finished = [job for job in self._jobs.values() if job.done]
+        expired = [job for job in finished if now - job.finished_at > JOB_RESULT_TTL]
+        expired += [job for job in finished[:max(0, len(finished) - JOB_HISTORY)] if job not in expired]
+        for job in expired:
+            del self._jobs[job.id]
+
+@st.cache_resource
+def get_job_manager():
+    """Gerenciador único por processo, preservado entre reruns e sessões"""
+    return AnalysisJobManager()
+
+def collect_plan_data(plan, period, cache, cleared_at, job):
+    """Corpo do job: coleta todas as seções do plano de análise, com progresso agregado"""
+    total = sum(len(symbols) for _, symbols, _ in plan) or 1
+    done = 0
+    results = []
+    for section, symbols, fetch_period in plan:
+        def report(i, n, text, offset=done):
+            job.report((offset + i) / total, text)
+        data, stats = collect_stock_data(symbols, period, fetch_period, cache, cleared_at=cleared_at,
+                                         report=report, is_cancelled=job.cancelled)
+        publish_downloads(stats)
+        results.append((section, data, stats))
+        done += len(symbols)
+    return {'sections': results, 'cache': cache}
+
+def calculate_fii_metrics(data):
+    """Calcula DY 12m, consistência de distribuições, P/VP e o Score FII de todos os fundos de uma vez"""
+    columns = ['DY 12m (%)', 'Consistência (%)', 'P/VP', 'Score FII']
+    symbols = list(data.keys())
+    if not symbols:
+        return pd.DataFrame(columns=columns)
+
+    # Matriz (datas x fundos) de proventos, montada a partir do mesmo histórico dos preços
+    dividends = {}
+    last_dates = []
+    for symbol in symbols:
+        div = data[symbol]['dividends']
+        div = pd.Series(div.values, index=to_daily_index(div.index), dtype=float)
+        dividends[symbol] = div.groupby(level=0).sum()
+        last_dates.append(to_daily_index(data[symbol]['history'].index)[-1])
+    dividends = pd.DataFrame(dividends, columns=symbols).fillna(0.0)
+
+    asof = max(last_dates)
+    window = dividends[dividends.index > asof - pd.DateOffset(years=1)]
+
+    prices = np.array([data[s]['current_price'] for s in symbols], dtype=float)
+    price_change = np.array([data[s]['price_change'] for s in symbols], dtype=float)
+    volatility = np.array([data[s]['volatility'] for s in symbols], dtype=float)
+    volume = np.array([data[s]['volume_avg'] for s in symbols], dtype=float)
+
+    ttm = window.sum(axis=0).to_numpy(dtype=float)
+    if window.empty:
+        paying_months = np.zeros(len(symbols))
+    else:
+        paying_months = (window > 0).groupby(window.index.to_period('M')).any().sum(axis=0).to_numpy(dtype=float)
+
+    # P/VP: preço sobre valor patrimonial por cota, ou o priceToBook informado pelo provedor
+    book = np.array([data[s]['fundamentals'].book_value for s in symbols], dtype=float)
+    price_to_book = np.array([data[s]['fundamentals'].price_to_book for s in symbols], dtype=float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dy = ttm / prices * 100
+        consistency = np.minimum(paying_months, 12) / 12 * 100
+        pvp = np.where(book > 0, prices / book, price_to_book)
+
+    score = fii_score(dy, consistency, pvp, price_change, volatility, volume)
+
+    return pd.DataFrame(
+        np.column_stack([dy, consistency, pvp, score]), index=symbols, columns=columns
+    )
+
+def fii_score(dy, consistency, pvp, price_change, volatility, volume):
+    """Score FII (0-100) vetorizado: renda (DY 30% + consistência 20%), desconto (P/VP 15%),
+    tendência (15%), volatilidade (10%) e liquidez (10%)"""
+    return (
+        np.select([dy >= 10, dy >= 8, dy >= 6], [30, 20, 10], 0)
+        + np.select([consistency >= 90, consistency >= 75], [20, 10], 0)
+        + np.select([np.isnan(pvp), pvp < 0.95, pvp <= 1.05, pvp <= 1.15], [7.5, 15, 10, 5], 0)
+        + np.where(price_change > 0, 15, 0)
+        + np.select([volatility < 15, volatility < 25], [10, 5], 0)
+        + np.select([volume > 50000, volume > 10000], [10, 5], 0)
+    )
+
+def momentum_score(price_change, close, ma20, ma50, volatility, volume, pe):
+    """Score padrão (0-100) vetorizado: tendência (30%), médias móveis (25%), volatilidade (20%),
+    liquidez (15%) e P/L (10%)"""
+    return (
+        np.where(price_change > 0, 30, 0)
+        + np.where(close > ma20, 12.5, 0) + np.where(close > ma50, 12.5, 0)
+        + np.select([volatility < 30, volatility < 50], [20, 10], 0)
+        + np.select([volume > 1000000, volume > 500000], [15, 7.5], 0)
+        + np.select([(pe > 10) & (pe < 20), pe < 30], [10, 5], 0)
+    )
+
+def _positive_number(value):
+    """Converte valores do provedor para float positivo (ou NaN)"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return np.nan
+    return value if value > 0 else np.nan
+
+# Histórico de rankings: backfill vetorizado dos scores (armazenamento em ranking_store.py)
+def _window_sums(values, start):
+    """Soma de cada linha desde start[i] até i (inclusive), via somas acumuladas"""
+    prefix = np.vstack([np.zeros((1, values.shape[1])), np.cumsum(values, axis=0)])
+    return prefix[np.arange(1, len(values) + 1)] - prefix[start]
+
+class ScoreHistory(NamedTuple):
+    """Matrizes (datas x ativos) do backfill: Score e as colunas gravadas no snapshot"""
+    score: pd.DataFrame
+    price: pd.DataFrame
+    change: pd.DataFrame
+    volatility: pd.DataFrame
+
+def compute_score_history(data, period, score_model="default"):
+    """Score de todos os ativos em todas as datas (matrizes datas x ativos) em operações vetorizadas.
+
+    Usa os mesmos critérios e as mesmas janelas de calendário de calculate_metrics/CompactHistory.to_stock_data
+    para reconstruir rankings passados a partir dos históricos em cache; variação e volatilidade
+    também são as do período terminado em cada data, como no snapshot ao vivo.
+
+    Limitação: o provedor só informa os fundamentos atuais, então P/L (score padrão) e valor
+    patrimonial/P/VP (score FII) de hoje valem para todas as datas passadas (look-ahead).
+    """
+    closes = build_close_matrix(data).ffill()
+    if closes.empty:
+        return ScoreHistory(closes, closes, closes, closes)
+    volumes = build_close_matrix(data, 'Volume').reindex(closes.index)
+    symbols = closes.columns
+    index = closes.index
+
+    # Início da janela de cada data: primeiro pregão >= data - período
+    window_start = index - PERIOD_OFFSETS[period]
+    start = index.searchsorted(window_start)
+    c = closes.to_numpy()
+    first = c[start]
+    valid = (window_start >= index[0])[:, None] & ~np.isnan(first)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        price_change = (c / first - 1) * 100
+
+        returns = closes.pct_change(fill_method=None).to_numpy()
+        returns_ok = ~np.isnan(returns)
+        returns = np.where(returns_ok, returns, 0.0)
+        # Retornos da janela vão de start+1 até a data (o primeiro preço não tem retorno)
+        n = _window_sums(returns_ok.astype(float), np.minimum(start + 1, len(index)))
+        total = _window_sums(returns, np.minimum(start + 1, len(index)))
+        total_sq = _window_sums(returns ** 2, np.minimum(start + 1, len(index)))
+        variance = np.maximum(total_sq - total ** 2 / n, 0) / (n - 1)
+        volatility = np.sqrt(variance) * np.sqrt(252) * 100
+
+        v = volumes.to_numpy()
+        volume_ok = ~np.isnan(v)
+        volume_avg = (_window_sums(np.where(volume_ok, v, 0.0), start)
+                      / _window_sums(volume_ok.astype(float), start))
+
+    if score_model == "fii":
+        dividends = build_close_matrix(data, 'Dividends').reindex(closes.index).fillna(0.0)
+        dy = dividends.rolling('365D').sum() / closes * 100
+        months = dividends.index.to_period('M')
+        paid = (dividends > 0).groupby(months).any().rolling(12, min_periods=1).sum()
+        consistency = paid.reindex(months).to_numpy() / 12 * 100
+
+        book = np.array([data[s]['fundamentals'].book_value for s in symbols], dtype=float)
+        price_to_book = np.array([data[s]['fundamentals'].price_to_book for s in symbols], dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pvp = np.where(book > 0, closes.to_numpy() / book, price_to_book)
+
+        score = fii_score(dy.to_numpy(), consistency, pvp, price_change, volatility, volume_avg)
+    else:
+        pe = np.array([data[s]['fundamentals'].trailing_pe for s in symbols], dtype=float)
+        ma20 = closes.rolling(20).mean().to_numpy()
+        ma50 = closes.rolling(50).mean().to_numpy()
+        score = momentum_score(price_change, c, ma20, ma50, volatility, volume_avg, pe[None, :])
+
+    def matrix(values):
+        return pd.DataFrame(np.where(valid, values, np.nan), index=index, columns=symbols)
+
+    return ScoreHistory(matrix(score), closes, matrix(price_change), matrix(volatility))
+
+# Modo intraday: candles de 1m/5m/15m aplicados incrementalmente ao ranking
+INTRADAY_INTERVALS = {'1m': 1, '5m': 5, '15m': 15}  # minutos por candle
+INTRADAY_WARMUP_PERIOD = {'1m': '5d', '5m': '5d', '15m': '1mo'}
+B3_SESSION_MINUTES = 7 * 60  # pregão regular (10h-17h)
+B3_TIMEZONE = 'America/Sao_Paulo'
+INTRADAY_MA_SHORT = 20
+INTRADAY_MA_LONG = 50
+INTRADAY_VOL_WINDOW = 50  # retornos na janela da volatilidade
+INTRADAY_MIN_POLL_SECONDS = 15
+
+def fetch_intraday_bars(symbols, interval, period=None, start=None):
+    """Candles intraday de vários ativos em uma única chamada ao provedor: (fechamentos, volumes)"""
+    symbols = list(symbols)
+    try:
+        frame = yf.download(symbols, period=period, start=start, interval=interval,
+                            group_by='column', progress=False, threads=True, session=provider_session())
+    except Exception:
+        frame = None
+    if frame is None or frame.empty:
+        return pd.DataFrame(columns=symbols), pd.DataFrame(columns=symbols)
+
+    if isinstance(frame.columns, pd.MultiIndex):
+        closes, volumes = frame['Close'], frame['Volume']
+    else:  # versões antigas devolvem colunas simples para um único ativo
+        closes = frame[['Close']].set_axis(symbols[:1], axis=1)
+        volumes = frame[['Volume']].set_axis(symbols[:1], axis=1)
+    return closes.reindex(columns=symbols), volumes.reindex(columns=symbols)
+
+class IncrementalIndicators:
+    """Indicadores intraday de um universo, atualizados em O(1) a cada candle novo.
+
+    O estado de cada ativo fica em arrays numpy (vetorizado entre ativos): buffer circular
+    dos últimos fechamentos com somas correntes para as médias móveis, Welford deslizante
+    para a volatilidade dos retornos e soma acumulada do volume. Nada é recalculado sobre
+    a série inteira.
+    """
+
+    def __init__(self, symbols, interval):
+        n = len(symbols)
+        self.symbols = list(symbols)
+        self.interval = interval
+        self.bars_per_day = B3_SESSION_MINUTES / INTRADAY_INTERVALS[interval]
+        self.annualization = np.sqrt(TRADING_DAYS * self.bars_per_day)
+        self.closes = np.zeros((n, INTRADAY_MA_LONG))
+        self.returns = np.zeros((n, INTRADAY_VOL_WINDOW))
+        self.count = np.zeros(n, dtype=np.int64)
+        self.return_count = np.zeros(n, dtype=np.int64)
+        self.sum_short = np.zeros(n)
+        self.sum_long = np.zeros(n)
+        self.return_mean = np.zeros(n)
+        self.return_m2 = np.zeros(n)
+        self.volume_sum = np.zeros(n)
+        self.last_close = np.full(n, np.nan)
+        self.reference_close = np.full(n, np.nan)  # último fechamento do pregão anterior
+        self.session_day = np.full(n, -1, dtype=np.int64)
+        self.last_time = np.full(n, np.iinfo(np.int64).min, dtype=np.int64)
+        self.pe = np.full(n, np.nan)
+
+    def update(self, timestamp, day, close, volume):
+        """Aplica o candle de um horário aos ativos com fechamento novo; devolve os índices atualizados"""
+        idx = np.flatnonzero(~np.isnan(close) & (timestamp > self.last_time))
+        if not len(idx):
+            return idx
+        c = close[idx]
+        k = self.count[idx]
+
+        # Novo pregão: a variação passa a ser medida contra o fechamento anterior
+        new_day = self.session_day[idx] != day
+        self.reference_close[idx] = np.where(new_day, np.where(k > 0, self.last_close[idx], c),
+                                             self.reference_close[idx])
+        self.session_day[idx] = day
+
+        # Médias móveis: soma corrente, saindo o fechamento que deixa cada janela
+        slot = k % INTRADAY_MA_LONG
+        leaving_long = np.where(k >= INTRADAY_MA_LONG, self.closes[idx, slot], 0.0)
+        leaving_short = np.where(k >= INTRADAY_MA_SHORT,
+                                 self.closes[idx, (k - INTRADAY_MA_SHORT) % INTRADAY_MA_LONG], 0.0)
+        self.sum_long[idx] += c - leaving_long
+        self.sum_short[idx] += c - leaving_short
+        self.closes[idx, slot] = c
+
+        # Volatilidade: Welford deslizante (com a janela cheia, o retorno novo substitui o mais antigo)
+        has_previous = k > 0
+        j = idx[has_previous]
+        if len(j):
+            r = c[has_previous] / self.last_close[j] - 1
+            m = self.return_count[j]
+            rslot = m % INTRADAY_VOL_WINDOW
+            full = m >= INTRADAY_VOL_WINDOW
+            old = self.returns[j, rslot]
+            mean = self.return_mean[j]
+            new_mean = np.where(full, mean + (r - old) / INTRADAY_VOL_WINDOW, mean + (r - mean) / (m + 1))
+            delta_m2 = np.where(full, (r - old) * (r - new_mean + old - mean), (r - mean) * (r - new_mean))
+            self.return_m2[j] = np.maximum(self.return_m2[j] + delta_m2, 0.0)
+            self.return_mean[j] = new_mean
+            self.returns[j, rslot] = r
+            self.return_count[j] = m + 1
+
+        self.volume_sum[idx] += np.nan_to_num(volume[idx])
+        self.last_close[idx] = c
+        self.last_time[idx] = timestamp
+        self.count[idx] = k + 1
+        return idx
+
+    def apply(self, closes, volumes, now=None):
+        """Aplica os candles fechados (horários x ativos) em ordem.
+
+        Devolve (candles aplicados, máscara dos ativos atualizados).
+        """
+        updated = np.zeros(len(self.symbols), dtype=bool)
+        if closes.empty:
+            return 0, updated
+        closes = closes.reindex(columns=self.symbols)
+        volumes = volumes.reindex(index=closes.index, columns=self.symbols)
+        index = pd.DatetimeIndex(closes.index)
+        if index.tz is None:
+            index = index.tz_localize(B3_TIMEZONE)
+        times = index.tz_convert('UTC').tz_localize(None).values.astype('datetime64[ns]').view(np.int64)
+        days = (index.tz_convert(B3_TIMEZONE).tz_localize(None).values.astype('datetime64[D]')
+                .view(np.int64))
+
+        # O último candle do provedor ainda está em formação: entra só quando fechar
+        now = pd.Timestamp.now(tz='UTC') if now is None else pd.Timestamp(now)
+        interval = INTRADAY_INTERVALS[self.interval] * 60 * 10 ** 9
+        closed = np.flatnonzero(times + interval <= now.value)
+
+        c = closes.to_numpy(dtype=float)
+        v = volumes.to_numpy(dtype=float)
+        applied = 0
+        for t in closed[np.argsort(times[closed], kind='stable')]:
+            idx = self.update(times[t], days[t], c[t], v[t])
+            updated[idx] = True
+            applied += len(idx)
+        return applied, updated
+
+    def latest_time(self):
+        """Horário (UTC) do último candle aplicado, ou None antes do primeiro"""
+        seen = self.last_time[self.count > 0]
+        return pd.Timestamp(int(seen.max()), tz='UTC') if len(seen) else None
+
+    def metrics(self):
+        """Métricas e Score atuais (mesmos critérios do Score diário, com volatilidade e volume anualizados)"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ma20 = self.sum_short / np.minimum(self.count, INTRADAY_MA_SHORT)
+            ma50 = self.sum_long / np.minimum(self.count, INTRADAY_MA_LONG)
+            n = np.minimum(self.return_count, INTRADAY_VOL_WINDOW)
+            volatility = np.sqrt(self.return_m2 / (n - 1)) * self.annualization * 100
+            price_change = (self.last_close / self.reference_close - 1) * 100
+            volume_avg = self.volume_sum / self.count * self.bars_per_day
+        score = momentum_score(price_change, self.last_close, ma20, ma50, volatility, volume_avg, self.pe)
+        return pd.DataFrame({
+            'price': self.last_close, 'change': price_change, 'ma20': ma20, 'ma50': ma50,
+            'volatility': volatility, 'volume': volume_avg, 'pe': self.pe,
+            'score': np.where(self.count > 0, score, np.nan), 'bars': self.count,
+        }, index=pd.Index(self.symbols, name='symbol'))
+
+class IntradayEngine:
+    """Ranking intraday ao vivo de um universo: busca só os candles novos e os aplica em O(1).
+
+    Compartilhado entre sessões (um por intervalo): o provedor é consultado no máximo uma vez
+    a cada min_seconds, não importa quantas abas acompanhem o ranking.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.indicators = None
+        self.last_poll = 0.0
+        self.stats = {}
+        # Chamados a cada lote aplicado: listener(intervalo, indicadores, atualizados, carga inicial)
+        self.listeners = []
+        self._lock = threading.Lock()
+
+    def refresh(self, symbols, pe=None, min_seconds=INTRADAY_MIN_POLL_SECONDS):
+        """Busca e aplica os candles novos se o último polling tiver mais de min_seconds"""
+        symbols = list(symbols)
+        with self._lock:
+            indicators = self.indicators
+            if indicators is not None and indicators.symbols == symbols:
+                if time.time() - self.last_poll < min_seconds:
+                    return self.stats
+                latest = indicators.latest_time()
+            else:
+                indicators = IncrementalIndicators(symbols, self.interval)
+                latest = None
+
+            start = time.perf_counter()
+            if latest is None:
+                closes, volumes = fetch_intraday_bars(symbols, self.interval,
+                                                      period=INTRADAY_WARMUP_PERIOD[self.interval])
+            else:
+                # Só a partir do próximo candle (o provedor devolve candles com horário >= start)
+                step = pd.Timedelta(minutes=INTRADAY_INTERVALS[self.interval])
+                closes, volumes = fetch_intraday_bars(symbols, self.interval, start=latest + step)
+            fetch_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            applied, updated = indicators.apply(closes, volumes)
+            if pe:
+                indicators.pe = np.array([pe.get(s, np.nan) for s in symbols], dtype=float)
+            self.indicators = indicators
+            self.last_poll = time.time()
+            self.stats = {'bars': applied, 'fetch_seconds': fetch_seconds,
+                          'update_seconds': time.perf_counter() - start,
+                          'updated_at': self.last_poll, 'latest': indicators.latest_time()}
+
+            if updated.any():
+                start = time.perf_counter()
+                for listener in self.listeners:
+                    try:
+                        listener(self.interval, indicators, updated, latest is None)
+                    except Exception as e:
+                        self.stats['listener_error'] = str(e)
+                self.stats['listeners_seconds'] = time.perf_counter() - start
+            return self.stats
+
+    def ranking(self):
+        """Ranking atual (Score decrescente) dos ativos que já receberam candles"""
+        with self._lock:
+            if self.indicators is None:
+                return pd.DataFrame()
+            frame = self.indicators.metrics()
+        frame = frame[frame['bars'] > 0].sort_values('score', ascending=False, kind='stable')
+        return frame.assign(rank=np.arange(1, len(frame) + 1))
+
+@st.cache_resource
+def get_intraday_engine(interval):
+    """Motor intraday do intervalo, compartilhado entre sessões e reruns"""
+    engine = IntradayEngine(interval)
+    engine.listeners.append(get_alert_manager().on_bars)
+    return engine
+
+# Scanner de pares: valores críticos de Engle-Granger (2 variáveis, com constante - MacKinnon)
+EG_CRITICAL_VALUES = {'1%': -3.90, '5%': -3.34, '10%': -3.04}
+PAIRS_MAX_CANDIDATES = 2000
+PAIRS_MIN_PARALLEL = 200
+PAIRS_CHUNK = 250  # pares por lote vetorizado
+
+def _adf_tstat(series):
+    """Estatística t do teste ADF (1 defasagem, com constante) de cada coluna (uma série por par).
+
+    As regressões de todas as colunas saem de somas vetorizadas e de uma inversão 3x3 em lote;
+    colunas degeneradas (regressores colineares) ficam com NaN.
+    """
+    diff = np.diff(series, axis=0)
+    y = diff[1:]
+    a = series[1:-1]
+    b = diff[:-1]
+    n = len(y)
+    sa, sb, sy = a.sum(axis=0), b.sum(axis=0), y.sum(axis=0)
+    xtx = np.stack([
+        np.stack([np.full_like(sa, n), sa, sb], axis=-1),
+        np.stack([sa, (a * a).sum(axis=0), (a * b).sum(axis=0)], axis=-1),
+        np.stack([sb, (a * b).sum(axis=0), (b * b).sum(axis=0)], axis=-1),
+    ], axis=-2)
+    xty = np.stack([sy, (a * y).sum(axis=0), (b * y).sum(axis=0)], axis=-1)
+
+    singular = ~(np.abs(np.linalg.det(xtx)) > 1e-12)
+    xtx[singular] = np.eye(3)
+    xtx_inv = np.linalg.inv(xtx)
+    coef = np.einsum('pij,pj->pi', xtx_inv, xty)
+    resid = y - (coef[:, 0] + coef[:, 1] * a + coef[:, 2] * b)
+    s2 = (resid * resid).sum(axis=0) / (n - 3)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_stat = coef[:, 1] / np.sqrt(s2 * xtx_inv[:, 1, 1])
+    t_stat[singular] = np.nan
+    return t_stat
+
+def _cointegration_chunk(log_prices, pairs):
+    """Teste de Engle-Granger e half-life para um lote de pares, vetorizado (uma coluna por par).
+
+    Devolve (i, j, ADF t, half-life, hedge ratio, intercepto, z-score atual) de cada par
+    com estatísticas finitas.
+    """
+    y = log_prices[:, pairs[:, 0]]
+    x = log_prices[:, pairs[:, 1]]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # MQO de y contra x com constante, em forma fechada para todos os pares
+        x_centered = x - x.mean(axis=0)
+        hedge_ratio = (x_centered * (y - y.mean(axis=0))).sum(axis=0) / (x_centered ** 2).sum(axis=0)
+        intercept = y.mean(axis=0) - hedge_ratio * x.mean(axis=0)
+        spread = y - hedge_ratio * x - intercept
+
+        t_stat = _adf_tstat(spread)
+
+        # Half-life da reversão à média: delta_spread = c + lambda * spread(t-1)
+        lagged = spread[:-1] - spread[:-1].mean(axis=0)
+        delta = np.diff(spread, axis=0)
+        lam = (lagged * (delta - delta.mean(axis=0))).sum(axis=0) / (lagged ** 2).sum(axis=0)
+        half_life = np.where(lam < 0, -np.log(2) / lam, np.inf)
+
+        z_score = (spread[-1] - spread.mean(axis=0)) / spread.std(axis=0)
+
+    valid = np.isfinite(t_stat) & np.isfinite(hedge_ratio) & np.isfinite(z_score)
+    return [(int(i), int(j), float(t), float(h), float(b), float(c), float(z))
+            for (i, j), t, h, b, c, z in zip(pairs[valid], t_stat[valid], half_life[valid],
+                                              hedge_ratio[valid], intercept[valid], z_score[valid])]
+
+def align_pair_closes(closes):
+    """Fechamentos usados pelo scanner: ativos com boa cobertura no período e datas alinhadas"""
+    coverage = closes.notna().mean()
+    return closes.loc[:, coverage >= 0.9].ffill().dropna()
+
+def scan_pairs(closes, min_corr=0.8, max_candidates=PAIRS_MAX_CANDIDATES, workers=None):
+    """Busca pares cointegrados: pré-filtro por correlação (um único produto matricial)
+    e testes de cointegração vetorizados em lotes, em paralelo, apenas nos pares sobreviventes.
+
+    Devolve (pares ranqueados, estatísticas da busca).
+    """
+    columns = ['Par', 'Ativo A', 'Ativo B', 'Correlação', 'ADF (t)', 'Significância',
+               'Half-life (dias)', 'Hedge Ratio', 'Intercepto', 'Z-Score Atual']
+    stats = {'symbols': 0, 'pairs': 0, 'above_corr': 0, 'tested': 0}
+
+    closes = align_pair_closes(closes)
+    if closes.shape[1] < 2 or len(closes) < 30:
+        return pd.DataFrame(columns=columns), stats
+
+    symbols = closes.columns.tolist()
+    log_prices = np.log(closes.to_numpy(dtype=float))
+    returns = np.diff(log_prices, axis=0)
+
+    # Correlação de todos os pares via Z^T Z
+    std = returns.std(axis=0, ddof=1)
+    std[std == 0] = np.nan
+    z = np.nan_to_num((returns - returns.mean(axis=0)) / std)
+    corr = (z.T @ z) / (len(returns) - 1)
+
+    rows, cols = np.triu_indices(len(symbols), k=1)
+    pair_corr = corr[rows, cols]
+    keep = np.flatnonzero(pair_corr >= min_corr)
+    stats.update(symbols=len(symbols), pairs=len(pair_corr), above_corr=len(keep))
+    keep = keep[np.argsort(-pair_corr[keep])][:max_candidates]
+    stats['tested'] = len(keep)
+    if len(keep) == 0:
+        return pd.DataFrame(columns=columns), stats
+    candidates = np.column_stack([rows[keep], cols[keep]])
+
+    # Lotes vetorizados em threads: as operações do numpy liberam o GIL, sem fork do servidor
+    chunks = [candidates[start:start + PAIRS_CHUNK] for start in range(0, len(candidates), PAIRS_CHUNK)]
+    workers = min(workers or os.cpu_count() or 1, len(chunks))
+    results = []
+    if workers > 1 and len(candidates) >= PAIRS_MIN_PARALLEL:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pairs-scan') as pool:
+            for chunk_result in pool.map(lambda chunk: _cointegration_chunk(log_prices, chunk), chunks):
+                results.extend(chunk_result)
+    else:
+        for chunk in chunks:
+            results.extend(_cointegration_chunk(log_prices, chunk))
+
+    if not results:
+        return pd.DataFrame(columns=columns), stats
+
+    result = pd.DataFrame(results, columns=['i', 'j', 'ADF (t)', 'Half-life (dias)',
+                                            'Hedge Ratio', 'Intercepto', 'Z-Score Atual'])
+    result['Ativo A'] = [symbols[i] for i in result['i']]
+    result['Ativo B'] = [symbols[j] for j in result['j']]
+    result['Correlação'] = corr[result['i'], result['j']]
+    result['Par'] = (result['Ativo A'].str.replace('.SA', '', regex=False) + ' / '
+                     + result['Ativo B'].str.replace('.SA', '', regex=False))
+    result['Significância'] = np.select(
+        [result['ADF (t)'] <= EG_CRITICAL_VALUES['1%'],
+         result['ADF (t)'] <= EG_CRITICAL_VALUES['5%'],
+         result['ADF (t)'] <= EG_CRITICAL_VALUES['10%']],
+        ['1%', '5%', '10%'], 'N/S'
+    )
+
+    result = result[result['Significância'] != 'N/S']
+    return result.sort_values('ADF (t)')[columns].reset_index(drop=True), stats
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def cached_pair_scan(closes, min_corr):
+    """Resultado do scanner em cache (pares, estatísticas): mesmos dados e parâmetros não recalculam"""
+    return scan_pairs(closes, min_corr)
+
+# Renderização de gráficos: pontos por série após LTTB e limite para trocar para WebGL
+CHART_MAX_POINTS = 400
+WEBGL_POINT_THRESHOLD = 2000
+CHART_COLORS = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd',
+                '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']
+
+def lttb_downsample(x, y, n_out):
+    """Largest-Triangle-Three-Buckets: índices de n_out pontos que preservam a forma da série"""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    # Limites dos baldes internos (primeiro e último ponto são sempre mantidos)
+    edges = (np.floor(np.arange(n_out - 1) * (n - 2) / (n_out - 2)) + 1).astype(int)
+    edges[-1] = n - 1
+
+    # Média de cada balde calculada de uma vez; o "próximo balde" do último é o ponto final
+    counts = np.diff(edges)
+    mean_x = np.append(np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / counts, x[-1])
+    mean_y = np.append(np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / counts, y[-1])
+
+    selected = np.empty(n_out, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for b in range(n_out - 2):
+        start, end = edges[b], edges[b + 1]
+        bx, by = x[start:end], y[start:end]
+        # Área do triângulo (ponto anterior, candidato, média do próximo balde)
+        area = np.abs((x[a] - mean_x[b + 1]) * (by - y[a]) - (x[a] - bx) * (mean_y[b + 1] - y[a]))
+        a = start + int(np.argmax(area))
+        selected[b + 1] = a
+    return selected
+
+# Memoização por sessão de dados, métricas, figuras e tabelas
+MEMO_MAX_ENTRIES = 64
+
+def data_fingerprint(*parts):
+    """Impressão digital estável de (universo, período, versão dos dados, parâmetros)"""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:16]
+
+def benchmark_fingerprint(benchmark):
+    """Impressão digital das séries do Ibovespa e do CDI (None sem benchmark)"""
+    if benchmark is None:
+        return None
+    digest = hashlib.sha1()
+    for series in (benchmark['ibov'], benchmark['cdi']):
+        digest.update(np.asarray(series.index.asi8).tobytes())
+        digest.update(series.to_numpy(dtype=float).tobytes())
+    return digest.hexdigest()[:16]
+
+def memoize(kind, fingerprint, builder):
+    """Devolve o resultado em cache para (tipo, impressão digital) ou o constrói uma única vez"""
+    memo = st.session_state.setdefault('memo_cache', OrderedDict())
+    key = (kind, fingerprint)
+    if key in memo:
+        memo.move_to_end(key)
+        return memo[key]
+
+    value = builder()
+    memo[key] = value
+    while len(memo) > MEMO_MAX_ENTRIES:
+        memo.popitem(last=False)
+    return value
+
+UNIVERSE_REGISTRY_PATH = os.environ.get(
+    'UNIVERSE_REGISTRY_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'universes.json')
+)
+B3_TICKER_RE = re.compile(r'^[A-Z0-9]{4}\d{1,2}[A-Z]?$')
+UNKNOWN_SECTOR = "Sem setor"
+
+class UniverseRegistry:
+    """Universos de ativos do arquivo de dados (data/universes.json), deduplicados e validados.
+
+    Mantém a ordem do arquivo e os índices símbolo -> setor/segmento, setor -> símbolos e os
+    conjuntos de pertinência de cada universo (símbolos com sufixo .SA). Um símbolo repetido
+    fica no primeiro setor em que aparece; códigos fora do padrão da B3 são descartados.
+    """
+
+    def __init__(self, config):
+        self.segment_of_sector = dict(config.get('sector_segments', {}))
+        self.universes = {}
+        self.members = {}
+        self.sector_of = {}
+        self.sector_symbols = {}
+        self.duplicates = []  # (universo, símbolo)
+        self.rejected = []  # (universo, entrada, motivo)
+
+        for universe, groups in config.get('universes', {}).items():
+            symbols = []
+            seen = set()
+            for group in groups:
+                sector = group.get('sector')
+                for entry in group.get('symbols', []):
+                    code = str(entry).strip().upper()
+                    if code.endswith('.SA'):
+                        code = code[:-3]
+                    if not B3_TICKER_RE.match(code):
+                        self.rejected.append((universe, entry, "código fora do padrão da B3"))
+                        continue
+                    symbol = code + '.SA'
+                    if symbol in seen:
+                        self.duplicates.append((universe, symbol))
+                        continue
+                    seen.add(symbol)
+                    symbols.append(symbol)
+                    if sector is not None and symbol not in self.sector_of:
+                        self.sector_of[symbol] = sector
+                        self.sector_symbols.setdefault(sector, []).append(symbol)
+            self.universes[universe] = symbols
+            self.members[universe] = frozenset(symbols)
+
+    @classmethod
+    def load(cls, path=UNIVERSE_REGISTRY_PATH):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def sector(self, symbol):
+        return self.sector_of.get(symbol, UNKNOWN_SECTOR)
+
+    def segment(self, symbol):
+        sector = self.sector(symbol)
+        return self.segment_of_sector.get(sector, sector)
+
+    def segments(self, universe):
+        """Segmento -> símbolos do universo, na ordem do arquivo"""
+        segments = {}
+        for symbol in self.universes.get(universe, []):
+            segments.setdefault(self.segment(symbol), []).append(symbol)
+        return segments
+
+    def universes_of(self, symbol):
+        """Universos dos quais o símbolo faz parte"""
+        return [universe for universe, members in self.members.items() if symbol in members]
+
+@st.cache_resource
+def load_universe_registry(path, mtime):
+    """Cadastro de universos carregado uma vez por processo (recarregado se o arquivo mudar)"""
+    return UniverseRegistry.load(path)
+
+def sector_aggregates(df, registry):
+    """Agregados por setor do ranking em uma única operação agrupada: Score mediano, momentum
+    (variação mediana no período) e amplitude (% em alta e % acima da MA50)"""
+    if df.empty:
+        return pd.DataFrame()
+    raw = df['raw_data']
+    change = np.array([r['price_change'] for r in raw], dtype=float)
+    price = np.array([r['current_price'] for r in raw], dtype=float)
+    table = pd.DataFrame({
+        'sector': (df['Symbol'] + '.SA').map(registry.sector_of).fillna(UNKNOWN_SECTOR).to_numpy(),
+        'score': df['Score'].to_numpy(dtype=float),
+        'change': change,
+        'up': change > 0,
+        'above_ma50': price > df['MA50'].to_numpy(dtype=float),
+    })
+    sectors = table.groupby('sector', sort=False).agg(
+        assets=('score', 'size'), score=('score', 'median'), momentum=('change', 'median'),
+        up=('up', 'mean'), above_ma50=('above_ma50', 'mean'),
+    )
+    sectors[['up', 'above_ma50']] *= 100
+    sectors = sectors.sort_values('score', ascending=False).reset_index()
+    sectors.insert(1, 'segment', sectors['sector'].map(lambda s: registry.segment_of_sector.get(s, s)))
+    sectors.columns = ['Setor', 'Segmento', 'Ativos', 'Score Mediano', 'Momentum (%)',
+                       'Em Alta (%)', 'Acima da MA50 (%)']
+    return sectors.round(1)
+
+class InvestmentAnalyzer:
+    def __init__(self):
+        # Cache simples para evitar downloads repetidos
+        if 'data_cache' not in st.session_state:
+            st.session_state.data_cache = {}
+        if 'data_version' not in st.session_state:
+            st.session_state.data_version = 0
+
+        # Histórico de rankings (snapshots diários em disco)
+        self.snapshots = RankingSnapshotStore()
+        
+        # Universos de ativos: cadastro em data/universes.json, carregado uma vez por processo
+        self.registry = load_universe_registry(UNIVERSE_REGISTRY_PATH, os.path.getmtime(UNIVERSE_REGISTRY_PATH))
+        self.b3_stocks = list(self.registry.universes.get('b3', []))
+        self.ibovespa_stocks = list(self.registry.universes.get('ibovespa', []))
+        self.real_estate_funds = list(self.registry.universes.get('fiis', []))
+        self.agro_funds = list(self.registry.universes.get('agro', []))
+
+    def clean_stock_lists(self):
+        """Remove ações que foram identificadas como problemáticas"""
+        problematic_stocks = []
+        
+        # Lista de ações conhecidas como removidas ou problemáticas
+        known_problematic = ['CIEL3.SA', 'OIBR3.SA', 'OIBR4.SA']
+        
+        # Remover da lista do Ibovespa
+        self.ibovespa_stocks = [stock for stock in self.ibovespa_stocks if stock not in known_problematic]
+        
+        # Remover da lista completa da B3
+        self.b3_stocks = [stock for stock in self.b3_stocks if stock not in known_problematic]
+        
+        return len(known_problematic)
+
+    def get_cached_stock_data(self, symbol, period):
+        """Busca o ativo no cache, recortando um download de período maior quando existir"""
+        return cached_stock_data(st.session_state.data_cache, symbol, period)
+
+    def get_stock_data(self, symbols, period="1y", fetch_period=None):
+        """Coleta dados das ações com otimização para grandes volumes e cache.
+
+        fetch_period permite baixar um período maior (ex.: FIIs em 5y) e recortar localmente.
+        """
+        progress_bar = st.progress(0)
+        status_text = st.empty()
+
+        def report(done, total, text):
+            status_text.text(text)
+            progress_bar.progress(done / total)
+
+        data, stats = collect_stock_data(
+            symbols, period, fetch_period, st.session_state.data_cache,
+            cleared_at=st.session_state.get('cache_cleared_at', 0), report=report)
+        
+        progress_bar.empty()
+        status_text.empty()
+
+        publish_downloads(stats)
+        show_load_summary(stats)
+        return data
+
+    def get_benchmark_data(self, cdi_anual=DEFAULT_CDI_ANUAL):
+        """Obtém Ibovespa e CDI (em cache) para as métricas de risco ajustado.
+
+        O Ibovespa é baixado no maior período e alinhado às datas de cada análise,
+        então trocar o período não gera novo download.
+        """
+        ibov = load_benchmark_history(PERIOD_ORDER[-1])
+
+        cdi = None
+        if os.path.exists(CDI_CSV_PATH):
+            try:
+                cdi = load_cdi_series(CDI_CSV_PATH, os.path.getmtime(CDI_CSV_PATH))
+            except Exception:
+                cdi = None
+
+        if cdi is None or cdi.empty:
+            # Sem arquivo local: taxa constante equivalente ao CDI anual informado
+            daily_rate = (1 + cdi_anual / 100) ** (1 / TRADING_DAYS) - 1
+            cdi = pd.Series(daily_rate, index=ibov.index, name='CDI')
+            cdi_source = f"CDI constante de {cdi_anual:.2f}% a.a."
+        else:
+            cdi_source = "CDI diário (arquivo local)"
+
+        return {'ibov': ibov, 'cdi': cdi, 'cdi_source': cdi_source}
+
+    def build_close_matrix(self, data):
+        """Monta a matriz (datas x ativos) de fechamentos alinhados"""
+        return build_close_matrix(data)
+
+    def get_validated_data(self, symbols, period, fetch_period=None):
+        """Dados coletados após a etapa de qualidade: (dados, flags por ativo, impressão digital)"""
+        fingerprint = analysis_data_fingerprint(symbols, period, fetch_period)
+        raw = memoize('data', fingerprint,
+                      lambda: self.get_stock_data(symbols, period, fetch_period=fetch_period))
+        data, flags = memoize('quality', fingerprint, lambda: validate_stock_data(raw))
+        show_quality_report(flags)
+        return data, flags, fingerprint
+
+    def load_analysis(self, symbols, period, benchmark=None, risk_in_score=False,
+                      score_model="default", fetch_period=None, universe=None):
+        """Coleta dados (já pela etapa de qualidade) e calcula métricas com memoização por impressão digital.
+
+        Retorna (dados, métricas, impressão digital) - a impressão digital serve de chave
+        para as figuras e tabelas derivadas. Com universe informado, o ranking calculado
+        é gravado no histórico de snapshots do dia.
+        """
+        data, _, fingerprint = self.get_validated_data(symbols, period, fetch_period)
+
+        def build_metrics():
+            df = self.calculate_metrics(data, benchmark, risk_in_score, score_model=score_model)
+            # O histórico guarda apenas o score base, comparável com o backfill
+            if universe is not None and not risk_in_score:
+                self.record_snapshot(universe, period, data, df)
+            return df
+
+        df = memoize('metrics', data_fingerprint(fingerprint, benchmark is not None, risk_in_score, score_model),
+                     build_metrics)
+        return data, df, fingerprint
+
+    def record_snapshot(self, universe, period, data, df):
+        """Grava o ranking calculado como snapshot do último pregão dos dados"""
+        if df.empty:
+            return
+        try:
+            raw = df['raw_data']
+            date = max(to_daily_index(d['history'].index)[-1] for d in raw)
+            self.snapshots.save(
+                universe, period, date,
+                symbols=[s + '.SA' for s in df['Symbol']],
+                score=df['Score'].to_numpy(dtype=float),
+                price=[d['current_price'] for d in raw],
+                change=[d['price_change'] for d in raw],
+                volatility=[d['volatility'] for d in raw],
+            )
+        except Exception as e:
+            st.warning(f"⚠️ Não foi possível gravar o histórico do ranking: {str(e)}")
+
+    def longest_cached_data(self, symbols):
+        """Para cada ativo, o registro em cache com o maior período baixado"""
+        data = {}
+        for symbol in symbols:
+            for cached_period in reversed(PERIOD_ORDER):
+                cached = st.session_state.data_cache.get(f"{symbol}_{cached_period}")
+                if cached is not None:
+                    stock_data = cached.to_stock_data()
+                    if stock_data is not None:
+                        data[symbol] = stock_data
+                    break
+        return data
+
+    def backfill_snapshots(self, universe, period, symbols, score_model="default", days=90):
+        """Reconstrói em lote os snapshots dos últimos dias a partir dos históricos em cache"""
+        data = self.longest_cached_data(symbols)
+        if not data:
+            return 0
+        return self.snapshots.save_history(universe, period, compute_score_history(data, period, score_model), days)
+
+    def calculate_metrics(self, data, benchmark=None, risk_in_score=False, score_model="default", messages=None):
+        """Calcula métricas de análise com tratamento melhorado de dados.
+
+        score_model="fii" troca o score de momentum pelo Score FII (renda e P/VP). Fora do
+        script da sessão (jobs), os avisos vão para a lista messages em vez da interface.
+        """
+        metrics = []
+        notes = [] if messages is None else messages
+
+        # Métricas de proventos (DY 12m, consistência, P/VP) vetorizadas para todos os ativos
+        try:
+            income = calculate_fii_metrics(data)
+        except Exception as e:
+            notes.append(('warning', f"⚠️ Métricas de proventos indisponíveis: {str(e)}"))
+            income = None
+
+        # Métricas de risco ajustado calculadas em uma única passada matricial
+        risk = None
+        if benchmark is not None and data:
+            try:
+                risk = calculate_risk_metrics(
+                    self.build_close_matrix(data), benchmark['ibov'], benchmark['cdi']
+                )
+            except Exception as e:
+                notes.append(('warning', f"⚠️ Métricas de risco indisponíveis: {str(e)}"))
+                risk = None
+
+        for symbol, stock_data in data.items():
+            try:
+                hist = stock_data['history']
+                
+                # Calcula métricas técnicas
+                ma_20 = hist['Close'].rolling(20).mean().iloc[-1] if len(hist) >= 20 else hist['Close'].mean()
+                ma_50 = hist['Close'].rolling(50).mean().iloc[-1] if len(hist) >= 50 else hist['Close'].mean()
+                current_price = stock_data['current_price']
+                
+                # Score baseado em múltiplos indicadores
+                score = 0
+                
+                # Tendência de preço (30%)
+                if stock_data['price_change'] > 0:
+                    score += 30
+                
+                # Posição relativa às médias móveis (25%)
+                if current_price > ma_20:
+                    score += 12.5
+                if current_price > ma_50:
+                    score += 12.5
+                
+                # Volatilidade (20% - menor volatilidade = melhor)
+                if stock_data['volatility'] < 30:
+                    score += 20
+                elif stock_data['volatility'] < 50:
+                    score += 10
+                
+                # Volume (15%)
+                if stock_data['volume_avg'] > 1000000:
+                    score += 15
+                elif stock_data['volume_avg'] > 500000:
+                    score += 7.5
+                
+                # P/L Ratio (10%) - com tratamento de erros
+                pe_ratio = None
+                try:
+                    pe_ratio = stock_data['fundamentals'].trailing_pe
+                    if pe_ratio and isinstance(pe_ratio, (int, float)) and pe_ratio > 0:
+                        if 10 < pe_ratio < 20:
+                            score += 10
+                        elif pe_ratio < 30:
+                            score += 5
+                    else:
+                        pe_ratio = None
+                except:
+                    pe_ratio = None
+                
+                # Converter P/L para string consistente
+                pe_display = f"{pe_ratio:.2f}" if pe_ratio and pe_ratio > 0 else "N/A"
+
+                risk_row = risk.loc[symbol] if risk is not None and symbol in risk.index else None
+                income_row = income.loc[symbol] if income is not None and symbol in income.index else None
+
+                # Score FII: substitui o score de momentum pelo modelo de renda
+                if score_model == "fii" and income_row is not None:
+                    score = income_row['Score FII']
+
+                # Risco ajustado (opcional): Score = 80% base + até 20 pontos de Sharpe e Alfa
+                if risk_in_score:
+                    risk_score = 0
+                    if risk_row is not None:
+                        if pd.notna(risk_row['Sharpe']):
+                            if risk_row['Sharpe'] >= 1:
+                                risk_score += 10
+                            elif risk_row['Sharpe'] > 0:
+                                risk_score += 5
+                        if pd.notna(risk_row['Alfa (%)']) and risk_row['Alfa (%)'] > 0:
+                            risk_score += 10
+                    score = score * 0.8 + risk_score
+
+                metrics.append({
+                    'Symbol': symbol.replace('.SA', ''),
+                    'Preço Atual': f"R$ {current_price:.2f}",
+                    'Variação (%)': f"{stock_data['price_change']:.2f}%",
+                    'Volatilidade (%)': f"{stock_data['volatility']:.2f}%",
+                    'P/L': pe_display,
+                    'Volume Médio': f"{stock_data['volume_avg']:.0f}",
+                    'Score': round(score, 1),
+                    'MA20': ma_20,
+                    'MA50': ma_50,
+                    'Beta': risk_row['Beta'] if risk_row is not None else np.nan,
+                    'Alfa (%)': risk_row['Alfa (%)'] if risk_row is not None else np.nan,
+                    'Sharpe': risk_row['Sharpe'] if risk_row is not None else np.nan,
+                    'Sortino': risk_row['Sortino'] if risk_row is not None else np.nan,
+                    'Tracking Error (%)': risk_row['Tracking Error (%)'] if risk_row is not None else np.nan,
+                    'DY 12m (%)': income_row['DY 12m (%)'] if income_row is not None else np.nan,
+                    'Consistência (%)': income_row['Consistência (%)'] if income_row is not None else np.nan,
+                    'P/VP': income_row['P/VP'] if income_row is not None else np.nan,
+                    'raw_data': stock_data
+                })
                 
             except Exception as e:
-                st.warning(f"Erro ao calcular métricas para {symbol}: {str(e)}")
+                notes.append(('warning', f"Erro ao calcular métricas para {symbol}: {str(e)}"))
                 continue
+
+        if messages is None:
+            for level, message in notes:
+                getattr(st, level)(message)
+        if not metrics:
+            return pd.DataFrame()
+            
+        df = pd.DataFrame(metrics).sort_values('Score', ascending=False)
+        return df
+
+    def cached_recommendation_chart(self, df, title, fingerprint):
+        """create_recommendation_chart memoizado pela impressão digital dos dados"""
+        return memoize('fig_recommendation', data_fingerprint(fingerprint, title),
+                       lambda: self.create_recommendation_chart(df, title))
+
+    def cached_performance_chart(self, data, df, benchmark, fingerprint, max_assets=5, optimized=True):
+        """create_performance_chart memoizado pela impressão digital e opções de exibição"""
+        return memoize('fig_performance', data_fingerprint(fingerprint, benchmark is not None, max_assets, optimized),
+                       lambda: self.create_performance_chart(data, df['Symbol'].tolist(), benchmark,
+                                                             max_assets=max_assets, optimized=optimized))
+
+    def create_recommendation_chart(self, df, title):
+        """Cria gráfico de recomendações"""
+        top_10 = df.head(10)
+        
+        fig = go.Figure()
+        
+        # Gráfico de barras com cores baseadas no score
+        colors = ['#2e7d32' if score >= 70 else '#ff9800' if score >= 50 else '#f44336' 
+                 for score in top_10['Score']]
         
-        if not metrics:
-            return pd.DataFrame()
+        fig.add_trace(go.Bar(
+            x=top_10['Symbol'],
+            y=top_10['Score'],
+            text=top_10['Score'],
+            textposition='auto',
+            marker_color=colors,
+            name='Score de Recomendação'
+        ))
+        
+        fig.update_layout(
+            title=dict(text=title, x=0.5, font=dict(size=20, color='#2e7d32')),
+            xaxis_title="Ativo",
+            yaxis_title="Score",
+            template="plotly_white",
+            height=500,
+            showlegend=False
+        )
+        
+        return fig
+
+    def create_performance_chart(self, data, symbols, benchmark=None, max_assets=5, optimized=True):
+        """Cria gráfico de performance comparativa com tratamento de erros.
+
+        Com optimized=True as séries longas são reduzidas com LTTB no servidor e o gráfico
+        passa a usar WebGL (Scattergl) quando o total de pontos ultrapassa o limite.
+        """
+        fig = go.Figure()
+        
+        # Filtrar símbolos que têm dados válidos
+        valid_symbols = []
+        for symbol in symbols[:max_assets]:
+            # Verificar se o símbolo já tem .SA ou precisa adicionar
+            symbol_key = symbol + '.SA' if not symbol.endswith('.SA') else symbol
             
-        df = pd.DataFrame(metrics).sort_values('Score', ascending=False)
-        return df
+            if symbol_key in data:
+                try:
+                    hist = data[symbol_key]['history']
+                    if not hist.empty and len(hist) > 5:
+                        valid_symbols.append((symbol, symbol_key))
+                except:
+                    continue
+        
+        if not valid_symbols:
+            # Se não há dados válidos, criar gráfico vazio com mensagem
+            fig.add_annotation(
+                text="Não há dados suficientes para mostrar performance comparativa",
+                xref="paper", yref="paper",
+                x=0.5, y=0.5, xanchor='center', yanchor='middle',
+                showarrow=False,
+                font=dict(size=16, color="gray")
+            )
+        else:
+            # Séries a desenhar: (nome, datas, retornos, estilo da linha)
+            series = []
+            
+            for i, (display_symbol, data_key) in enumerate(valid_symbols):
+                try:
+                    hist = data[data_key]['history']
+                    
+                    # Calcular retorno percentual
+                    returns = (hist['Close'] / hist['Close'].iloc[0] - 1) * 100
+                    
+                    series.append((display_symbol.replace('.SA', ''), hist.index, returns,
+                                   dict(width=2, color=CHART_COLORS[i % len(CHART_COLORS)])))
+                except Exception as e:
+                    continue
+
+            # Benchmarks sobrepostos: Ibovespa e CDI acumulado no mesmo intervalo dos ativos
+            if benchmark is not None:
+                first_hist = data[valid_symbols[0][1]]['history']
+                start = to_daily_index(first_hist.index)[0]
+
+                ibov = benchmark['ibov']
+                ibov = ibov[ibov.index >= start]
+                if len(ibov) > 1:
+                    series.append(('Ibovespa', ibov.index, (ibov / ibov.iloc[0] - 1) * 100,
+                                   dict(width=2, color='#555555', dash='dash')))
+
+                cdi = benchmark['cdi']
+                cdi = cdi[(cdi.index >= start) & (cdi.index <= to_daily_index(first_hist.index)[-1])]
+                if len(cdi) > 1:
+                    series.append(('CDI', cdi.index, ((1 + cdi).cumprod() / (1 + cdi.iloc[0]) - 1) * 100,
+                                   dict(width=2, color='#999999', dash='dot')))
+
+            # Reduzir pontos no servidor preservando a forma das curvas
+            if optimized:
+                reduced = []
+                for name, x, y, line in series:
+                    valid = np.isfinite(np.asarray(y, dtype=float))
+                    x, y = pd.DatetimeIndex(x)[valid], np.asarray(y, dtype=float)[valid]
+                    keep = lttb_downsample(x.asi8, y, CHART_MAX_POINTS)
+                    reduced.append((name, x[keep], y[keep], line))
+                series = reduced
+
+            total_points = sum(len(y) for _, _, y, _ in series)
+            trace_class = go.Scattergl if optimized and total_points > WEBGL_POINT_THRESHOLD else go.Scatter
+
+            for name, x, y, line in series:
+                fig.add_trace(trace_class(
+                    x=x,
+                    y=y,
+                    mode='lines',
+                    name=name,
+                    line=line,
+                    hovertemplate='<b>%{fullData.name}</b><br>' +
+                                'Data: %{x}<br>' +
+                                'Retorno: %{y:.2f}%<br>' +
+                                '<extra></extra>'
+                ))
+        
+        fig.update_layout(
+            title=dict(text="Performance Comparativa (Últimos 12 Meses)", 
+                      x=0.5, font=dict(size=20, color='#2e7d32')),
+            xaxis_title="Data",
+            yaxis_title="Retorno (%)",
+            template="plotly_white",
+            height=500,
+            hovermode='x unified',
+            legend=dict(
+                orientation="h",
+                yanchor="bottom",
+                y=1.02,
+                xanchor="right",
+                x=1
+            )
+        )
+        
+        return fig
+
+    def create_spread_chart(self, aligned, pair):
+        """Cria gráfico do spread normalizado (z-score) de um par cointegrado.
+
+        aligned é a matriz alinhada do scanner (align_pair_closes): mesmas datas, hedge ratio
+        e intercepto do teste, então o último ponto coincide com o Z-Score Atual do ranking.
+        """
+        spread = (np.log(aligned[pair['Ativo A']]) - pair['Hedge Ratio'] * np.log(aligned[pair['Ativo B']])
+                  - pair['Intercepto'])
+        z_score = (spread - spread.mean()) / spread.std(ddof=0)
+
+        fig = go.Figure()
+        fig.add_trace(go.Scatter(
+            x=z_score.index,
+            y=z_score,
+            mode='lines',
+            name='Z-Score do Spread',
+            line=dict(width=2, color='#1f77b4'),
+            hovertemplate='Data: %{x}<br>Z-Score: %{y:.2f}<extra></extra>'
+        ))
+
+        for level, color in [(2, '#f44336'), (-2, '#f44336'), (0, '#999999')]:
+            fig.add_hline(y=level, line=dict(color=color, width=1, dash='dash'))
+
+        fig.update_layout(
+            title=dict(text=f"Spread {pair['Par']} (Half-life: {pair['Half-life (dias)']:.1f} dias)",
+                       x=0.5, font=dict(size=18, color='#2e7d32')),
+            xaxis_title="Data",
+            yaxis_title="Z-Score",
+            template="plotly_white",
+            height=400,
+            showlegend=False
+        )
+
+        return fig
+
+# Screener: campos disponíveis nas expressões (apelido -> coluna da tabela colunar)
+SCREENER_FIELDS = {
+    'close': 'close', 'price': 'close', 'preco': 'close',
+    'change': 'change', 'variacao': 'change',
+    'volatility': 'volatility', 'vol': 'volatility', 'volatilidade': 'volatility',
+    'volume': 'volume',
+    'pe': 'pe', 'pl': 'pe',
+    'score': 'score',
+    'ma20': 'ma20', 'ma50': 'ma50',
+    'rsi': 'rsi14', 'rsi14': 'rsi14',
+    'ret1m': 'ret1m',
+    'beta': 'beta', 'alpha': 'alpha', 'alfa': 'alpha',
+    'sharpe': 'sharpe', 'sortino': 'sortino', 'te': 'tracking_error',
+    'dy': 'dy', 'consistency': 'consistency', 'consistencia': 'consistency',
+    'pvp': 'pvp',
+}
+SCREENER_COLUMNS = ['close', 'change', 'volatility', 'volume', 'pe', 'score', 'ma20', 'ma50', 'rsi14',
+                    'ret1m', 'beta', 'alpha', 'sharpe', 'sortino', 'tracking_error', 'dy', 'consistency', 'pvp']
+SCREENS_PATH = os.environ.get(
+    'SCREENS_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'saved_screens.json')
+)
+
+class ScreenerQuery:
+    """Expressões de filtro sobre a tabela de métricas, ex.:
+    "volatility < 30 and pe between 8 and 15 and close > ma50".
+
+    A expressão é compilada uma vez em uma função que devolve a máscara booleana
+    (numpy) de todos os ativos, sem laços por linha. Valores ausentes (NaN) seguem a lógica
+    de três valores: cada nó devolve as máscaras (verdadeiro, falso) e uma comparação com
+    NaN não é nenhum dos dois, então "not" e "!=" não a tornam verdadeira e "or" ainda
+    aceita o ativo pelo outro lado.
+    """
+
+    TOKEN_RE = re.compile(r"\s*(?:(\d+(?:\.\d*)?|\.\d+)|(<=|>=|==|!=|<|>|=)|([A-Za-z_][A-Za-z0-9_]*)|(\(|\))|(-))")
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = self._tokenize(text)
+        self.pos = 0
+        self.evaluate = self._parse_or()
+        if self.pos != len(self.tokens):
+            raise ValueError(f"Trecho inesperado: '{self.tokens[self.pos][1]}'")
+        self.fields = sorted({SCREENER_FIELDS[value] for kind, value in self.tokens if kind == 'name'})
+
+    def _tokenize(self, text):
+        tokens = []
+        pos = 0
+        text = text.strip()
+        while pos < len(text):
+            match = self.TOKEN_RE.match(text, pos)
+            if not match or match.end() == pos:
+                raise ValueError(f"Caractere inválido na posição {pos + 1}: '{text[pos]}'")
+            number, op, name, paren, minus = match.groups()
+            if number is not None:
+                tokens.append(('num', float(number)))
+            elif op is not None:
+                tokens.append(('op', '==' if op == '=' else op))
+            elif name is not None:
+                lowered = name.lower()
+                kind = 'kw' if lowered in ('and', 'or', 'not', 'between') else 'name'
+                tokens.append((kind, lowered))
+            elif paren is not None:
+                tokens.append(('paren', paren))
+            else:
+                tokens.append(('minus', minus))
+            pos = match.end()
+            while pos < len(text) and text[pos].isspace():
+                pos += 1
+        return tokens
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def _take(self, kind=None, value=None):
+        token = self._peek()
+        if token[0] is None or (kind and token[0] != kind) or (value and token[1] != value):
+            expected = value or kind or 'expressão'
+            found = token[1] if token[0] else 'fim da expressão'
+            raise ValueError(f"Esperado '{expected}', encontrado '{found}'")
+        self.pos += 1
+        return token
+
+    def _parse_or(self):
+        left = self._parse_and()
+        while self._peek() == ('kw', 'or'):
+            self._take()
+            right = self._parse_and()
+            left = (lambda l, r: lambda cols: self._or(l(cols), r(cols)))(left, right)
+        return left
+
+    def _parse_and(self):
+        left = self._parse_not()
+        while self._peek() == ('kw', 'and'):
+            self._take()
+            right = self._parse_not()
+            left = (lambda l, r: lambda cols: self._and(l(cols), r(cols)))(left, right)
+        return left
+
+    @staticmethod
+    def _or(left, right):
+        return left[0] | right[0], left[1] & right[1]
+
+    @staticmethod
+    def _and(left, right):
+        return left[0] & right[0], left[1] | right[1]
+
+    @staticmethod
+    def _compare(result, *values):
+        """(verdadeiro, falso) de uma comparação: com algum operando NaN, nenhum dos dois"""
+        known = np.isfinite(values[0])
+        for value in values[1:]:
+            known = known & np.isfinite(value)
+        return result & known, ~result & known
+
+    def _parse_not(self):
+        if self._peek() == ('kw', 'not'):
+            self._take()
+            inner = self._parse_not()
+            return lambda cols: inner(cols)[::-1]
+        return self._parse_comparison()
+
+    def _parse_comparison(self):
+        if self._peek() == ('paren', '('):
+            self._take()
+            inner = self._parse_or()
+            self._take('paren', ')')
+            return inner
+
+        left = self._parse_operand()
+        if self._peek() == ('kw', 'between'):
+            self._take()
+            low = self._parse_operand()
+            self._take('kw', 'and')
+            high = self._parse_operand()
+            def between(cols):
+                value, lower, upper = left(cols), low(cols), high(cols)
+                return self._compare((value >= lower) & (value <= upper), value, lower, upper)
+            return between
+
+        op = self._take('op')[1]
+        right = self._parse_operand()
+        compare = {
+            '<': np.less, '<=': np.less_equal, '>': np.greater,
+            '>=': np.greater_equal, '==': np.equal, '!=': np.not_equal,
+        }[op]
+        def comparison(cols):
+            a, b = left(cols), right(cols)
+            return self._compare(compare(a, b), a, b)
+        return comparison
+
+    def _parse_operand(self):
+        kind, value = self._peek()
+        if kind == 'minus':
+            self._take()
+            number = -self._take('num')[1]
+            return lambda cols: number
+        if kind == 'num':
+            self._take()
+            return lambda cols: value
+        if kind == 'name':
+            self._take()
+            if value not in SCREENER_FIELDS:
+                raise ValueError(f"Campo desconhecido: '{value}'")
+            column = SCREENER_FIELDS[value]
+            return lambda cols: cols[column]
+        raise ValueError(f"Esperado número ou campo, encontrado '{value if kind else 'fim da expressão'}'")
+
+    def mask(self, columns):
+        """Máscara booleana dos ativos para os quais a expressão é verdadeira"""
+        with np.errstate(invalid='ignore'):
+            return np.asarray(self.evaluate(columns)[0], dtype=bool)
+
+def compile_screen(text):
+    """Compila (com cache) uma expressão do screener"""
+    cache = st.session_state.setdefault('screen_cache', OrderedDict())
+    if text not in cache:
+        cache[text] = ScreenerQuery(text)
+        while len(cache) > 32:
+            cache.popitem(last=False)
+    return cache[text]
+
+def build_screener_table(universes):
+    """Tabela colunar (um array numpy por métrica) para o universo combinado.
+
+    universes: lista de (nome do universo, dados, métricas) já calculados.
+    """
+    frames = []
+    for universe, data, df in universes:
+        if df.empty:
+            continue
+        closes = build_close_matrix(data).ffill()
+
+        # Indicadores vetorizados sobre a matriz (datas x ativos) de fechamentos
+        delta = closes.diff()
+        gain = delta.clip(lower=0).ewm(alpha=1 / 14, adjust=False).mean().iloc[-1]
+        loss = (-delta.clip(upper=0)).ewm(alpha=1 / 14, adjust=False).mean().iloc[-1]
+        rsi = 100 - 100 / (1 + gain / loss)
+        ret1m = (closes.iloc[-1] / closes.shift(21).iloc[-1] - 1) * 100
+
+        symbols = [s + '.SA' for s in df['Symbol']]
+        raw = df['raw_data']
+        frame = pd.DataFrame({
+            'symbol': df['Symbol'].to_numpy(),
+            'universe': universe,
+            'close': [r['current_price'] for r in raw],
+            'change': [r['price_change'] for r in raw],
+            'volatility': [r['volatility'] for r in raw],
+            'volume': [r['volume_avg'] for r in raw],
+            'pe': [r['fundamentals'].trailing_pe for r in raw],
+            'score': df['Score'].to_numpy(dtype=float),
+            'ma20': df['MA20'].to_numpy(dtype=float),
+            'ma50': df['MA50'].to_numpy(dtype=float),
+            'rsi14': rsi.reindex(symbols).to_numpy(dtype=float),
+            'ret1m': ret1m.reindex(symbols).to_numpy(dtype=float),
+            'beta': df['Beta'].to_numpy(dtype=float),
+            'alpha': df['Alfa (%)'].to_numpy(dtype=float),
+            'sharpe': df['Sharpe'].to_numpy(dtype=float),
+            'sortino': df['Sortino'].to_numpy(dtype=float),
+            'tracking_error': df['Tracking Error (%)'].to_numpy(dtype=float),
+            'dy': df['DY 12m (%)'].to_numpy(dtype=float),
+            'consistency': df['Consistência (%)'].to_numpy(dtype=float),
+            'pvp': df['P/VP'].to_numpy(dtype=float),
+        })
+        frames.append(frame)
+
+    if not frames:
+        return pd.DataFrame(columns=['symbol', 'universe'] + SCREENER_COLUMNS)
+
+    table = pd.concat(frames, ignore_index=True).drop_duplicates('symbol')
+    table[SCREENER_COLUMNS] = table[SCREENER_COLUMNS].astype(float)
+    return table.reset_index(drop=True)
+
+def run_screen(table, query, sort_by='score', descending=True, top_n=50):
+    """Aplica a expressão, ordena e devolve os top-N ativos"""
+    columns = {col: table[col].to_numpy() for col in SCREENER_COLUMNS}
+    result = table[query.mask(columns)] if query is not None else table
+    return result.sort_values(sort_by, ascending=not descending, na_position='last').head(top_n)
+
+def load_saved_screens(path=SCREENS_PATH):
+    """Telas salvas pelo usuário (nome -> parâmetros)"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_screens(screens, path=SCREENS_PATH):
+    """Grava as telas salvas de forma atômica"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(screens, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+ALERT_RULES_PATH = os.environ.get(
+    'ALERT_RULES_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'alert_rules.json')
+)
+ALERT_LOG_PATH = os.environ.get(
+    'ALERT_LOG_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'alerts.log')
+)
+ALERT_RECENT = 200
+# Campos disponíveis a cada candle (métricas de IncrementalIndicators)
+ALERT_COLUMNS = ['close', 'change', 'volatility', 'volume', 'pe', 'score', 'ma20', 'ma50']
+ALERT_CROSS_RE = re.compile(r'^\s*(.+?)\s+(?:crosses|cruza)(?:\s+(above|below|acima|abaixo))?\s+(.+?)\s*$', re.I)
+ALERT_SIMPLE_RE = re.compile(r'^\s*([A-Za-z_]\w*)\s*(<=|>=|<|>)\s*(-?\d+(?:\.\d*)?)\s*$')
+ALERT_OPS = {'<': np.less, '<=': np.less_equal, '>': np.greater, '>=': np.greater_equal}
+
+class AlertRule:
+    """Regra de alerta compilada, ex.: "score crosses above 70", "close crosses ma50", "volatility > 50".
+
+    A condição é uma expressão do screener; "A crosses above B" vira "A > B" e dispara quando
+    passa de falsa a verdadeira ("crosses" sem direção dispara nas duas mudanças).
+    """
+
+    __slots__ = ('id', 'text', 'watchlist', 'condition', 'on_change', 'simple')
+
+    def __init__(self, text, watchlist=None, rule_id=None):
+        self.id = rule_id or uuid.uuid4().hex[:8]
+        self.text = text.strip()
+        self.watchlist = watchlist or None
+        self.on_change = False
+
+        cross = ALERT_CROSS_RE.match(self.text)
+        if cross:
+            left, direction, right = cross.groups()
+            direction = (direction or '').lower()
+            op = '<' if direction in ('below', 'abaixo') else '>'
+            self.on_change = not direction
+            self.condition = f"{left} {op} {right}"
+        else:
+            self.condition = self.text
+
+        query = ScreenerQuery(self.condition)
+        unavailable = sorted(set(query.fields) - set(ALERT_COLUMNS))
+        if unavailable:
+            raise ValueError(f"Campo indisponível para alertas: {', '.join(unavailable)}")
+
+        # "campo op número": comparação agrupada com as demais regras do mesmo campo e operador
+        simple = ALERT_SIMPLE_RE.match(self.condition)
+        if simple and simple.group(1).lower() in SCREENER_FIELDS:
+            self.simple = (SCREENER_FIELDS[simple.group(1).lower()], simple.group(2), float(simple.group(3)))
+        else:
+            self.simple = None
+
+    def to_dict(self):
+        return {'id': self.id, 'text': self.text, 'watchlist': self.watchlist}
+
+class AlertEngine:
+    """Avalia regras de alerta de forma incremental sobre as métricas de um universo.
+
+    Regras "campo op número" com o mesmo campo e operador viram uma única comparação
+    matricial (regras x ativos) e as demais expressões são avaliadas uma vez por texto
+    distinto. A cada lote só os ativos atualizados são reavaliados, contra o estado
+    anterior de cada par (regra, ativo).
+    """
+
+    def __init__(self, rules, watchlists, symbols):
+        self.rules = list(rules)
+        self.watchlists = watchlists
+        self.symbols = list(symbols)
+        self.membership = self._membership(self.symbols)
+        self.on_change = np.array([rule.on_change for rule in self.rules], dtype=bool)
+
+        groups, expressions = {}, {}
+        for i, rule in enumerate(self.rules):
+            if rule.simple is not None:
+                column, op, threshold = rule.simple
+                groups.setdefault((column, op), []).append((i, threshold))
+            else:
+                expressions.setdefault(rule.condition, []).append(i)
+        self.groups = [(column, ALERT_OPS[op], np.array([i for i, _ in items]),
+                        np.array([t for _, t in items])[:, None])
+                       for (column, op), items in groups.items()]
+        self.expressions = [(ScreenerQuery(text), np.array(rows)) for text, rows in expressions.items()]
+
+        self.state = np.zeros((len(self.rules), len(self.symbols)), dtype=bool)
+        self.known = np.zeros(len(self.symbols), dtype=bool)
+
+    def _membership(self, symbols):
+        """Matriz (regras x ativos) de quem cada regra acompanha (todos, ou os da watchlist)"""
+        codes = [s.replace('.SA', '') for s in symbols]
+        membership = np.ones((len(self.rules), len(symbols)), dtype=bool)
+        for i, rule in enumerate(self.rules):
+            if rule.watchlist is not None:
+                members = set(self.watchlists.get(rule.watchlist, []))
+                membership[i] = [code in members for code in codes]
+        return membership
+
+    def extend(self, symbols):
+        """Acrescenta ativos ao fim da lista, preservando o estado dos que já eram acompanhados"""
+        symbols = list(symbols)
+        self.membership = np.hstack([self.membership, self._membership(symbols)])
+        self.state = np.hstack([self.state, np.zeros((len(self.rules), len(symbols)), dtype=bool)])
+        self.known = np.concatenate([self.known, np.zeros(len(symbols), dtype=bool)])
+        self.symbols += symbols
+
+    def evaluate(self, columns, updated=None):
+        """Reavalia os ativos atualizados; devolve [(regra, símbolo, condição atual)] dos disparos.
+
+        A primeira avaliação de cada ativo só registra o estado (sem disparos).
+        """
+        idx = np.arange(len(self.symbols)) if updated is None else np.flatnonzero(updated)
+        if not len(idx) or not self.rules:
+            return []
+        # Todos atualizados (caso comum a cada candle): fatias evitam copiar as matrizes de estado
+        columns_idx = slice(None) if len(idx) == len(self.symbols) else idx
+        values = {column: np.asarray(columns[column], dtype=float)[columns_idx] for column in ALERT_COLUMNS}
+
+        current = np.empty((len(self.rules), len(idx)), dtype=bool)
+        with np.errstate(invalid='ignore'):
+            for column, compare, rows, thresholds in self.groups:
+                current[rows] = compare(values[column][None, :], thresholds)
+            for query, rows in self.expressions:
+                current[rows] = query.mask(values)[None, :]
+        current &= self.membership[:, columns_idx]
+
+        changed = current != self.state[:, columns_idx]
+        changed[~self.on_change] &= current[~self.on_change]
+        changed &= self.known[columns_idx][None, :]
+        self.state[:, columns_idx] = current
+        self.known[idx] = True
+
+        rows, cols = np.nonzero(changed)
+        return [(self.rules[r], self.symbols[idx[c]], bool(current[r, c])) for r, c in zip(rows, cols)]
+
+class DailyBars:
+    """Últimas métricas diárias de cada ativo baixado, no formato dos indicadores intraday.
+
+    Fonte dos alertas na coleta diária: cada lote de históricos novos atualiza só as linhas
+    dos seus ativos (os demais mantêm os valores anteriores) e ativos novos entram no fim.
+    O Score é o de momentum, como no intraday.
+    """
+
+    def __init__(self):
+        self.symbols = []
+        self._positions = {}
+        self._values = np.empty((0, 7))
+        self._latest = None
+
+    def update(self, data):
+        """Aplica os registros {símbolo: dados do período}; devolve a máscara dos ativos atualizados"""
+        symbols = list(data)
+        new = [s for s in symbols if s not in self._positions]
+        for symbol in new:
+            self._positions[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        self._values = np.vstack([self._values, np.full((len(new), 7), np.nan)])
+
+        closes = [np.asarray(data[s]['history']['Close'], dtype=float) for s in symbols]
+        rows = np.array([self._positions[s] for s in symbols], dtype=int)
+        self._values[rows] = np.column_stack([
+            [data[s]['current_price'] for s in symbols],
+            [data[s]['price_change'] for s in symbols],
+            [close[-20:].mean() for close in closes],
+            [close[-50:].mean() for close in closes],
+            [data[s]['volatility'] for s in symbols],
+            [data[s]['volume_avg'] for s in symbols],
+            [data[s]['fundamentals'].trailing_pe for s in symbols],
+        ]).astype(float)
+        latest = max(data[s]['history'].index[-1] for s in symbols)
+        self._latest = latest if self._latest is None else max(self._latest, latest)
+
+        updated = np.zeros(len(self.symbols), dtype=bool)
+        updated[rows] = True
+        return updated
+
+    def latest_time(self):
+        """Data do último pregão recebido, ou None antes do primeiro lote"""
+        return self._latest
+
+    def metrics(self):
+        """Métricas e Score atuais de todos os ativos já recebidos"""
+        price, change, ma20, ma50, volatility, volume, pe = self._values.T
+        score = momentum_score(change, price, ma20, ma50, volatility, volume, pe)
+        return pd.DataFrame({
+            'price': price, 'change': change, 'ma20': ma20, 'ma50': ma50,
+            'volatility': volatility, 'volume': volume, 'pe': pe, 'score': score,
+        }, index=pd.Index(self.symbols, name='symbol'))
+
+def load_alert_config(path=ALERT_RULES_PATH):
+    """Watchlists (nome -> códigos) e regras de alerta salvas"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        config = {}
+    return {'watchlists': config.get('watchlists', {}), 'rules': config.get('rules', [])}
+
+def save_alert_config(config, path=ALERT_RULES_PATH):
+    """Grava watchlists e regras de forma atômica"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+class AlertManager:
+    """Regras do arquivo local avaliadas a cada lote de candles ou de históricos diários novos;
+    disparos vão para um log JSON lines.
+
+    Há um AlertEngine por fonte (intervalo intraday ou período da coleta diária), recompilado
+    quando o arquivo de regras ou a lista de ativos muda (o estado recomeça sem disparos);
+    ativos novos no fim da lista só ampliam o motor.
+    """
+
+    def __init__(self, rules_path=ALERT_RULES_PATH, log_path=ALERT_LOG_PATH):
+        self.rules_path = rules_path
+        self.log_path = log_path
+        self.recent = deque(maxlen=ALERT_RECENT)
+        self.stats = {}
+        self._engines = {}
+        self._daily = {}
+        self._lock = threading.RLock()
+
+    def _version(self):
+        try:
+            return os.stat(self.rules_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _engine(self, source, symbols):
+        version = self._version()
+        entry = self._engines.get(source)
+        if entry is not None and entry[0] == version and symbols[:len(entry[1].symbols)] == entry[1].symbols:
+            if len(symbols) > len(entry[1].symbols):
+                entry[1].extend(symbols[len(entry[1].symbols):])
+            return entry[1]
+        config = load_alert_config(self.rules_path)
+        rules = []
+        for item in config['rules']:
+            try:
+                rules.append(AlertRule(item['text'], item.get('watchlist'), item.get('id')))
+            except (KeyError, ValueError):
+                continue  # regra inválida editada à mão: ignorada
+        engine = AlertEngine(rules, config['watchlists'], symbols)
+        self._engines[source] = (version, engine)
+        return engine
+
+    def on_bars(self, source, indicators, updated, initial=False):
+        """Listener do motor intraday: avalia as regras nos ativos atualizados e registra os disparos"""
+        start = time.perf_counter()
+        metrics = indicators.metrics()
+        columns = {'close': metrics['price'].to_numpy()}
+        columns.update({column: metrics[column].to_numpy() for column in ALERT_COLUMNS if column != 'close'})
+
+        with self._lock:
+            engine = self._engine(source, indicators.symbols)
+            fired = engine.evaluate(columns, updated)
+            if initial:
+                fired = []  # carga inicial: histórico, não alerta
+            latest = indicators.latest_time()
+            alerts = []
+            for rule, symbol, active in fired:
+                i = engine.symbols.index(symbol)
+                alerts.append({
+                    'time': f"{latest:%Y-%m-%dT%H:%M:%SZ}" if latest is not None else None,
+                    'source': source, 'rule': rule.id, 'text': rule.text, 'watchlist': rule.watchlist,
+                    'symbol': symbol.replace('.SA', ''), 'active': active,
+                    'price': round(float(columns['close'][i]), 2), 'score': float(columns['score'][i]),
+                })
+            self.recent.extend(alerts)
+            evaluated = len(engine.symbols) if updated is None else np.count_nonzero(updated)
+            self.stats = {'rules': len(engine.rules), 'symbols': int(evaluated),
+                          'fired': len(alerts), 'seconds': time.perf_counter() - start}
+            if alerts:
+                self._write(alerts)
+        return alerts
+
+    def on_daily(self, period, data):
+        """Coleta diária: avalia as regras nos ativos com histórico recém-baixado (fonte "diário <período>")"""
+        if not data:
+            return []
+        with self._lock:
+            bars = self._daily.setdefault(period, DailyBars())
+            updated = bars.update(data)
+            return self.on_bars(f"diário {period}", bars, updated)
+
+    def _write(self, alerts):
+        try:
+            with open(self.log_path, 'a', encoding='utf-8') as f:
+                for alert in alerts:
+                    f.write(json.dumps(alert, ensure_ascii=False) + '\n')
+        except OSError as e:
+            self.stats['log_error'] = str(e)
+
+@st.cache_resource
+def get_alert_manager():
+    """Gerenciador de alertas compartilhado entre sessões e reruns"""
+    return AlertManager()
+
+def _load_screen_into_state():
+    """Callback: preenche os campos do screener com a tela salva escolhida"""
+    name = st.session_state.get('screener_saved')
+    screen = load_saved_screens().get(name)
+    if screen:
+        st.session_state.screener_query = screen['query']
+        st.session_state.screener_sort = screen['sort_by']
+        st.session_state.screener_desc = screen['descending']
+        st.session_state.screener_top_n = screen['top_n']
+
+def render_screener(table):
+    """Interface do screener: expressão, ordenação, top-N e telas salvas"""
+    screens = load_saved_screens()
+    st.selectbox("📂 Telas salvas:", ["(nova)"] + sorted(screens), key="screener_saved",
+                 on_change=_load_screen_into_state)
+
+    query_text = st.text_area(
+        "Expressão de filtro:",
+        value="volatility < 30 and pe between 8 and 15 and close > ma50",
+        key="screener_query",
+        help="Operadores: < <= > >= == != , between X and Y, and, or, not e parênteses. "
+             "Campos podem ser comparados entre si (ex.: close > ma50)."
+    )
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        sort_by = st.selectbox("Ordenar por:", SCREENER_COLUMNS, index=SCREENER_COLUMNS.index('score'),
+                               key="screener_sort")
+    with col2:
+        descending = st.toggle("Decrescente", value=True, key="screener_desc")
+    with col3:
+        top_n = st.number_input("Top N:", min_value=1, max_value=1000, value=50, key="screener_top_n")
+
+    query = None
+    if query_text.strip():
+        try:
+            query = compile_screen(query_text.strip())
+        except ValueError as e:
+            st.error(f"❌ Expressão inválida: {str(e)}")
+            return
+
+    start = time.perf_counter()
+    result = run_screen(table, query, sort_by, descending, int(top_n))
+    elapsed = (time.perf_counter() - start) * 1000
+
+    st.caption(f"⚡ {len(result)} de {len(table)} ativos em {elapsed:.1f} ms")
+    st.dataframe(result.round(2), use_container_width=True, hide_index=True)
+
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        screen_name = st.text_input("Nome da tela:", key="screener_name")
+    with col2:
+        st.write("")
+        if st.button("💾 Salvar tela", key="screener_save") and screen_name.strip():
+            screens[screen_name.strip()] = {
+                'query': query_text.strip(), 'sort_by': sort_by,
+                'descending': bool(descending), 'top_n': int(top_n),
+            }
+            try:
+                save_screens(screens)
+                st.success(f"Tela '{screen_name.strip()}' salva!")
+            except OSError as e:
+                st.warning(f"⚠️ Não foi possível salvar a tela: {str(e)}")
+
+    with st.expander("ℹ️ Campos disponíveis"):
+        aliases = {}
+        for alias, column in SCREENER_FIELDS.items():
+            aliases.setdefault(column, []).append(alias)
+        st.markdown("\n".join(f"- **{column}:** {', '.join(names)}" for column, names in aliases.items()))
+
+# Tabela de resultados: faixas de cor do Score e opções de paginação
+SCORE_BAND_COLORS = ['#e8f5e8', '#fff3e0', '#ffebee']
+GRID_PAGE_SIZES = [25, 50, 100, 250]
+GRID_SORT_KEYS = {
+    'Preço Atual': lambda col: pd.to_numeric(col.str.replace('R$ ', '', regex=False), errors='coerce'),
+    'Variação (%)': lambda col: pd.to_numeric(col.str.replace('%', '', regex=False), errors='coerce'),
+    'Volatilidade (%)': lambda col: pd.to_numeric(col.str.replace('%', '', regex=False), errors='coerce'),
+    'P/L': lambda col: pd.to_numeric(col, errors='coerce'),
+}
+
+def score_band_styles(frame):
+    """Estilos de todas as células calculados de uma vez a partir da coluna numérica Score"""
+    score = pd.to_numeric(frame['Score'], errors='coerce').to_numpy(dtype=float)
+    colors = np.select([score >= 70, score >= 50, ~np.isnan(score)], SCORE_BAND_COLORS, '#f5f5f5')
+    css = np.char.add('background-color: ', colors.astype(str))
+    return pd.DataFrame(np.repeat(css[:, None], frame.shape[1], axis=1),
+                        index=frame.index, columns=frame.columns)
+
+def build_results_table(df, numeric_columns):
+    """Prepara a tabela de exibição (compatível com Arrow) e as chaves numéricas de ordenação"""
+    display_df = df[['Symbol', 'Preço Atual', 'Variação (%)', 
+                     'Volatilidade (%)', 'P/L'] + numeric_columns + ['Score']].copy()
+    display_df['Score'] = display_df['Score'].astype(float)
+
+    sort_keys = pd.DataFrame(index=display_df.index)
+    for col in display_df.columns:
+        if col in GRID_SORT_KEYS:
+            sort_keys[col] = GRID_SORT_KEYS[col](display_df[col].astype(str))
+        elif col in numeric_columns or col == 'Score':
+            sort_keys[col] = pd.to_numeric(display_df[col], errors='coerce')
+        else:
+            sort_keys[col] = display_df[col]
+
+    for col in numeric_columns:
+        display_df[col] = display_df[col].map(lambda v: f"{v:.2f}" if pd.notna(v) else "N/A")
+    display_df = display_df.fillna('N/A')  # Substituir valores nulos
+    return display_df, sort_keys
+
+def render_results_grid(df, numeric_columns, fingerprint, key):
+    """Tabela paginada no servidor: filtra, ordena e envia ao navegador apenas a página visível"""
+    display_df, sort_keys = memoize('table', data_fingerprint(fingerprint, tuple(numeric_columns)),
+                                    lambda: build_results_table(df, numeric_columns))
+
+    col1, col2, col3, col4 = st.columns([2, 2, 2, 1])
+    with col1:
+        search = st.text_input("🔎 Filtrar ativo:", key=f"{key}_search").strip().upper()
+    with col2:
+        min_score = st.slider("Score mínimo:", 0, 100, 0, key=f"{key}_min_score")
+    with col3:
+        sort_column = st.selectbox("Ordenar por:", list(display_df.columns),
+                                   index=list(display_df.columns).index('Score'), key=f"{key}_sort")
+    with col4:
+        descending = st.toggle("Decrescente", value=True, key=f"{key}_desc")
+
+    # Filtro e ordenação vetorizados sobre as chaves numéricas
+    mask = sort_keys['Score'].to_numpy() >= min_score
+    if search:
+        mask &= display_df['Symbol'].str.contains(search, regex=False).to_numpy()
+    order = sort_keys.loc[mask, sort_column].sort_values(ascending=not descending, na_position='last').index
+    total = len(order)
+
+    col1, col2, col3 = st.columns([1, 1, 2])
+    with col1:
+        page_size = st.selectbox("Linhas por página:", GRID_PAGE_SIZES, key=f"{key}_page_size")
+    n_pages = max(1, -(-total // page_size))
+    with col2:
+        page = st.number_input("Página:", min_value=1, max_value=n_pages, value=1, key=f"{key}_page")
+    page = min(page, n_pages)
+
+    page_df = display_df.loc[order[(page - 1) * page_size:page * page_size]]
+    with col3:
+        first = (page - 1) * page_size + 1 if total else 0
+        st.caption(f"Mostrando {first}–{min(page * page_size, total)} de {total} ativos "
+                   f"(página {page}/{n_pages})")
+
+    try:
+        styled_df = page_df.style.apply(score_band_styles, axis=None)
+        st.dataframe(styled_df, use_container_width=True)
+    except Exception as e:
+        # Se falhar com estilo, mostrar sem formatação
+        st.dataframe(page_df, use_container_width=True)
+        st.warning(f"⚠️ Formatação de cores não disponível: {str(e)}")
+
+# Tipo de análise -> universo usado no histórico de rankings
+UNIVERSE_KEYS = {
+    "Ações do Ibovespa": "ibovespa",
+    "Todas as Ações da B3": "b3",
+    "Fundos Imobiliários (FIIs)": "fiis",
+    "Fundos Agroindustriais": "agro",
+}
+
+def render_ranking_history(analyzer, universe, period, df, score_model):
+    """Evolução do Score de um ativo, maiores variações da semana e backfill do histórico"""
+    store = analyzer.snapshots
+    dates = store.dates(universe, period)
+    st.caption(f"💾 {len(dates)} snapshots diários gravados para este universo e período ({period})")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        symbol = st.selectbox("Evolução do Score:", df['Symbol'].tolist(), key="history_symbol")
+        trend = store.score_trend(universe, period, symbol + '.SA')
+        if len(trend) > 1:
+            fig = go.Figure(go.Scatter(x=trend.index, y=trend.values, mode='lines+markers',
+                                       line=dict(width=2, color='#2e7d32')))
+            fig.update_layout(template="plotly_white", height=300, yaxis=dict(range=[0, 100]),
+                              margin=dict(l=20, r=20, t=20, b=20), yaxis_title="Score")
+            st.plotly_chart(fig, use_container_width=True, key="history_trend")
+        else:
+            st.info("📋 Histórico insuficiente para este ativo. Use o backfill abaixo.")
+
+    with col2:
+        st.markdown("**🚀 Maiores variações de Score (7 dias)**")
+        movers = store.biggest_movers(universe, period, days=7)
+        if movers.empty:
+            st.info("📋 São necessários ao menos dois snapshots.")
+        else:
+            st.dataframe(movers.round(1), use_container_width=True, hide_index=True)
+
+    if st.button("🧱 Reconstruir histórico (backfill de 90 dias)", key="history_backfill",
+                 help="Calcula os rankings passados em lote a partir dos históricos já em cache"):
+        symbols = [s + '.SA' for s in df['Symbol']]
+        written = analyzer.backfill_snapshots(universe, period, symbols, score_model)
+        if written:
+            st.success(f"✅ {written} snapshots gravados")
+        else:
+            st.warning("⚠️ Históricos em cache não cobrem o período selecionado. "
+                       "Analise um período maior para reconstruir o histórico.")
+    st.caption("ℹ️ No backfill, P/L e P/VP são os fundamentos atuais aplicados a todas as datas: "
+               "o provedor não informa valores históricos.")
+
+def analysis_plan(analyzer, analysis):
+    """Conjuntos de ativos que cada tipo de análise carrega: [(seção, símbolos, período de download)]"""
+    analysis_type = analysis['analysis_type']
+    num_stocks, num_fiis = analysis['num_stocks'], analysis['num_fiis']
+    # Opções "Todas"/"Todos" (texto) selecionam o universo inteiro
+    stocks = analyzer.b3_stocks if isinstance(num_stocks, str) else analyzer.b3_stocks[:num_stocks]
+    fiis = analyzer.real_estate_funds if isinstance(num_fiis, str) else analyzer.real_estate_funds[:num_fiis]
+
+    if analysis_type == "Ações do Ibovespa":
+        return [('ibovespa', analyzer.ibovespa_stocks, None)]
+    if analysis_type == "Todas as Ações da B3":
+        return [('b3', stocks, None)]
+    if analysis_type == "Fundos Imobiliários (FIIs)":
+        return [('fiis', fiis, FII_FETCH_PERIOD)]
+    if analysis_type == "Fundos Agroindustriais":
+        return [('agro', analyzer.agro_funds, None)]
+    if analysis_type == "Pares Cointegrados (B3)":
+        return [('pairs', stocks, None)]
+    if analysis_type == "Screener (B3 + FIIs + Agro)":
+        return [('b3', analyzer.b3_stocks, None),
+                ('fiis', analyzer.real_estate_funds, FII_FETCH_PERIOD),
+                ('agro', analyzer.agro_funds, None)]
+    # Análise Completa: 50 ações da B3 e 10 fundos agro na visão expandida
+    return [('ibovespa', analyzer.ibovespa_stocks, None),
+            ('b3', analyzer.b3_stocks[:50], None),
+            ('fiis', fiis, FII_FETCH_PERIOD),
+            ('agro', analyzer.agro_funds[:10], None)]
+
+def analysis_data_fingerprint(symbols, period, fetch_period=None):
+    """Impressão digital dos dados de um conjunto de ativos na versão atual dos dados da sessão"""
+    return data_fingerprint(tuple(symbols), period, fetch_period, st.session_state.data_version)
+
+def plan_data_ready(plan, period):
+    """Indica se todos os dados do plano já estão memoizados na sessão"""
+    memo = st.session_state.get('memo_cache', {})
+    return all(('data', analysis_data_fingerprint(symbols, period, fetch_period)) in memo
+               for _, symbols, fetch_period in plan)
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def job_progress(job):
+    """Progresso do job de coleta: só este trecho é reexecutado a cada consulta, e a página
+    inteira recarrega quando o job termina"""
+    if job.done:
+        st.rerun(scope="app")
+    st.progress(min(job.progress, 1.0), text=f"🧵 {job.message}")
+
+def run_analysis_job(analysis, plan, period):
+    """Inicia (ou acompanha) o job de coleta da análise ativa; True quando os dados estão prontos.
+
+    Enquanto o job roda, só o progresso (job_progress) é atualizado a cada consulta; mexer em
+    widgets ou fechar a aba não interrompe a coleta.
+    """
+    jobs = get_job_manager()
+    job = jobs.get(analysis.get('job_id'))
+    if job is None:
+        cleared_at = st.session_state.get('cache_cleared_at', 0)
+        cache = dict(st.session_state.data_cache)
+        key = (tuple((section, tuple(symbols), fetch_period) for section, symbols, fetch_period in plan),
+               period, cleared_at)
+        job = jobs.submit(key, lambda job: collect_plan_data(plan, period, cache, cleared_at, job),
+                          description=f"{analysis['analysis_type']} ({period})", params=dict(analysis))
+        analysis['job_id'] = job.id
+        job_ids = st.session_state.setdefault('job_ids', [])
+        if job.id not in job_ids:
+            job_ids.append(job.id)
+
+    if job.status == 'concluído':
+        st.session_state.data_cache.update(job.result['cache'])
+        for (section, data, stats), (_, symbols, fetch_period) in zip(job.result['sections'], plan):
+            memoize('data', analysis_data_fingerprint(symbols, period, fetch_period), lambda data=data: data)
+            show_load_summary(stats)
+        return True
+
+    if job.status == 'cancelado':
+        st.warning(f"⏹️ Análise cancelada (job {job.id}). Clique em \"🚀 Iniciar Análise\" para recomeçar.")
+        return False
+    if job.status == 'erro':
+        st.error(f"❌ Erro no job {job.id}: {job.error}")
+        return False
+
+    job_progress(job)
+    st.caption(f"Job {job.id} em segundo plano ({job.status}): fechar a aba ou mudar filtros não "
+               f"interrompe a coleta - use o ID para reanexar.")
+    if st.button("⏹️ Cancelar análise", key=f"cancel_job_{job.id}"):
+        jobs.cancel(job.id)
+        st.rerun()
+    return False
+
+# Análise Completa: cada seção é um job próprio, renderizada só quando aberta
+COMPLETE_SECTIONS = {
+    # seção: (rótulo do seletor, título do card, título do gráfico, modelo de score)
+    'ibovespa': ("🔥 Ibovespa", "🥇 Melhor Ibovespa", "Top Ações por Score", "default"),
+    'b3': ("📈 B3", "🚀 Melhor B3", "Top Ações B3 por Score", "default"),
+    'fiis': ("🏢 FIIs", "🏢 Melhor FII", "Top FIIs por Score", "fii"),
+    'agro': ("🌾 Agro", "🌾 Melhor Fundo Agro", "Top Fundos Agro por Score", "default"),
+}
+COMPLETE_SUMMARY = "📋 Resumo"
+
+def compute_section(analyzer, symbols, period, fetch_period, score_model, benchmark, risk_in_score,
+                    cache, cleared_at, job):
+    """Corpo do job de uma seção: coleta, etapa de qualidade e métricas, sem usar a interface"""
+    data, stats = collect_stock_data(symbols, period, fetch_period, cache, cleared_at=cleared_at,
+                                     report=lambda i, n, text: job.report(i / max(n, 1), text),
+                                     is_cancelled=job.cancelled)
+    publish_downloads(stats)
+    job.report(1.0, "Calculando métricas")
+    validated, flags = validate_stock_data(data)
+    # Avisos das métricas seguem com os da coleta e aparecem no script da sessão (show_load_summary)
+    df = analyzer.calculate_metrics(validated, benchmark, risk_in_score, score_model=score_model,
+                                    messages=stats['messages'])
+    return {'data': data, 'validated': validated, 'flags': flags, 'metrics': df, 'stats': stats, 'cache': cache}
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def section_progress(label, job):
+    """Progresso de uma seção em processamento: só este trecho é reexecutado a cada consulta,
+    e a página inteira recarrega quando o job termina (para mostrar o card ou o erro)"""
+    if job.done:
+        st.rerun(scope="app")
+    st.progress(min(job.progress, 1.0), text=f"{label}: {job.message}")
+
+def section_card(title, row, fii=False):
+    """Card do resumo executivo com o melhor ativo da seção"""
+    if fii:
+        # Fundos sem histórico de proventos ficam com DY NaN
+        dy = row['DY 12m (%)']
+        detail = f"<p><strong>DY 12m:</strong> {f'{dy:.2f}%' if pd.notna(dy) else 'N/D'}</p>"
+    else:
+        detail = f"<p><strong>Variação:</strong> {row['Variação (%)']}</p>"
+    return f"""
+    <div class="recommendation-card">
+        <h4>{title}</h4>
+        <h2>{row['Symbol']}</h2>
+        <p><strong>{'Score FII' if fii else 'Score'}:</strong> {row['Score']}/100</p>
+        <p><strong>Preço:</strong> {row['Preço Atual']}</p>
+        {detail}
+    </div>
+    """
+
+def render_complete_analysis(analyzer, analysis, plan, period, benchmark, risk_in_score,
+                             chart_assets, optimized_charts):
+    """Análise Completa por seções independentes.
+
+    Cada seção (Ibovespa, B3, FIIs, Agro) é calculada por um job próprio no gerenciador de
+    jobs, em paralelo com as demais, e o resultado é memoizado com as mesmas chaves de
+    load_analysis. Os cards do resumo aparecem assim que cada seção fica pronta; gráficos e
+    tabela só são montados para a seção aberta no seletor.
+    """
+    jobs = get_job_manager()
+    memo = st.session_state.setdefault('memo_cache', OrderedDict())
+    cleared_at = st.session_state.get('cache_cleared_at', 0)
+    section_jobs = analysis.setdefault('section_jobs', {})
+    job_ids = st.session_state.setdefault('job_ids', [])
+
+    ready, pending = {}, {}
+    for section, symbols, fetch_period in plan:
+        score_model = COMPLETE_SECTIONS[section][3]
+        fingerprint = analysis_data_fingerprint(symbols, period, fetch_period)
+        metrics_key = data_fingerprint(fingerprint, benchmark is not None, risk_in_score, score_model)
+        if ('metrics', metrics_key) in memo:
+            ready[section] = memo[('metrics', metrics_key)]
+            continue
+
+        job = jobs.get(section_jobs.get(section))
+        if job is None:
+            # O job calcula Sharpe, alfa e score com o CDI e o Ibovespa desta sessão
+            key = ('section', section, tuple(symbols), fetch_period, period, cleared_at,
+                   analysis['cdi_anual'], benchmark_fingerprint(benchmark), risk_in_score)
+            cache = dict(st.session_state.data_cache)
+            job = jobs.submit(
+                key,
+                lambda job, symbols=symbols, fetch_period=fetch_period, score_model=score_model, cache=cache:
+                    compute_section(analyzer, symbols, period, fetch_period, score_model, benchmark,
+                                    risk_in_score, cache, cleared_at, job),
+                description=f"Análise Completa: {COMPLETE_SECTIONS[section][0]} ({period})",
+                params=dict(analysis, section_jobs={}))
+            section_jobs[section] = job.id
+            if job.id not in job_ids:
+                job_ids.append(job.id)
+
+        if job.status != 'concluído':
+            pending[section] = job
+            continue
+
+        # Resultado do job entra no memo da sessão: as próximas execuções não passam por aqui
+        result = job.result
+        st.session_state.data_cache.update(result['cache'])
+        memoize('data', fingerprint, lambda result=result: result['data'])
+        memoize('quality', fingerprint, lambda result=result: (result['validated'], result['flags']))
+
+        def build_metrics(section=section, result=result):
+            if not risk_in_score:
+                analyzer.record_snapshot(section, period, result['validated'], result['metrics'])
+            return result['metrics']
+
+        ready[section] = memoize('metrics', metrics_key, build_metrics)
+        show_load_summary(result['stats'])
+
+    # Resumo executivo primeiro: cards das seções prontas, progresso das demais
+    st.markdown("### 🎯 Resumo Executivo - Melhores Oportunidades")
+    columns = st.columns(len(plan))
+    for column, (section, _, _) in zip(columns, plan):
+        label, card_title, _, score_model = COMPLETE_SECTIONS[section]
+        with column:
+            if section in ready:
+                df = ready[section]
+                if df.empty:
+                    st.info(f"{label}: sem ativos com dados suficientes")
+                else:
+                    st.markdown(section_card(card_title, df.iloc[0], fii=score_model == "fii"),
+                                unsafe_allow_html=True)
+            else:
+                job = pending[section]
+                if job.status == 'erro':
+                    st.error(f"❌ {label}: {job.error}")
+                elif job.status == 'cancelado':
+                    st.warning(f"⏹️ {label}: cancelada")
+                else:
+                    section_progress(label, job)
+
+    options = [COMPLETE_SUMMARY] + [COMPLETE_SECTIONS[section][0] for section, _, _ in plan]
+    choice = st.radio("Seção:", options, horizontal=True, key="complete_section",
+                      help="Gráficos e tabela são montados apenas para a seção aberta")
+    running = [job for job in pending.values() if not job.done]
+
+    for section, symbols, fetch_period in plan:
+        label, _, chart_title, score_model = COMPLETE_SECTIONS[section]
+        if choice != label:
+            continue
+        if section not in ready:
+            st.info(f"⏳ {label}: seção ainda em processamento, ela aparece aqui assim que ficar pronta.")
+            break
+
+        # Dados e métricas já memoizados: load_analysis só recupera (e mostra a qualidade dos dados)
+        data, df, fingerprint = analyzer.load_analysis(
+            symbols, period, benchmark, risk_in_score, score_model=score_model,
+            fetch_period=fetch_period, universe=section)
+        if df.empty:
+            st.warning(f"{label}: nenhum ativo com dados suficientes.")
+            break
+        if section == 'b3':
+            st.info(f"📊 Analisando {len(symbols)} de {len(analyzer.b3_stocks)} ações da B3")
+        elif section == 'fiis':
+            st.info(f"📊 Analisando {len(symbols)} de {len(analyzer.real_estate_funds)} FIIs disponíveis no IFIX")
+
+        col1, col2 = st.columns(2)
+        with col1:
+            st.plotly_chart(analyzer.cached_recommendation_chart(df, chart_title, fingerprint),
+                            use_container_width=True, key=f"{section}_recommendation")
+        with col2:
+            st.plotly_chart(analyzer.cached_performance_chart(
+                data, df, benchmark, fingerprint, max_assets=chart_assets, optimized=optimized_charts),
+                use_container_width=True, key=f"{section}_performance")
+
+        numeric_columns = ['Beta', 'Alfa (%)', 'Sharpe', 'Sortino', 'Tracking Error (%)']
+        if score_model == "fii":
+            numeric_columns = ['DY 12m (%)', 'Consistência (%)', 'P/VP'] + numeric_columns
+        render_results_grid(df, numeric_columns, fingerprint, key=f"{section}_grid")
+
+    if running:
+        st.caption(f"🧵 {len(running)} seção(ões) em segundo plano - fechar a aba ou mudar filtros não "
+                   f"interrompe o cálculo.")
+        if st.button("⏹️ Cancelar análise", key="cancel_complete_analysis"):
+            for job in running:
+                jobs.cancel(job.id)
+            st.rerun()
+
+def render_job_panel():
+    """Jobs da sessão e reanexação de um job pelo ID (ex.: após fechar a aba)"""
+    jobs = get_job_manager()
+    with st.sidebar.expander("🧵 Análises em segundo plano"):
+        for job_id in reversed(st.session_state.get('job_ids', [])[-5:]):
+            job = jobs.get(job_id)
+            if job is not None:
+                st.caption(f"`{job.id}` · {job.description} · {job.status} ({job.progress:.0%})")
+
+        job_id = st.text_input("ID do job:", key="reattach_job_id")
+        if st.button("🔗 Reanexar", key="reattach_job") and job_id.strip():
+            job = jobs.get(job_id.strip())
+            if job is None or job.params is None:
+                st.warning("Job não encontrado ou expirado.")
+            else:
+                st.session_state.data_version += 1
+                st.session_state.active_analysis = dict(job.params, job_id=job.id,
+                                                        data_version=st.session_state.data_version)
+                job_ids = st.session_state.setdefault('job_ids', [])
+                if job.id not in job_ids:
+                    job_ids.append(job.id)
+
+def intraday_fundamentals(symbols):
+    """P/L dos ativos já baixados na sessão (o modo intraday não consulta fundamentos)"""
+    pe = {}
+    for key, record in st.session_state.get('data_cache', {}).items():
+        symbol = key.rsplit('_', 1)[0]
+        if symbol in symbols and not np.isnan(record.fundamentals.trailing_pe):
+            pe[symbol] = record.fundamentals.trailing_pe
+    return pe
+
+def render_intraday(analyzer, analysis):
+    """Ranking intraday do Ibovespa atualizado a cada polling, só com os candles novos"""
+    interval = analysis['intraday_interval']
+    poll_seconds = analysis['intraday_poll']
+    symbols = analyzer.ibovespa_stocks
+    engine = get_intraday_engine(interval)
+
+    st.subheader(f"⏱️ Ibovespa Intraday ao Vivo (candles de {interval})")
+
+    # Ao vivo, só este trecho é reexecutado a cada polling (fragmento com run_every): o resto da
+    # página continua respondendo entre as atualizações, sem o script parado em um sleep
+    @st.fragment(run_every=poll_seconds if analysis.get('intraday_live') else None)
+    def live_ranking():
+        stats = engine.refresh(symbols, pe=intraday_fundamentals(symbols), min_seconds=poll_seconds)
+        ranking = engine.ranking()
+        if ranking.empty:
+            st.warning("Nenhum candle intraday disponível no momento (mercado fechado ou provedor indisponível).")
+            return
+
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Ativos com candles", f"{len(ranking)}/{len(symbols)}")
+        with col2:
+            latest = stats.get('latest')
+            st.metric("Último candle", f"{latest.tz_convert(B3_TIMEZONE):%d/%m %H:%M}" if latest is not None else "-")
+        with col3:
+            st.metric("Candles aplicados", stats.get('bars', 0))
+        with col4:
+            st.metric("Atualização", f"{stats.get('update_seconds', 0) * 1000:.1f} ms",
+                      help=f"Download: {stats.get('fetch_seconds', 0):.2f}s")
+
+        table = ranking.reset_index()
+        table['symbol'] = table['symbol'].str.replace('.SA', '', regex=False)
+        table = table[['rank', 'symbol', 'score', 'price', 'change', 'ma20', 'ma50', 'volatility', 'volume', 'bars']]
+        table.columns = ['#', 'Ativo', 'Score', 'Preço', 'Variação Dia (%)', 'MM20', 'MM50',
+                         'Volatilidade (%)', 'Volume Médio/Dia', 'Candles']
+        st.dataframe(table.round(2), use_container_width=True, hide_index=True)
+        st.caption(f"Atualizado às {datetime.fromtimestamp(stats['updated_at']):%H:%M:%S}: médias móveis de "
+                   f"{INTRADAY_MA_SHORT}/{INTRADAY_MA_LONG} candles, volatilidade dos últimos "
+                   f"{INTRADAY_VOL_WINDOW} retornos (anualizada) e variação contra o fechamento anterior.")
+
+        render_alerts(symbols)
+
+    live_ranking()
 
-    def create_recommendation_chart(self, df, title):
-        """Cria gráfico de recomendações"""
-        top_10 = df.head(10)
-        
-        fig = go.Figure()
-        
-        # Gráfico de barras com cores baseadas no score
-        colors = ['#2e7d32' if score >= 70 else '#ff9800' if score >= 50 else '#f44336' 
-                 for score in top_10['Score']]
-        
-        fig.add_trace(go.Bar(
-            x=top_10['Symbol'],
-            y=top_10['Score'],
-            text=top_10['Score'],
-            textposition='auto',
-            marker_color=colors,
-            name='Score de Recomendação'
-        ))
-        
-        fig.update_layout(
-            title=dict(text=title, x=0.5, font=dict(size=20, color='#2e7d32')),
-            xaxis_title="Ativo",
-            yaxis_title="Score",
-            template="plotly_white",
-            height=500,
-            showlegend=False
-        )
-        
-        return fig
+def render_alerts(symbols):
+    """Watchlists, regras de alerta (avaliadas a cada lote de candles) e últimos disparos"""
+    manager = get_alert_manager()
+    config = load_alert_config(manager.rules_path)
 
-    def create_performance_chart(self, data, symbols):
-        """Cria gráfico de performance comparativa com tratamento de erros"""
-        fig = go.Figure()
-        
-        # Filtrar símbolos que têm dados válidos
-        valid_symbols = []
-        for symbol in symbols[:5]:  # Top 5 para não poluir o gráfico
-            # Verificar se o símbolo já tem .SA ou precisa adicionar
-            symbol_key = symbol + '.SA' if not symbol.endswith('.SA') else symbol
-            
-            if symbol_key in data:
-                try:
-                    hist = data[symbol_key]['history']
-                    if not hist.empty and len(hist) > 5:
-                        valid_symbols.append((symbol, symbol_key))
-                except:
-                    continue
-        
-        if not valid_symbols:
-            # Se não há dados válidos, criar gráfico vazio com mensagem
-            fig.add_annotation(
-                text="Não há dados suficientes para mostrar performance comparativa",
-                xref="paper", yref="paper",
-                x=0.5, y=0.5, xanchor='center', yanchor='middle',
-                showarrow=False,
-                font=dict(size=16, color="gray")
-            )
-        else:
-            # Cores para cada linha
-            colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd']
-            
-            for i, (display_symbol, data_key) in enumerate(valid_symbols):
+    with st.expander(f"🔔 Watchlists e Alertas ({len(config['rules'])} regras)"):
+        stats = manager.stats
+        if stats:
+            st.caption(f"Última avaliação: {stats['rules']} regras x {stats['symbols']} ativos atualizados em "
+                       f"{stats['seconds'] * 1000:.1f} ms ({stats['fired']} disparos) · log em {manager.log_path}")
+
+        col1, col2 = st.columns(2)
+        with col1:
+            st.markdown("**Watchlist**")
+            name = st.text_input("Nome:", key="watchlist_name")
+            codes = st.text_input("Ativos (separados por vírgula):", key="watchlist_symbols",
+                                  placeholder="PETR4, VALE3, ITUB4")
+            if st.button("💾 Salvar watchlist", key="save_watchlist") and name.strip():
+                members = [c.strip().upper().replace('.SA', '') for c in codes.split(',') if c.strip()]
+                available = {s.replace('.SA', '') for s in symbols}
+                unknown = [c for c in members if c not in available]
+                if unknown:
+                    st.info(f"📋 Fora do universo intraday (sem alertas): {', '.join(unknown)}")
+                config['watchlists'][name.strip()] = members
+                save_alert_config(config, manager.rules_path)
+                st.success(f"Watchlist '{name.strip()}' salva com {len(members)} ativos")
+        with col2:
+            st.markdown("**Regra**")
+            text = st.text_input("Condição:", key="alert_rule_text",
+                                 placeholder="score crosses above 70 | close crosses ma50 | volatility > 50")
+            watchlist = st.selectbox("Aplicar a:", ["Todos os ativos"] + list(config['watchlists']),
+                                     key="alert_rule_watchlist")
+            if st.button("➕ Adicionar regra", key="add_alert_rule") and text.strip():
                 try:
-                    hist = data[data_key]['history']
-                    
-                    # Calcular retorno percentual
-                    returns = (hist['Close'] / hist['Close'].iloc[0] - 1) * 100
-                    
-                    fig.add_trace(go.Scatter(
-                        x=hist.index,
-                        y=returns,
-                        mode='lines',
-                        name=display_symbol.replace('.SA', ''),
-                        line=dict(width=2, color=colors[i % len(colors)]),
-                        hovertemplate='<b>%{fullData.name}</b><br>' +
-                                    'Data: %{x}<br>' +
-                                    'Retorno: %{y:.2f}%<br>' +
-                                    '<extra></extra>'
-                    ))
-                except Exception as e:
-                    continue
-        
-        fig.update_layout(
-            title=dict(text="Performance Comparativa (Últimos 12 Meses)", 
-                      x=0.5, font=dict(size=20, color='#2e7d32')),
-            xaxis_title="Data",
-            yaxis_title="Retorno (%)",
-            template="plotly_white",
-            height=500,
-            hovermode='x unified',
-            legend=dict(
-                orientation="h",
-                yanchor="bottom",
-                y=1.02,
-                xanchor="right",
-                x=1
-            )
-        )
-        
-        return fig
+                    rule = AlertRule(text, None if watchlist == "Todos os ativos" else watchlist)
+                except ValueError as e:
+                    st.warning(f"⚠️ Regra inválida: {str(e)}")
+                else:
+                    config['rules'].append(rule.to_dict())
+                    save_alert_config(config, manager.rules_path)
+                    st.success(f"Regra adicionada: {rule.text}")
+
+        for i, rule in enumerate(config['rules']):
+            col1, col2 = st.columns([5, 1])
+            with col1:
+                st.text(f"{rule['text']}  ·  {rule.get('watchlist') or 'Todos os ativos'}")
+            with col2:
+                if st.button("🗑️", key=f"delete_alert_{rule.get('id', i)}"):
+                    config['rules'].pop(i)
+                    save_alert_config(config, manager.rules_path)
+                    st.rerun()
+
+        if manager.recent:
+            st.markdown("**Últimos alertas**")
+            recent = pd.DataFrame(list(manager.recent)[::-1][:20])
+            recent = recent[['time', 'symbol', 'text', 'watchlist', 'active', 'price', 'score']]
+            recent.columns = ['Candle (UTC)', 'Ativo', 'Regra', 'Watchlist', 'Condição Ativa', 'Preço', 'Score']
+            st.dataframe(recent, use_container_width=True, hide_index=True)
+
+def get_analyzer():
+    """Reaproveita o analisador da sessão em vez de reconstruir as listas a cada rerun"""
+    analyzer = st.session_state.get('analyzer')
+    if not isinstance(analyzer, InvestmentAnalyzer):
+        analyzer = InvestmentAnalyzer()
+        analyzer.cleaned_count = analyzer.clean_stock_lists()
+        st.session_state.analyzer = analyzer
+    return analyzer
 
 def main():
     st.markdown('<h1 class="main-header">📈 Análise de Investimentos Brasil</h1>', 
@@ -527,19 +3781,25 @@ def main():
     </div>
     """, unsafe_allow_html=True)
     
-    analyzer = InvestmentAnalyzer()
+    analyzer = get_analyzer()
     
-    # Limpar listas de ações problemáticas
-    cleaned_count = analyzer.clean_stock_lists()
+    # Listas de ações problemáticas já removidas na criação do analisador
+    cleaned_count = analyzer.cleaned_count
     if cleaned_count > 0:
         st.sidebar.info(f"🧹 {cleaned_count} ações problemáticas removidas automaticamente")
+    registry = analyzer.registry
+    if registry.duplicates or registry.rejected:
+        st.sidebar.info(f"🗂️ Cadastro de universos: {len(registry.duplicates)} entradas repetidas e "
+                        f"{len(registry.rejected)} códigos inválidos ignorados")
     
     # Sidebar
     st.sidebar.header("🔧 Configurações")
     
     analysis_type = st.sidebar.selectbox(
         "Tipo de Análise:",
-        ["Ações do Ibovespa", "Todas as Ações da B3", "Fundos Imobiliários (FIIs)", "Fundos Agroindustriais", "Análise Completa"]
+        ["Ações do Ibovespa", "Todas as Ações da B3", "Fundos Imobiliários (FIIs)", "Fundos Agroindustriais",
+         "Pares Cointegrados (B3)", "Screener (B3 + FIIs + Agro)", "Intraday ao Vivo (Ibovespa)",
+         "Análise Completa"]
     )
     
     period = st.sidebar.selectbox(
@@ -550,171 +3810,216 @@ def main():
     
     num_fiis = st.sidebar.selectbox(
         "Número de FIIs para analisar:",
-        [20, 30, 50, "Todos (117)"],
+        [20, 30, 50, f"Todos ({len(analyzer.real_estate_funds)})"],
         index=1,
         help="Mais FIIs = análise mais completa, mas demora mais tempo"
     )
     
     num_stocks = st.sidebar.selectbox(
         "Número de ações B3 para analisar:",
-        [30, 50, 100, 200, "Todas (390+)"],
+        [30, 50, 100, 200, f"Todas ({len(analyzer.b3_stocks)})"],
         index=1,
         help="Mais ações = análise mais completa, mas demora mais tempo"
     )
+
+    min_corr = 0.8
+    if analysis_type == "Pares Cointegrados (B3)":
+        min_corr = st.sidebar.slider(
+            "Correlação mínima dos pares:", min_value=0.5, max_value=0.95, value=0.8, step=0.05,
+            help="Pré-filtro: apenas pares acima dessa correlação passam pelo teste de cointegração"
+        )
+
+    intraday_interval, intraday_poll, intraday_live = '5m', 60, True
+    if analysis_type == "Intraday ao Vivo (Ibovespa)":
+        intraday_interval = st.sidebar.selectbox("Intervalo dos candles:", list(INTRADAY_INTERVALS), index=1)
+        intraday_poll = st.sidebar.slider(
+            "Atualizar a cada (segundos):", min_value=INTRADAY_MIN_POLL_SECONDS, max_value=300, value=60, step=15,
+            help="Cada atualização baixa só os candles novos e atualiza os indicadores incrementalmente"
+        )
+        intraday_live = st.sidebar.checkbox("🔴 Atualização automática", value=True)
+
+    chart_assets = st.sidebar.slider(
+        "Ativos no gráfico de performance:", min_value=3, max_value=20, value=5,
+        help="Quantidade de ativos do topo do ranking comparados no gráfico de performance"
+    )
+
+    optimized_charts = st.sidebar.checkbox(
+        "⚡ Gráficos otimizados (LTTB + WebGL)",
+        value=True,
+        help="Reduz séries longas preservando a forma e usa WebGL com muitos pontos"
+    )
+
+    risk_in_score = st.sidebar.checkbox(
+        "⚖️ Incluir risco ajustado no Score",
+        value=False,
+        help="Usa Sharpe e Alfa vs Ibovespa/CDI como componentes do Score (20%)"
+    )
+
+    background = st.sidebar.checkbox(
+        "🧵 Executar em segundo plano",
+        value=True,
+        help="A coleta roda como job no servidor: fechar a aba ou mexer nos filtros não perde o trabalho"
+    )
+
+    cdi_anual = DEFAULT_CDI_ANUAL
+    if not os.path.exists(CDI_CSV_PATH):
+        cdi_anual = st.sidebar.number_input(
+            "CDI anual (%):", min_value=0.0, max_value=50.0, value=DEFAULT_CDI_ANUAL, step=0.25,
+            help="Usado como taxa livre de risco quando não há arquivo local do CDI (data/cdi.csv)"
+        )
     
-    if st.sidebar.button("🚀 Iniciar Análise", type="primary"):
+    run_clicked = st.sidebar.button("🚀 Iniciar Análise", type="primary")
+
+    # Botão para limpar cache
+    if st.sidebar.button("🗑️ Limpar Cache", help="Remove dados em cache para forçar download atualizado"):
+        st.session_state.data_cache = {}
+        st.session_state.memo_cache = OrderedDict()
+        st.session_state.cache_cleared_at = time.time()
+        # Respostas HTTP guardadas também deixam de valer: o próximo download vai ao provedor
+        PROVIDER_HTTP.cache.clear()
+        st.session_state.data_version += 1
+        if st.session_state.get('active_analysis'):
+            st.session_state.active_analysis['data_version'] = st.session_state.data_version
+            # O job anterior usou dados antigos: a próxima execução enfileira outro
+            st.session_state.active_analysis.pop('job_id', None)
+            st.session_state.active_analysis.pop('section_jobs', None)
+        st.sidebar.success("Cache limpo! Próximas análises usarão dados atualizados.")
+
+    if run_clicked:
+        # Nova análise: os parâmetros que definem os dados ficam fixos até o próximo clique,
+        # e reruns que só mexem na interface reaproveitam os resultados memoizados
+        st.session_state.data_version += 1
+        st.session_state.active_analysis = {
+            'analysis_type': analysis_type,
+            'period': period,
+            'num_fiis': num_fiis,
+            'num_stocks': num_stocks,
+            'min_corr': min_corr,
+            'risk_in_score': risk_in_score,
+            'cdi_anual': cdi_anual,
+            'background': background,
+            'intraday_interval': intraday_interval,
+            'intraday_poll': intraday_poll,
+            'intraday_live': intraday_live,
+            'data_version': st.session_state.data_version,
+        }
+
         # Aviso sobre tempo de análise
-        if (num_fiis == "Todos (117)" or num_fiis >= 50 or 
-            num_stocks == "Todas (390+)" or num_stocks >= 100):
+        if (isinstance(num_fiis, str) or num_fiis >= 50 or 
+            isinstance(num_stocks, str) or num_stocks >= 100 or
+            analysis_type == "Screener (B3 + FIIs + Agro)"):
             st.warning("⏱️ Análise completa pode levar vários minutos. Por favor, aguarde...")
+
+    render_job_panel()
+
+    active_analysis = st.session_state.get('active_analysis')
+    if active_analysis is not None:
+        analysis_type = active_analysis['analysis_type']
+        period = active_analysis['period']
+        num_fiis = active_analysis['num_fiis']
+        num_stocks = active_analysis['num_stocks']
+        min_corr = active_analysis['min_corr']
+        risk_in_score = active_analysis['risk_in_score']
+        cdi_anual = active_analysis['cdi_anual']
+
+        if analysis_type == "Intraday ao Vivo (Ibovespa)":
+            render_intraday(analyzer, active_analysis)
+            return
+
+        plan = analysis_plan(analyzer, active_analysis)
+        sections = {section: symbols for section, symbols, _ in plan}
+        if (active_analysis.get('background') and analysis_type != "Análise Completa"
+                and not plan_data_ready(plan, period)):
+            if not run_analysis_job(active_analysis, plan, period):
+                return
         
         with st.spinner("Coletando e analisando dados..."):
+
+            benchmark = analyzer.get_benchmark_data(cdi_anual)
+            if benchmark['ibov'].empty:
+                st.info("📋 Ibovespa indisponível no momento: métricas de risco ajustado não serão calculadas")
+                benchmark = None
             
             if analysis_type == "Ações do Ibovespa":
-                data = analyzer.get_stock_data(analyzer.ibovespa_stocks, period)
-                df = analyzer.calculate_metrics(data)
+                data, df, fingerprint = analyzer.load_analysis(
+                    analyzer.ibovespa_stocks, period, benchmark, risk_in_score, universe="ibovespa")
                 
                 st.subheader("📊 Melhores Ações do Ibovespa")
                 
             elif analysis_type == "Todas as Ações da B3":
-                stocks_to_analyze = len(analyzer.b3_stocks) if num_stocks == "Todas (390+)" else num_stocks
-                data = analyzer.get_stock_data(analyzer.b3_stocks[:stocks_to_analyze], period)
-                df = analyzer.calculate_metrics(data)
+                data, df, fingerprint = analyzer.load_analysis(
+                    sections['b3'], period, benchmark, risk_in_score, universe="b3")
                 
-                st.subheader(f"📊 Melhores Ações da B3 (Analisando {stocks_to_analyze}/{len(analyzer.b3_stocks)} ações)")
+                st.subheader(f"📊 Melhores Ações da B3 (Analisando {len(sections['b3'])}/{len(analyzer.b3_stocks)} ações)")
                 
             elif analysis_type == "Fundos Imobiliários (FIIs)":
-                fiis_to_analyze = len(analyzer.real_estate_funds) if num_fiis == "Todos (117)" else num_fiis
-                data = analyzer.get_stock_data(analyzer.real_estate_funds[:fiis_to_analyze], period)
-                df = analyzer.calculate_metrics(data)
+                data, df, fingerprint = analyzer.load_analysis(
+                    sections['fiis'], period, benchmark, risk_in_score,
+                    score_model="fii", fetch_period=FII_FETCH_PERIOD, universe="fiis")
                 
-                st.subheader(f"🏢 Melhores Fundos Imobiliários (Analisando {fiis_to_analyze}/{len(analyzer.real_estate_funds)} FIIs)")
+                st.subheader(f"🏢 Melhores Fundos Imobiliários (Analisando {len(sections['fiis'])}/{len(analyzer.real_estate_funds)} FIIs)")
                 
             elif analysis_type == "Fundos Agroindustriais":
-                data = analyzer.get_stock_data(analyzer.agro_funds, period)
-                df = analyzer.calculate_metrics(data)
+                data, df, fingerprint = analyzer.load_analysis(
+                    sections['agro'], period, benchmark, risk_in_score, universe="agro")
                 
                 st.subheader("🌾 Melhores Fundos Agroindustriais")
+
+            elif analysis_type == "Screener (B3 + FIIs + Agro)":
+                st.subheader("🔎 Screener - B3 + FIIs + Agro")
+
+                # Universo combinado completo, com métricas memoizadas por universo
+                b3 = analyzer.load_analysis(sections['b3'], period, benchmark, risk_in_score, universe="b3")
+                fiis = analyzer.load_analysis(sections['fiis'], period, benchmark, risk_in_score,
+                                              score_model="fii", fetch_period=FII_FETCH_PERIOD, universe="fiis")
+                agro = analyzer.load_analysis(sections['agro'], period, benchmark, risk_in_score, universe="agro")
+                table = memoize('screener_table', data_fingerprint(b3[2], fiis[2], agro[2]),
+                                lambda: build_screener_table([('B3',) + b3[:2], ('FII',) + fiis[:2],
+                                                              ('Agro',) + agro[:2]]))
+
+                render_screener(table)
+                return
+
+            elif analysis_type == "Pares Cointegrados (B3)":
+                symbols = sections['pairs']
+                data, _, fingerprint = analyzer.get_validated_data(symbols, period)
+                closes = memoize('closes', fingerprint, lambda: analyzer.build_close_matrix(data))
+
+                st.subheader(f"🔗 Pares Cointegrados da B3 (Analisando {len(data)} ações)")
+
+                scan_start = time.perf_counter()
+                pairs_df, scan_stats = cached_pair_scan(closes, min_corr)
+                scan_time = time.perf_counter() - scan_start
+
+                truncated = ""
+                if scan_stats['tested'] < scan_stats['above_corr']:
+                    truncated = (f" - apenas os {scan_stats['tested']} mais correlacionados de "
+                                 f"{scan_stats['above_corr']} testados (limite PAIRS_MAX_CANDIDATES)")
+                st.info(f"📊 {scan_stats['pairs']} pares candidatos, {scan_stats['above_corr']} com correlação "
+                        f"≥ {min_corr:.2f}, {len(pairs_df)} cointegrados em {scan_time:.2f}s{truncated}")
+
+                if pairs_df.empty:
+                    st.error("Nenhum par cointegrado encontrado com os parâmetros atuais.")
+                    return
+
+                display_pairs = pairs_df.drop(columns=['Ativo A', 'Ativo B', 'Intercepto']).round(3)
+                st.dataframe(display_pairs, use_container_width=True)
+
+                st.subheader("📉 Spreads dos Melhores Pares")
+                top_pairs = pairs_df.head(4)
+                aligned = memoize('closes_aligned', fingerprint, lambda: align_pair_closes(closes))
+                col1, col2 = st.columns(2)
+                for i, (_, pair) in enumerate(top_pairs.iterrows()):
+                    with (col1 if i % 2 == 0 else col2):
+                        fig = memoize('fig_spread', data_fingerprint(fingerprint, min_corr, pair['Par']),
+                                      lambda: analyzer.create_spread_chart(aligned, pair))
+                        st.plotly_chart(fig, use_container_width=True, key=f"pair_spread_{i}")
+                return
                 
             else:  # Análise Completa
                 st.subheader("📈 Análise Completa de Investimentos")
-                
-                # Análise de Ações
-                st.markdown("### 🔥 Top Ações do Ibovespa")
-                stocks_data = analyzer.get_stock_data(analyzer.ibovespa_stocks, period)
-                stocks_df = analyzer.calculate_metrics(stocks_data)
-                
-                col1, col2 = st.columns(2)
-                with col1:
-                    st.plotly_chart(analyzer.create_recommendation_chart(
-                        stocks_df, "Top Ações por Score"), use_container_width=True, key="stocks_recommendation")
-                with col2:
-                    st.plotly_chart(analyzer.create_performance_chart(
-                        stocks_data, stocks_df['Symbol'].tolist()), use_container_width=True, key="stocks_performance")
-                
-                # Análise Adicional de Ações B3
-                st.markdown("### 📈 Top Ações da B3 (Análise Expandida)")
-                stocks_b3_to_analyze = min(50, len(analyzer.b3_stocks))  # Usar 50 ações para análise completa
-                stocks_b3_data = analyzer.get_stock_data(analyzer.b3_stocks[:stocks_b3_to_analyze], period)
-                stocks_b3_df = analyzer.calculate_metrics(stocks_b3_data)
-                
-                st.info(f"📊 Analisando {stocks_b3_to_analyze} de {len(analyzer.b3_stocks)} ações da B3")
-                
-                col1, col2 = st.columns(2)
-                with col1:
-                    st.plotly_chart(analyzer.create_recommendation_chart(
-                        stocks_b3_df, "Top Ações B3 por Score"), use_container_width=True, key="stocks_b3_recommendation")
-                with col2:
-                    st.plotly_chart(analyzer.create_performance_chart(
-                        stocks_b3_data, stocks_b3_df['Symbol'].tolist()), use_container_width=True, key="stocks_b3_performance")
-                
-                # Análise de FIIs
-                st.markdown(f"### 🏢 Top Fundos Imobiliários")
-                fiis_to_analyze = len(analyzer.real_estate_funds) if num_fiis == "Todos (117)" else num_fiis
-                fiis_data = analyzer.get_stock_data(analyzer.real_estate_funds[:fiis_to_analyze], period)
-                fiis_df = analyzer.calculate_metrics(fiis_data)
-                
-                st.info(f"📊 Analisando {fiis_to_analyze} de {len(analyzer.real_estate_funds)} FIIs disponíveis no IFIX")
-                
-                col1, col2 = st.columns(2)
-                with col1:
-                    st.plotly_chart(analyzer.create_recommendation_chart(
-                        fiis_df, "Top FIIs por Score"), use_container_width=True, key="fiis_recommendation")
-                with col2:
-                    st.plotly_chart(analyzer.create_performance_chart(
-                        fiis_data, fiis_df['Symbol'].tolist()), use_container_width=True, key="fiis_performance")
-                
-                # Análise de Fundos Agro
-                st.markdown("### 🌾 Top Fundos Agroindustriais")
-                agro_data = analyzer.get_stock_data(analyzer.agro_funds[:10], period)
-                agro_df = analyzer.calculate_metrics(agro_data)
-                
-                col1, col2 = st.columns(2)
-                with col1:
-                    st.plotly_chart(analyzer.create_recommendation_chart(
-                        agro_df, "Top Fundos Agro por Score"), use_container_width=True, key="agro_recommendation")
-                with col2:
-                    st.plotly_chart(analyzer.create_performance_chart(
-                        agro_data, agro_df['Symbol'].tolist()), use_container_width=True, key="agro_performance")
-                
-                # Resumo Executivo
-                st.markdown("### 🎯 Resumo Executivo - Melhores Oportunidades")
-                
-                best_stock = stocks_df.iloc[0] if not stocks_df.empty else None
-                best_stock_b3 = stocks_b3_df.iloc[0] if not stocks_b3_df.empty else None
-                best_fii = fiis_df.iloc[0] if not fiis_df.empty else None
-                best_agro = agro_df.iloc[0] if not agro_df.empty else None
-                
-                col1, col2, col3, col4 = st.columns(4)
-                
-                if best_stock is not None:
-                    with col1:
-                        st.markdown(f"""
-                        <div class="recommendation-card">
-                            <h4>🥇 Melhor Ibovespa</h4>
-                            <h2>{best_stock['Symbol']}</h2>
-                            <p><strong>Score:</strong> {best_stock['Score']}/100</p>
-                            <p><strong>Preço:</strong> {best_stock['Preço Atual']}</p>
-                            <p><strong>Variação:</strong> {best_stock['Variação (%)']}</p>
-                        </div>
-                        """, unsafe_allow_html=True)
-                
-                if best_stock_b3 is not None:
-                    with col2:
-                        st.markdown(f"""
-                        <div class="recommendation-card">
-                            <h4>🚀 Melhor B3</h4>
-                            <h2>{best_stock_b3['Symbol']}</h2>
-                            <p><strong>Score:</strong> {best_stock_b3['Score']}/100</p>
-                            <p><strong>Preço:</strong> {best_stock_b3['Preço Atual']}</p>
-                            <p><strong>Variação:</strong> {best_stock_b3['Variação (%)']}</p>
-                        </div>
-                        """, unsafe_allow_html=True)
-                
-                if best_fii is not None:
-                    with col3:
-                        st.markdown(f"""
-                        <div class="recommendation-card">
-                            <h4>🏢 Melhor FII</h4>
-                            <h2>{best_fii['Symbol']}</h2>
-                            <p><strong>Score:</strong> {best_fii['Score']}/100</p>
-                            <p><strong>Preço:</strong> {best_fii['Preço Atual']}</p>
-                            <p><strong>Variação:</strong> {best_fii['Variação (%)']}</p>
-                        </div>
-                        """, unsafe_allow_html=True)
-                
-                if best_agro is not None:
-                    with col4:
-                        st.markdown(f"""
-                        <div class="recommendation-card">
-                            <h4>🌾 Melhor Fundo Agro</h4>
-                            <h2>{best_agro['Symbol']}</h2>
-                            <p><strong>Score:</strong> {best_agro['Score']}/100</p>
-                            <p><strong>Preço:</strong> {best_agro['Preço Atual']}</p>
-                            <p><strong>Variação:</strong> {best_agro['Variação (%)']}</p>
-                        </div>
-                        """, unsafe_allow_html=True)
-                
+                render_complete_analysis(analyzer, active_analysis, plan, period, benchmark, risk_in_score,
+                                         chart_assets, optimized_charts)
                 return
             
             if not df.empty:
@@ -742,44 +4047,27 @@ def main():
                 col1, col2 = st.columns(2)
                 
                 with col1:
-                    fig1 = analyzer.create_recommendation_chart(df, "Ranking por Score")
+                    fig1 = analyzer.cached_recommendation_chart(df, "Ranking por Score", fingerprint)
                     st.plotly_chart(fig1, use_container_width=True, key="individual_recommendation")
                 
                 with col2:
-                    fig2 = analyzer.create_performance_chart(data, df['Symbol'].tolist())
+                    fig2 = analyzer.cached_performance_chart(data, df, benchmark, fingerprint,
+                                                             max_assets=chart_assets, optimized=optimized_charts)
                     st.plotly_chart(fig2, use_container_width=True, key="individual_performance")
                 
                 # Tabela detalhada
                 st.subheader("📋 Análise Detalhada")
                 
-                # Preparar dados para exibição - garantir compatibilidade com Arrow
-                display_df = df[['Symbol', 'Preço Atual', 'Variação (%)', 
-                               'Volatilidade (%)', 'P/L', 'Score']].copy()
-                
-                # Garantir que todos os tipos são compatíveis com Arrow
-                display_df['Score'] = display_df['Score'].astype(float)
-                display_df = display_df.fillna('N/A')  # Substituir valores nulos
-                
-                # Colorir linhas baseado no score
-                def highlight_score(row):
-                    try:
-                        score = float(row['Score'])
-                        if score >= 70:
-                            return ['background-color: #e8f5e8'] * len(row)
-                        elif score >= 50:
-                            return ['background-color: #fff3e0'] * len(row)
-                        else:
-                            return ['background-color: #ffebee'] * len(row)
-                    except:
-                        return ['background-color: #f5f5f5'] * len(row)
-                
-                try:
-                    styled_df = display_df.style.apply(highlight_score, axis=1)
-                    st.dataframe(styled_df, use_container_width=True)
-                except Exception as e:
-                    # Se falhar com estilo, mostrar sem formatação
-                    st.dataframe(display_df, use_container_width=True)
-                    st.warning(f"⚠️ Formatação de cores não disponível: {str(e)}")
+                numeric_columns = ['Beta', 'Alfa (%)', 'Sharpe', 'Sortino', 'Tracking Error (%)']
+                if analysis_type == "Fundos Imobiliários (FIIs)":
+                    numeric_columns = ['DY 12m (%)', 'Consistência (%)', 'P/VP'] + numeric_columns
+                render_results_grid(df, numeric_columns, fingerprint, key="detail_grid")
+
+                sectors = memoize('sectors', data_fingerprint(fingerprint, benchmark is not None, risk_in_score),
+                                  lambda: sector_aggregates(df, analyzer.registry))
+                if len(sectors) > 1:
+                    st.subheader("🏭 Visão por Setor")
+                    st.dataframe(sectors, use_container_width=True, hide_index=True)
                 
                 # Recomendações específicas
                 st.subheader("💡 Recomendações Baseadas em IA")
@@ -811,229 +4099,16 @@ def main():
                         <p style="margin: 0; color: #666;">{justification}</p>
                     </div>
                     """, unsafe_allow_html=True)
+
+                # Histórico do ranking (snapshots diários)
+                universe = UNIVERSE_KEYS[analysis_type]
+                score_model = "fii" if universe == "fiis" else "default"
+                with st.expander("📈 Histórico do Ranking"):
+                    render_ranking_history(analyzer, universe, period, df, score_model)
             
             else:
                 st.error("Não foi possível carregar dados suficientes para análise.")
     
-    # Botão para limpar cache
-    if st.sidebar.button("🗑️ Limpar Cache", help="Remove dados em cache para forçar download atualizado"):
-        st.session_state.data_cache = {}
-        st.sidebar.success("Cache limpo! Próximas análises usarão dados atualizados.")
-            
-        if analysis_type == "Ações do Ibovespa":
-            data = analyzer.get_stock_data(analyzer.ibovespa_stocks, period)
-            df = analyzer.calculate_metrics(data)
-            
-            st.subheader("📊 Melhores Ações do Ibovespa")
-            
-        elif analysis_type == "Todas as Ações da B3":
-            stocks_to_analyze = len(analyzer.b3_stocks) if num_stocks == "Todas (400+)" else num_stocks
-            data = analyzer.get_stock_data(analyzer.b3_stocks[:stocks_to_analyze], period)
-            df = analyzer.calculate_metrics(data)
-            
-            st.subheader(f"📊 Melhores Ações da B3 (Analisando {stocks_to_analyze}/{len(analyzer.b3_stocks)} ações)")
-            
-        elif analysis_type == "Fundos Imobiliários (FIIs)":
-            fiis_to_analyze = len(analyzer.real_estate_funds) if num_fiis == "Todos (117)" else num_fiis
-            data = analyzer.get_stock_data(analyzer.real_estate_funds[:fiis_to_analyze], period)
-            df = analyzer.calculate_metrics(data)
-            
-            st.subheader(f"🏢 Melhores Fundos Imobiliários (Analisando {fiis_to_analyze}/{len(analyzer.real_estate_funds)} FIIs)")
-            
-        elif analysis_type == "Fundos Agroindustriais":
-            data = analyzer.get_stock_data(analyzer.agro_funds, period)
-            df = analyzer.calculate_metrics(data)
-            
-            st.subheader("🌾 Melhores Fundos Agroindustriais")
-            
-        else:  # Análise Completa
-            st.subheader("📈 Análise Completa de Investimentos")
-            
-            # Análise de Ações
-            st.markdown("### 🔥 Top Ações do Ibovespa")
-            stocks_data = analyzer.get_stock_data(analyzer.ibovespa_stocks[:10], period)
-            stocks_df = analyzer.calculate_metrics(stocks_data)
-            
-            col1, col2 = st.columns(2)
-            with col1:
-                st.plotly_chart(analyzer.create_recommendation_chart(
-                    stocks_df, "Top Ações por Score"), use_container_width=True, key="stocks_recommendation")
-            with col2:
-                st.plotly_chart(analyzer.create_performance_chart(
-                    stocks_data, stocks_df['Symbol'].tolist()), use_container_width=True, key="stocks_performance")
-            
-            # Análise de FIIs
-            st.markdown(f"### 🏢 Top Fundos Imobiliários")
-            fiis_to_analyze = len(analyzer.real_estate_funds) if num_fiis == "Todos (117)" else num_fiis
-            fiis_data = analyzer.get_stock_data(analyzer.real_estate_funds[:fiis_to_analyze], period)
-            fiis_df = analyzer.calculate_metrics(fiis_data)
-            
-            st.info(f"📊 Analisando {fiis_to_analyze} de {len(analyzer.real_estate_funds)} FIIs disponíveis no IFIX")
-            
-            col1, col2 = st.columns(2)
-            with col1:
-                st.plotly_chart(analyzer.create_recommendation_chart(
-                    fiis_df, "Top FIIs por Score"), use_container_width=True, key="fiis_recommendation")
-            with col2:
-                st.plotly_chart(analyzer.create_performance_chart(
-                    fiis_data, fiis_df['Symbol'].tolist()), use_container_width=True, key="fiis_performance")
-            
-            # Análise de Fundos Agro
-            st.markdown("### 🌾 Top Fundos Agroindustriais")
-            agro_data = analyzer.get_stock_data(analyzer.agro_funds[:10], period)
-            agro_df = analyzer.calculate_metrics(agro_data)
-            
-            col1, col2 = st.columns(2)
-            with col1:
-                st.plotly_chart(analyzer.create_recommendation_chart(
-                    agro_df, "Top Fundos Agro por Score"), use_container_width=True, key="agro_recommendation")
-            with col2:
-                st.plotly_chart(analyzer.create_performance_chart(
-                    agro_data, agro_df['Symbol'].tolist()), use_container_width=True, key="agro_performance")
-            
-            # Resumo Executivo
-            st.markdown("### 🎯 Resumo Executivo - Melhores Oportunidades")
-            
-            best_stock = stocks_df.iloc[0] if not stocks_df.empty else None
-            best_stock_b3 = stocks_b3_df.iloc[0] if not stocks_b3_df.empty else None
-            best_fii = fiis_df.iloc[0] if not fiis_df.empty else None
-            best_agro = agro_df.iloc[0] if not agro_df.empty else None
-            
-            col1, col2, col3, col4 = st.columns(4)
-            
-            if best_stock is not None:
-                with col1:
-                    st.markdown(f"""
-                    <div class="recommendation-card">
-                        <h4>🥇 Melhor Ibovespa</h4>
-                        <h2>{best_stock['Symbol']}</h2>
-                        <p><strong>Score:</strong> {best_stock['Score']}/100</p>
-                        <p><strong>Preço:</strong> {best_stock['Preço Atual']}</p>
-                        <p><strong>Variação:</strong> {best_stock['Variação (%)']}</p>
-                    </div>
-                    """, unsafe_allow_html=True)
-            
-            if best_stock_b3 is not None:
-                with col2:
-                    st.markdown(f"""
-                    <div class="recommendation-card">
-                        <h4>🚀 Melhor B3</h4>
-                        <h2>{best_stock_b3['Symbol']}</h2>
-                        <p><strong>Score:</strong> {best_stock_b3['Score']}/100</p>
-                        <p><strong>Preço:</strong> {best_stock_b3['Preço Atual']}</p>
-                        <p><strong>Variação:</strong> {best_stock_b3['Variação (%)']}</p>
-                    </div>
-                    """, unsafe_allow_html=True)
-            
-            if best_fii is not None:
-                with col3:
-                    st.markdown(f"""
-                    <div class="recommendation-card">
-                        <h4>🏢 Melhor FII</h4>
-                        <h2>{best_fii['Symbol']}</h2>
-                        <p><strong>Score:</strong> {best_fii['Score']}/100</p>
-                        <p><strong>Preço:</strong> {best_fii['Preço Atual']}</p>
-                        <p><strong>Variação:</strong> {best_fii['Variação (%)']}</p>
-                    </div>
-                    """, unsafe_allow_html=True)
-            
-            if best_agro is not None:
-                with col4:
-                    st.markdown(f"""
-                    <div class="recommendation-card">
-                        <h4>🌾 Melhor Fundo Agro</h4>
-                        <h2>{best_agro['Symbol']}</h2>
-                        <p><strong>Score:</strong> {best_agro['Score']}/100</p>
-                        <p><strong>Preço:</strong> {best_agro['Preço Atual']}</p>
-                        <p><strong>Variação:</strong> {best_agro['Variação (%)']}</p>
-                    </div>
-                    """, unsafe_allow_html=True)
-            
-            return
-        
-        if not df.empty:
-            # Exibir métricas principais
-            col1, col2, col3, col4 = st.columns(4)
-            
-            with col1:
-                avg_score = df['Score'].mean()
-                st.metric("Score Médio", f"{avg_score:.1f}", 
-                            delta=f"{avg_score-50:.1f} vs benchmark")
-            
-            with col2:
-                positive_returns = (df['Variação (%)'].str.replace('%', '').astype(float) > 0).sum()
-                st.metric("Ativos em Alta", f"{positive_returns}/{len(df)}")
-            
-            with col3:
-                best_performer = df.iloc[0]['Symbol']
-                st.metric("Melhor Ativo", best_performer)
-            
-            with col4:
-                top_score = df.iloc[0]['Score']
-                st.metric("Maior Score", f"{top_score:.1f}")
-            
-            # Gráficos
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                fig1 = analyzer.create_recommendation_chart(df, "Ranking por Score")
-                st.plotly_chart(fig1, use_container_width=True, key="individual_recommendation")
-            
-            with col2:
-                fig2 = analyzer.create_performance_chart(data, df['Symbol'].tolist())
-                st.plotly_chart(fig2, use_container_width=True, key="individual_performance")
-            
-            # Tabela detalhada
-            st.subheader("📋 Análise Detalhada")
-            
-            # Colorir linhas baseado no score
-            def highlight_score(row):
-                if row['Score'] >= 70:
-                    return ['background-color: #e8f5e8'] * len(row)
-                elif row['Score'] >= 50:
-                    return ['background-color: #fff3e0'] * len(row)
-                else:
-                    return ['background-color: #ffebee'] * len(row)
-            
-            styled_df = df[['Symbol', 'Preço Atual', 'Variação (%)', 
-                            'Volatilidade (%)', 'P/L', 'Score']].style.apply(highlight_score, axis=1)
-            
-            st.dataframe(styled_df, use_container_width=True)
-            
-            # Recomendações específicas
-            st.subheader("💡 Recomendações Baseadas em IA")
-            
-            top_3 = df.head(3)
-            
-            for i, (_, row) in enumerate(top_3.iterrows(), 1):
-                score = row['Score']
-                symbol = row['Symbol']
-                price_change = float(row['Variação (%)'].replace('%', ''))
-                
-                if score >= 70:
-                    recommendation = "COMPRA FORTE"
-                    color = "#2e7d32"
-                    justification = f"Score elevado ({score:.1f}), boa performance ({price_change:.1f}%) e baixa volatilidade."
-                elif score >= 50:
-                    recommendation = "COMPRA MODERADA"
-                    color = "#ff9800"
-                    justification = f"Score razoável ({score:.1f}), mas requer acompanhamento da volatilidade."
-                else:
-                    recommendation = "AGUARDAR"
-                    color = "#f44336"
-                    justification = f"Score baixo ({score:.1f}), sugere-se aguardar melhores condições."
-                
-                st.markdown(f"""
-                <div style="border-left: 4px solid {color}; padding: 1rem; margin: 1rem 0; background: #f8f9fa;">
-                    <h4 style="color: {color}; margin: 0;">#{i} - {symbol}</h4>
-                    <p style="margin: 0.5rem 0;"><strong>Recomendação:</strong> <span style="color: {color};">{recommendation}</span></p>
-                    <p style="margin: 0; color: #666;">{justification}</p>
-                </div>
-                """, unsafe_allow_html=True)
-        
-        else:
-            st.error("Não foi possível carregar dados suficientes para análise.")
-    
     # Informações adicionais
     with st.expander("ℹ️ Metodologia de Análise"):
         st.markdown("""
@@ -1045,6 +4120,30 @@ def main():
         - 📉 **Volatilidade (20%):** Menor volatilidade indica maior estabilidade
         - 💰 **Liquidez (15%):** Volume médio de negociação
         - 📋 **Múltiplos (10%):** P/L e outros indicadores fundamentalistas
+
+        **Pares Cointegrados:** a correlação de todos os pares é calculada de uma vez
+        (produto matricial dos retornos padronizados); somente os pares acima da correlação
+        mínima passam pelo teste de Engle-Granger e pelo cálculo de half-life, em paralelo.
+        Pares com z-score do spread acima de ±2 indicam possível reversão à média.
+
+        **Screener:** filtre o universo combinado (B3 + FIIs + Agro) com expressões como
+        `volatility < 30 and pe between 8 and 15 and close > ma50`. A expressão é compilada
+        uma vez e avaliada de forma vetorizada sobre a tabela de métricas em cache.
+
+        **Score FII:** fundos imobiliários usam um modelo próprio focado em renda:
+        DY 12 meses (30%), consistência das distribuições mensais (20%), P/VP (15%),
+        tendência (15%), volatilidade (10%) e liquidez (10%). Os proventos vêm do mesmo
+        download dos preços e os FIIs são baixados uma vez em 5 anos, então trocar o
+        período apenas recalcula o ranking.
+
+        **Risco ajustado (opcional):** com a opção "Incluir risco ajustado no Score", o score base
+        passa a valer 80% e Sharpe (10%) e Alfa vs Ibovespa (10%) completam os 100 pontos.
+        Beta, Alfa, Sharpe, Sortino e Tracking Error são calculados contra o Ibovespa (^BVSP),
+        usando o CDI como taxa livre de risco.
+
+        **Qualidade dos dados:** antes das métricas, os históricos são validados de uma vez
+        (lacunas, preço parado, dias sem negócios, retornos atípicos, desdobramentos e proventos):
+        ativos inutilizáveis saem da análise e erros corrigíveis são ajustados.
         
         **Interpretação:**
         - 🟢 **70-100:** Compra Forte
@@ -1062,10 +4161,19 @@ def main():
         - **Segmentos:** Petróleo, Mineração, Bancos, Varejo, Tecnologia, Energia, Construção, Agronegócio e mais
         
         ### ⚡ Otimizações de Performance:
+        - **Gráficos otimizados:** séries longas reduzidas com LTTB e renderização WebGL
         - **Cache inteligente:** Dados ficam em cache durante a sessão
+        - **Memoização:** métricas, gráficos e tabelas ficam em cache por (universo, período, versão dos dados);
+          interações que só mudam a interface reaproveitam os resultados sem recalcular
         - **Download otimizado:** Timeout de 10s por ativo
         - **Delay adaptativo:** Menor delay para análises grandes
         - **Progress tracking:** Acompanhe o progresso em tempo real
+        - **Segundo plano:** a coleta roda como job no servidor (cancelável e reanexável pelo ID);
+          análises idênticas de outras sessões reaproveitam o mesmo job
+        - **Intraday ao vivo:** candles de 1m/5m/15m; cada atualização baixa só os candles novos e
+          atualiza médias móveis, volatilidade (Welford) e Score em O(1) por candle
+        - **Alertas:** regras sobre as métricas intraday avaliadas em lote (regras x ativos) a cada candle novo
+        - **Tabela paginada:** filtro, ordenação e paginação no servidor; só a página visível vai ao navegador
         - **Filtro automático:** Remove ações sem dados ou removidas da bolsa
         
         ### 🔧 Tratamento de Erros:
@@ -1075,14 +4183,23 @@ def main():
         """)
     
     # Mostrar status do cache na sidebar
-    cache_size = len(st.session_state.get('data_cache', {}))
+    data_cache = st.session_state.get('data_cache', {})
+    cache_size = len(data_cache)
     if cache_size > 0:
-        st.sidebar.info(f"💾 Cache: {cache_size} ativos salvos\n⚡ Próximas análises serão mais rápidas!")
+        cache_mb = sum(record.nbytes for record in data_cache.values()) / 1024 ** 2
+        st.sidebar.info(f"💾 Cache: {cache_size} ativos salvos ({cache_mb:.1f} MB)\n⚡ Próximas análises serão mais rápidas!")
     else:
         st.sidebar.info("💾 Cache vazio\n⏱️ Primeira análise pode demorar mais")
+
+    http_stats = PROVIDER_HTTP.cache.stats()
+    if http_stats['hits'] + http_stats['revalidated'] + http_stats['misses'] > 0:
+        st.sidebar.caption(
+            f"🌐 HTTP do provedor: {http_stats['hits']} respostas do cache, {http_stats['revalidated']} "
+            f"revalidadas (304), {http_stats['misses']} baixadas | "
+            f"{http_stats['bytes_saved'] / 1024 ** 2:.1f} MB economizados")
     
     with st.expander("📋 Lista Completa de FIIs Analisados"):
-        st.markdown("### 🏢 117 Fundos Imobiliários do IFIX:")
+        st.markdown(f"### 🏢 {len(analyzer.real_estate_funds)} Fundos Imobiliários do IFIX:")
         
         # Mostrar fundos em colunas organizadas
         fundos_clean = [fundo.replace('.SA', '') for fundo in analyzer.real_estate_funds]
@@ -1094,27 +4211,15 @@ def main():
                 st.text(fundo)
     
     with st.expander("📈 Lista de Ações da B3 por Segmento"):
-        st.markdown("### 🏭 400+ Ações da B3 por Segmento:")
-        
-        # Organizar por segmentos (primeiros de cada categoria)
-        segmentos = {
-            "🛢️ Petróleo & Gás": ["PETR3", "PETR4", "PRIO3", "RRRP3", "RECV3", "3R11"],
-            "⛏️ Mineração": ["VALE3", "CSNA3", "GGBR4", "USIM5", "GOAU4", "FESA4"],
-            "🏦 Bancos": ["ITUB4", "BBDC4", "BBAS3", "SANB11", "BPAC11", "BMGB4"],
-            "🛒 Varejo": ["MGLU3", "LREN3", "AMER3", "PCAR3", "VVAR3", "GUAR3"],
-            "🍺 Alimentos & Bebidas": ["ABEV3", "JBSS3", "BRFS3", "MRFG3", "SMLS3", "CAML3"],
-            "💻 Tecnologia": ["VIVT3", "TIMS3", "DESK3", "TOTS3", "IFCM3", "LWSA3"],
-            "⚡ Energia": ["ELET3", "EQTL3", "CPFE3", "CMIG4", "CPLE6", "TAEE11"],
-            "🏗️ Construção": ["MRVE3", "CYRE3", "EVEN3", "GFSA3", "JHSF3", "HBTS5"],
-            "🌱 Agronegócio": ["SLC3", "TERA3", "SOJA3", "LAND3", "RUMO3", "RAIZ4"],
-            "🚛 Transporte": ["RAIL3", "CCRO3", "LOGN3", "AZUL4", "GOLL4", "EMBR3"]
-        }
+        st.markdown(f"### 🏭 {len(analyzer.b3_stocks)} Ações da B3 por Segmento:")
         
-        for segmento, acoes in segmentos.items():
+        # Segmentos do cadastro de universos (primeiros de cada segmento)
+        for segmento, acoes in analyzer.registry.segments('b3').items():
             st.markdown(f"**{segmento}:**")
-            st.text(", ".join(acoes) + " e mais...")
+            codigos = ", ".join(acao.replace('.SA', '') for acao in acoes[:6])
+            st.text(codigos + (" e mais..." if len(acoes) > 6 else ""))
             
-        st.info("💡 Esta é apenas uma amostra. O sistema inclui 390+ ações de todos os segmentos da B3!")
+        st.info("💡 Esta é apenas uma amostra. O sistema inclui todas as ações de cada segmento da B3!")
         
         # Mostrar total de ações por categoria
         total_acoes = len(analyzer.b3_stocks)
@@ -0,0 +1,197 @@
+"""Teste da sessão HTTP do provedor (pool keep-alive + cache em disco) contra um servidor local.
+
+Sobe um servidor HTTP/1.1 que imita o endpoint de cotações do provedor (JSON com
+Cache-Control e ETag, respondendo 304 a requisições condicionais) e mede, para a mesma
+lista de ativos:
+  1. sem sessão: uma conexão nova por requisição;
+  2. sessão com pool, cache frio: downloads reaproveitando as conexões;
+  3. cache quente: respostas ainda válidas, sem tocar o servidor;
+  4. cache vencido: revalidação condicional (304, sem corpo).
+Falha (código 1) se conexões, requisições ou contadores fugirem do esperado.
+
+Uso:
+    python provider_http_test.py --symbols 390 --clients 4 [--pool-size 10] [--max-age 2]
+"""
+import os
+
+os.environ.setdefault('STREAMLIT_LOGGER_LEVEL', 'error')
+
+import argparse
+import hashlib
+import json
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import requests as plain_requests
+
+from app import HttpResponseCache, create_http_session
+
+FIXTURE_DAYS = 252
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """GET /v8/finance/chart/{ativo}: série fixa por ativo, com validade e ETag"""
+
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.count('connections')
+
+    def do_GET(self):
+        symbol = self.path.split('?')[0].rstrip('/').rsplit('/', 1)[-1]
+        body = self.server.payload(symbol)
+        etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+        self.server.count('requests')
+        if self.headers.get('If-None-Match') == etag:
+            self.server.count('not_modified')
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', f'max-age={self.server.max_age}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.server.count('bytes', len(body))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', f'max-age={self.server.max_age}')
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, max_age):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.max_age = max_age
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._payloads = {}
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def take_counters(self):
+        with self._lock:
+            counters, self.counters = self.counters, {}
+        return counters
+
+    def payload(self, symbol):
+        with self._lock:
+            if symbol not in self._payloads:
+                rng = np.random.default_rng(sum(map(ord, symbol)))
+                close = 50 * np.exp(np.cumsum(rng.normal(0.0003, 0.015, FIXTURE_DAYS)))
+                self._payloads[symbol] = json.dumps({'chart': {'result': [{
+                    'meta': {'symbol': symbol},
+                    'timestamp': list(range(1_700_000_000, 1_700_000_000 + FIXTURE_DAYS * 86400, 86400)),
+                    'indicators': {'quote': [{'close': close.round(4).tolist(),
+                                              'volume': rng.integers(10_000, 2_000_000, FIXTURE_DAYS).tolist()}]},
+                }]}}).encode('utf-8')
+            return self._payloads[symbol]
+
+def run_phase(fetch, urls, clients):
+    """Busca todas as URLs com clients threads; devolve (segundos, latências em ms)"""
+    chunks = [urls[i::clients] for i in range(clients)]
+    latencies = [[] for _ in chunks]
+
+    def worker(chunk, out):
+        for url in chunk:
+            start = time.perf_counter()
+            response = fetch(url)
+            response.raise_for_status()
+            response.json()
+            out.append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=worker, args=(chunk, out)) for chunk, out in zip(chunks, latencies)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, np.concatenate([np.array(l) for l in latencies])
+
+def main():
+    parser = argparse.ArgumentParser(description="Sessão HTTP com pool e cache contra um servidor local")
+    parser.add_argument('--symbols', type=int, default=390, help="ativos buscados por fase")
+    parser.add_argument('--clients', type=int, default=4, help="threads fazendo requisições")
+    parser.add_argument('--pool-size', type=int, default=10, help="conexões mantidas por host")
+    parser.add_argument('--max-age', type=int, default=2, help="validade (s) das respostas do servidor")
+    args = parser.parse_args()
+
+    server = StandInServer(args.max_age)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    urls = [f'http://{host}:{port}/v8/finance/chart/ATV{i:03d}.SA?range=1y&interval=1d&crumb=c{i % 7}'
+            for i in range(args.symbols)]
+
+    failures = []
+
+    def check(condition, message):
+        if not condition:
+            failures.append(message)
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = HttpResponseCache(directory)
+        session = create_http_session(cache, args.pool_size)
+        phases = [
+            ("sem sessão (conexão por requisição)", lambda url: plain_requests.get(url, timeout=10)),
+            ("pool + cache frio", lambda url: session.get(url, timeout=10)),
+            ("cache quente", lambda url: session.get(url, timeout=10)),
+            ("cache vencido (revalidação)", lambda url: session.get(url, timeout=10)),
+        ]
+        results = []
+        for i, (name, fetch) in enumerate(phases):
+            if i == 3:
+                time.sleep(args.max_age + 0.5)
+            before = cache.stats()
+            elapsed, latencies = run_phase(fetch, urls, args.clients)
+            after = cache.stats()
+            delta = {key: after[key] - before[key] for key in after}
+            results.append((name, elapsed, latencies, server.take_counters(), delta))
+
+        session.close()
+    server.shutdown()
+    server.server_close()
+
+    print(f"{args.symbols} ativos por fase, {args.clients} threads, pool de {args.pool_size} conexões\n")
+    for name, elapsed, latencies, counters, delta in results:
+        print(f"{name}:")
+        print(f"  {elapsed * 1000:.0f} ms | p50 {np.percentile(latencies, 50):.2f} ms | "
+              f"p95 {np.percentile(latencies, 95):.2f} ms")
+        print(f"  servidor: {counters.get('connections', 0)} conexões, {counters.get('requests', 0)} requisições, "
+              f"{counters.get('not_modified', 0)} respostas 304, {counters.get('bytes', 0) / 1024:.0f} KB enviados")
+        print(f"  cache: {delta['hits']} acertos, {delta['revalidated']} revalidadas, {delta['misses']} baixadas, "
+              f"{delta['bytes_saved'] / 1024:.0f} KB economizados")
+
+    n = args.symbols
+    baseline, cold, warm, stale = (r[3] for r in results)
+    check(baseline.get('connections', 0) == n, f"sem sessão: esperado {n} conexões, houve {baseline.get('connections', 0)}")
+    check(cold.get('connections', 0) <= min(args.clients, args.pool_size),
+          f"pool: {cold.get('connections', 0)} conexões abertas para {args.clients} threads")
+    check(results[1][4]['misses'] == n, f"cache frio: esperado {n} downloads, houve {results[1][4]['misses']}")
+    check(warm.get('requests', 0) == 0 and results[2][4]['hits'] == n,
+          f"cache quente: {warm.get('requests', 0)} requisições ao servidor, {results[2][4]['hits']} acertos")
+    check(stale.get('connections', 0) <= min(args.clients, args.pool_size),
+          f"revalidação: {stale.get('connections', 0)} conexões novas (respostas 304 devem manter o keep-alive)")
+    check(stale.get('not_modified', 0) == n and results[3][4]['revalidated'] == n and stale.get('bytes', 0) == 0,
+          f"revalidação: {stale.get('not_modified', 0)} respostas 304, {results[3][4]['revalidated']} revalidadas")
+
+    if failures:
+        print("\n❌ " + "\n❌ ".join(failures))
+        sys.exit(1)
+    print("\n✅ Pool, validade e revalidação condicional conforme o esperado")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""Histórico diário dos rankings (snapshots colunares em disco).
+
+Módulo sem dependência do Streamlit: usado pelo app, que grava os snapshots a cada análise
+e no backfill, e pela API (api.py), que só os lê.
+"""
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows: só a trava entre threads
+    fcntl = None
+
+# Períodos suportados, do menor para o maior (um download maior atende os menores)
+PERIOD_ORDER = ['6mo', '1y', '2y', '5y']
+SNAPSHOT_DIR = os.environ.get(
+    'SNAPSHOT_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshots')
+)
+
+class RankingSnapshotStore:
+    """Snapshots diários do ranking em formato colunar compacto.
+
+    Cada (universo, período) tem um diretório com um dicionário de símbolos (symbols.json)
+    e um arquivo .npz por dia com colunas tipadas: códigos int16 do dicionário, score
+    uint16 (x10), rank int16 e preço/variação/volatilidade em float32. As consultas
+    leem apenas as colunas de que precisam. As gravações (dicionário e snapshot do dia)
+    releem e reescrevem os arquivos sob uma trava de arquivo por diretório, então vários
+    processos do servidor podem gravar no mesmo histórico.
+    """
+
+    def __init__(self, base_dir=SNAPSHOT_DIR):
+        self.base_dir = base_dir
+        self._lock = threading.Lock()
+
+    def _dir(self, universe, period):
+        return os.path.join(self.base_dir, universe, period)
+
+    @contextmanager
+    def _writer_lock(self, universe, period):
+        directory = self._dir(universe, period)
+        os.makedirs(directory, exist_ok=True)
+        with self._lock, open(os.path.join(directory, 'write.lock'), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _dictionary(self, universe, period):
+        try:
+            with open(os.path.join(self._dir(universe, period), 'symbols.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def _encode(self, universe, period, symbols):
+        """Códigos do dicionário para os símbolos, incluindo novos símbolos quando necessário
+        (chamado com a trava de gravação: o dicionário é relido antes de ser estendido)"""
+        dictionary = self._dictionary(universe, period)
+        positions = {symbol: code for code, symbol in enumerate(dictionary)}
+        new_symbols = [s for s in dict.fromkeys(symbols) if s not in positions]
+        if new_symbols:
+            for symbol in new_symbols:
+                positions[symbol] = len(dictionary)
+                dictionary.append(symbol)
+            directory = self._dir(universe, period)
+            os.makedirs(directory, exist_ok=True)
+            tmp_path = os.path.join(directory, 'symbols.json.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(dictionary, f)
+            os.replace(tmp_path, os.path.join(directory, 'symbols.json'))
+        return np.array([positions[s] for s in symbols], dtype=np.int16)
+
+    def _path(self, universe, period, date):
+        return os.path.join(self._dir(universe, period), f"{pd.Timestamp(date):%Y-%m-%d}.npz")
+
+    def dates(self, universe, period):
+        """Datas com snapshot disponível, em ordem"""
+        try:
+            names = os.listdir(self._dir(universe, period))
+        except OSError:
+            return []
+        return sorted(pd.Timestamp(name[:-4]) for name in names if name.endswith('.npz'))
+
+    def read(self, universe, period, date, columns=('codes', 'score')):
+        """Lê apenas as colunas pedidas de um snapshot"""
+        with np.load(self._path(universe, period, date)) as snapshot:
+            return {col: snapshot[col] for col in columns}
+
+    def _write(self, universe, period, date, codes, score, price, change, volatility):
+        order = np.argsort(-score, kind='stable')
+        rank = np.empty(len(score), dtype=np.int16)
+        rank[order] = np.arange(1, len(score) + 1)
+
+        path = self._path(universe, period, date)
+        tmp_path = path[:-4] + '.tmp.npz'
+        np.savez_compressed(
+            tmp_path,
+            codes=codes.astype(np.int16),
+            score=np.round(np.nan_to_num(score) * 10).astype(np.uint16),
+            rank=rank,
+            price=np.asarray(price, dtype=np.float32),
+            change=np.asarray(change, dtype=np.float32),
+            volatility=np.asarray(volatility, dtype=np.float32),
+        )
+        os.replace(tmp_path, path)
+
+    def save(self, universe, period, date, symbols, score, price, change, volatility):
+        """Grava (ou completa) o snapshot do dia; símbolos já gravados no dia são atualizados"""
+        score = np.asarray(score, dtype=float)
+        columns = [np.asarray(price, dtype=float), np.asarray(change, dtype=float),
+                   np.asarray(volatility, dtype=float)]
+
+        with self._writer_lock(universe, period):
+            codes = self._encode(universe, period, list(symbols))
+            if os.path.exists(self._path(universe, period, date)):
+                previous = self.read(universe, period, date, ('codes', 'score', 'price', 'change', 'volatility'))
+                keep = ~np.isin(previous['codes'], codes)
+                codes = np.concatenate([previous['codes'][keep], codes])
+                score = np.concatenate([previous['score'][keep] / 10, score])
+                columns = [np.concatenate([previous[name][keep], col])
+                           for name, col in zip(('price', 'change', 'volatility'), columns)]
+
+            self._write(universe, period, date, codes, score, *columns)
+
+    def save_history(self, universe, period, history, days=90):
+        """Grava em lote snapshots de várias datas a partir de compute_score_history (backfill).
+
+        Variação e volatilidade são as do período terminado em cada data, como em save().
+        """
+        scores = history.score.dropna(how='all').tail(days)
+        if scores.empty:
+            return 0
+
+        symbols = list(scores.columns)
+        columns = [frame.reindex(index=scores.index, columns=symbols).to_numpy()
+                   for frame in (history.price, history.change, history.volatility)]
+
+        with self._writer_lock(universe, period):
+            codes = self._encode(universe, period, symbols)
+            for i, (date, row) in enumerate(scores.iterrows()):
+                valid = row.notna().to_numpy()
+                self._write(universe, period, date, codes[valid], row.to_numpy()[valid],
+                            *(column[i][valid] for column in columns))
+        return len(scores)
+
+    def universes(self):
+        """Universos e períodos com snapshots gravados: {universo: [períodos]}"""
+        result = {}
+        try:
+            universes = sorted(os.listdir(self.base_dir))
+        except OSError:
+            return result
+        for universe in universes:
+            periods = [p for p in PERIOD_ORDER if self.dates(universe, p)]
+            if periods:
+                result[universe] = periods
+        return result
+
+    def revision(self, universe, period):
+        """Marca de versão (mtime em ns do diretório): muda sempre que um snapshot é gravado"""
+        try:
+            return os.stat(self._dir(universe, period)).st_mtime_ns
+        except OSError:
+            return 0
+
+    def ranking(self, universe, period, date=None):
+        """Ranking completo de um dia (o mais recente por padrão): (data, DataFrame ordenado por rank)"""
+        dates = self.dates(universe, period)
+        if date is None:
+            if not dates:
+                return None, pd.DataFrame()
+            date = dates[-1]
+        date = pd.Timestamp(date)
+        if date not in dates:
+            return date, pd.DataFrame()
+
+        snapshot = self.read(universe, period, date, ('codes', 'score', 'rank', 'price', 'change', 'volatility'))
+        dictionary = self._dictionary(universe, period)
+        frame = pd.DataFrame({
+            'rank': snapshot['rank'].astype(int),
+            'symbol': [dictionary[c].replace('.SA', '') for c in snapshot['codes']],
+            'score': snapshot['score'].astype(float) / 10,
+            'price': snapshot['price'].astype(float),
+            'change': snapshot['change'].astype(float),
+            'volatility': snapshot['volatility'].astype(float),
+        })
+        return date, frame.sort_values('rank', kind='stable').reset_index(drop=True)
+
+    def score_trend(self, universe, period, symbol, days=180):
+        """Evolução do Score de um ativo nos últimos dias (lê só códigos e score)"""
+        dictionary = self._dictionary(universe, period)
+        if symbol not in dictionary:
+            return pd.Series(dtype=float, name=symbol)
+        code = dictionary.index(symbol)
+
+        dates = self.dates(universe, period)
+        dates = [d for d in dates if d >= dates[-1] - pd.Timedelta(days=days)] if dates else []
+        values = {}
+        for date in dates:
+            snapshot = self.read(universe, period, date)
+            match = np.flatnonzero(snapshot['codes'] == code)
+            if len(match):
+                values[date] = snapshot['score'][match[0]] / 10
+        return pd.Series(values, dtype=float, name=symbol)
+
+    def biggest_movers(self, universe, period, days=7, top=10):
+        """Maiores altas e quedas de Score entre o último snapshot e o de `days` dias antes"""
+        columns = ['Symbol', 'Score Atual', 'Score Anterior', 'Variação']
+        dates = self.dates(universe, period)
+        if len(dates) < 2:
+            return pd.DataFrame(columns=columns)
+
+        latest = dates[-1]
+        earlier = [d for d in dates if d <= latest - pd.Timedelta(days=days)]
+        base = earlier[-1] if earlier else dates[0]
+
+        now = self.read(universe, period, latest)
+        before = self.read(universe, period, base)
+        common, now_idx, before_idx = np.intersect1d(now['codes'], before['codes'], return_indices=True)
+        if len(common) == 0:
+            return pd.DataFrame(columns=columns)
+
+        score_now = now['score'][now_idx].astype(float) / 10
+        score_before = before['score'][before_idx].astype(float) / 10
+        delta = score_now - score_before
+        order = np.argsort(-np.abs(delta), kind='stable')[:top]
+
+        dictionary = self._dictionary(universe, period)
+        return pd.DataFrame({
+            'Symbol': [dictionary[c].replace('.SA', '') for c in common[order]],
+            'Score Atual': score_now[order],
+            'Score Anterior': score_before[order],
+            'Variação': delta[order],
+        })
@@ -0,0 +1,171 @@
+"""Teste da matriz de preços compartilhada (SharedPriceMatrix) entre processos do servidor.
+
+Cada papel roda em um interpretador separado, com o mesmo SHARED_MATRIX_DIR:
+  1. um processo publica os ativos e outro, novo, lê os mesmos valores mapeados (sem cópia);
+  2. dois escritores publicam ao mesmo tempo e um leitor já aberto passa para a versão
+     final, com os ativos dos dois (a trava de arquivo não perde publicações);
+  3. com SHARED_MATRIX_MAX_AGE curto, a versão vencida é ignorada pelos leitores e os
+     registros vencidos não são levados para a próxima publicação.
+Falha (código 1) se algum processo divergir do esperado.
+
+Uso:
+    python shared_matrix_test.py --symbols 200 [--max-age 2]
+"""
+import os
+
+os.environ.setdefault('STREAMLIT_LOGGER_LEVEL', 'error')
+
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def fixture_symbols(start, count):
+    return [f'SHR{i:04d}.SA' for i in range(start, start + count)]
+
+def fixture_records(symbols):
+    """Históricos determinísticos por ativo, no formato publicado pelo app"""
+    from api_load_test import FixtureProvider
+    from app import CompactHistory, FII_FETCH_PERIOD
+
+    records = {}
+    for symbol in symbols:
+        provider = FixtureProvider(symbol)
+        records[symbol] = (CompactHistory.from_history(provider.history(FII_FETCH_PERIOD), provider.info),
+                           FII_FETCH_PERIOD)
+    return records
+
+def role_publish(args):
+    from app import SharedPriceMatrix
+
+    records = fixture_records(fixture_symbols(args.start, args.count))
+    version = SharedPriceMatrix().publish(records)
+    print(json.dumps({'version': version}))
+
+def read_snapshot(matrix, symbols):
+    """Confere os ativos da versão atual contra os históricos esperados"""
+    expected = fixture_records(symbols)
+    snapshot = matrix.snapshot()
+    if snapshot is None:
+        return {'version': None, 'symbols': 0, 'found': 0, 'mismatched': 0, 'mapped': False}
+    found = mismatched = 0
+    for symbol in symbols:
+        record = matrix.record(snapshot, symbol)
+        if record is None:
+            continue
+        found += 1
+        reference = expected[symbol][0]
+        if not (np.array_equal(record.positions, reference.positions)
+                and np.array_equal(record.close, reference.close)
+                and np.array_equal(record.volume, reference.volume)):
+            mismatched += 1
+    return {'version': snapshot['version'], 'symbols': len(snapshot['symbols']), 'found': found,
+            'mismatched': mismatched, 'mapped': isinstance(snapshot['close'], np.memmap)}
+
+def role_read(args):
+    from app import SharedPriceMatrix
+
+    print(json.dumps(read_snapshot(SharedPriceMatrix(), fixture_symbols(args.start, args.count))))
+
+def role_watch(args):
+    """Leitor de vida longa: lê, espera um sinal na entrada padrão e lê de novo"""
+    from app import SharedPriceMatrix
+
+    matrix = SharedPriceMatrix()
+    symbols = fixture_symbols(args.start, args.count)
+    print(json.dumps(read_snapshot(matrix, symbols)), flush=True)
+    sys.stdin.readline()
+    print(json.dumps(read_snapshot(matrix, symbols)), flush=True)
+
+def spawn(role, directory, start, count, max_age, **popen):
+    env = dict(os.environ, SHARED_MATRIX_DIR=directory, SHARED_MATRIX_MAX_AGE=str(max_age))
+    command = [sys.executable, os.path.abspath(__file__), '--role', role,
+               '--start', str(start), '--count', str(count)]
+    return subprocess.Popen(command, cwd=APP_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            text=True, **popen)
+
+def result(process, role, output=None):
+    """Última linha JSON do processo (erro com a saída de erro se ele falhou)"""
+    if output is None:
+        output, errors = process.communicate()
+    else:
+        errors = process.stderr.read()
+    if process.wait() != 0:
+        raise RuntimeError(f"Processo '{role}' falhou (código {process.returncode}):\n{errors[-2000:]}")
+    return json.loads(output.strip().splitlines()[-1])
+
+def run(role, directory, start, count, max_age=3600):
+    return result(spawn(role, directory, start, count, max_age), role)
+
+def main():
+    parser = argparse.ArgumentParser(description="Matriz de preços compartilhada entre processos")
+    parser.add_argument('--symbols', type=int, default=200, help="ativos publicados por escritor")
+    parser.add_argument('--max-age', type=int, default=2, help="validade (s) usada na fase de expiração")
+    parser.add_argument('--role', choices=['publish', 'read', 'watch'], help=argparse.SUPPRESS)
+    parser.add_argument('--start', type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument('--count', type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.role:
+        {'publish': role_publish, 'read': role_read, 'watch': role_watch}[args.role](args)
+        return
+
+    n = args.symbols
+    failures = []
+
+    def check(condition, message):
+        if not condition:
+            failures.append(message)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # 1. Publicação em um processo, leitura em outro
+        start = time.perf_counter()
+        published = run('publish', directory, 0, n)
+        read = run('read', directory, 0, n)
+        print(f"1. publicação e leitura em processos separados ({time.perf_counter() - start:.1f}s): "
+              f"versão {read['version']}, {read['found']}/{n} ativos, {read['mismatched']} divergentes, "
+              f"mapeado sem cópia: {read['mapped']}")
+        check(read['version'] == published['version'] and read['found'] == n and read['mismatched'] == 0,
+              f"leitura: {read['found']}/{n} ativos, {read['mismatched']} divergentes")
+        check(read['mapped'], "leitura: arrays copiados em vez de mapeados")
+
+        # 2. Dois escritores simultâneos e um leitor já aberto
+        watcher = spawn('watch', directory, 0, 3 * n, 3600, stdin=subprocess.PIPE)
+        before = json.loads(watcher.stdout.readline())
+        writers = [spawn('publish', directory, n, n, 3600), spawn('publish', directory, 2 * n, n, 3600)]
+        versions = [result(writer, 'publish')['version'] for writer in writers]
+        watcher.stdin.write('\n')
+        watcher.stdin.flush()
+        after = result(watcher, 'watch', watcher.stdout.readline())
+        print(f"2. escritores simultâneos (versões {sorted(versions)}): leitor aberto foi da versão "
+              f"{before['version']} ({before['found']} ativos) para a {after['version']} ({after['found']} ativos, "
+              f"{after['mismatched']} divergentes)")
+        check(sorted(versions) == [2, 3], f"escritores: versões publicadas {versions}")
+        check(after['version'] == max(versions) and after['found'] == 3 * n and after['mismatched'] == 0,
+              f"leitor aberto: versão {after['version']} com {after['found']}/{3 * n} ativos")
+
+        # 3. Expiração: versão vencida ignorada e registros vencidos fora da próxima publicação
+        # (a leitura final usa validade longa: só confere o que o escritor publicou)
+        time.sleep(args.max_age + 0.5)
+        expired = run('read', directory, 0, 3 * n, max_age=args.max_age)
+        run('publish', directory, 3 * n, n, max_age=args.max_age)
+        fresh = run('read', directory, 0, 4 * n)
+        print(f"3. validade de {args.max_age}s: versão vencida lida como {expired['version']}; "
+              f"nova publicação com {fresh['symbols']} ativos ({fresh['found']} válidos)")
+        check(expired['version'] is None, f"expiração: versão {expired['version']} vencida ainda lida")
+        check(fresh['symbols'] == n and fresh['found'] == n,
+              f"expiração: nova versão levou {fresh['symbols'] - n} registros vencidos")
+
+    if failures:
+        print("\n❌ " + "\n❌ ".join(failures))
+        sys.exit(1)
+    print("\n✅ Publicação, leitura entre processos, concorrência e validade conforme o esperado")
+
+if __name__ == "__main__":
+    main()
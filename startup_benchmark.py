@@ -0,0 +1,146 @@
+"""Benchmark de partida do app: tempo de import (-X importtime) e da primeira renderização.
+
+Cada medição roda em um interpretador novo (partida a frio): o import do app é medido com
+-X importtime, agregado por pacote, e a página inicial é executada pelo AppTest do Streamlit
+(primeira renderização e reruns). Também verifica se alguma dependência pesada (rede e
+gráficos) foi carregada antes da primeira renderização.
+
+Uso:
+    python startup_benchmark.py --runs 5 [--eager] [--budget-ms 1500] [--top 15]
+"""
+import os
+
+os.environ.setdefault('STREAMLIT_LOGGER_LEVEL', 'error')
+
+import argparse
+import json
+import re
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# Carregadas só no primeiro uso (download de cotações e gráficos)
+HEAVY_MODULES = ('yfinance', 'curl_cffi', 'plotly.express', 'plotly.subplots')
+IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)\s*$')
+
+PAINT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+# O servidor compila o script uma vez e reaproveita o bytecode nos reruns; o AppTest
+# recompila a cada execução. O cache abaixo reproduz o servidor.
+compiled = {{}}
+get_bytecode = ScriptCache.get_bytecode
+ScriptCache.get_bytecode = lambda self, path: compiled.get(path) or compiled.setdefault(path, get_bytecode(self, path))
+at = AppTest.from_file({path!r}, default_timeout=120)
+ready = time.perf_counter()
+at.run()
+first = time.perf_counter()
+reruns = []
+for _ in range({reruns}):
+    t = time.perf_counter()
+    at.run()
+    reruns.append(time.perf_counter() - t)
+print(json.dumps({{
+    'harness': ready - start, 'first_paint': first - ready, 'reruns': reruns,
+    'errors': [str(e.value) for e in at.exception],
+    'heavy': [m for m in {heavy!r} if m in sys.modules],
+}}))
+"""
+
+def parse_importtime(stderr):
+    """Linhas do -X importtime: [(módulo, profundidade, próprio µs, acumulado µs)]"""
+    records = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            records.append((name, len(indent) // 2, int(self_us), int(cumulative_us)))
+    return records
+
+def package_totals(records):
+    """Tempo próprio somado por pacote de topo (ms), do mais caro ao mais barato"""
+    totals = {}
+    for name, _, self_us, _ in records:
+        package = name.split('.')[0]
+        totals[package] = totals.get(package, 0) + self_us / 1000
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+def run_python(args, env):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable] + args, cwd=APP_DIR, env=env, capture_output=True, text=True)
+    return time.perf_counter() - start, result
+
+def measure_import(env):
+    """Import do app a frio: (segundos de parede, registros do importtime, módulos pesados carregados)"""
+    code = f"import sys, app; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    elapsed, result = run_python(['-X', 'importtime', '-c', code], env)
+    if result.returncode != 0:
+        raise RuntimeError(f"Falha ao importar o app:\n{result.stderr[-2000:]}")
+    heavy = [m for m in result.stdout.strip().splitlines()[-1].split(',') if m] if result.stdout.strip() else []
+    return elapsed, parse_importtime(result.stderr), heavy
+
+def measure_paint(env, reruns):
+    """Página inicial pelo AppTest a frio: tempos da primeira renderização e dos reruns"""
+    code = PAINT_SCRIPT.format(path=os.path.join(APP_DIR, 'app.py'), reruns=reruns, heavy=HEAVY_MODULES)
+    _, result = run_python(['-c', code], env)
+    if result.returncode != 0:
+        raise RuntimeError(f"Falha ao executar o app:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Tempo de partida a frio e de rerun do app")
+    parser.add_argument('--runs', type=int, default=5, help="partidas a frio medidas")
+    parser.add_argument('--reruns', type=int, default=5, help="reruns medidos por partida")
+    parser.add_argument('--eager', action='store_true', help="importa tudo na partida (LAZY_IMPORTS=0)")
+    parser.add_argument('--top', type=int, default=15, help="pacotes mais caros listados")
+    parser.add_argument('--budget-ms', type=float, default=None,
+                        help="falha (código 1) se a mediana da primeira renderização passar do orçamento")
+    args = parser.parse_args()
+
+    env = dict(os.environ, LAZY_IMPORTS='0' if args.eager else '1')
+    import_times, import_totals, paints, rerun_times = [], [], [], []
+    heavy_loaded = set()
+    records = []
+    for _ in range(args.runs):
+        elapsed, records, heavy = measure_import(env)
+        import_times.append(elapsed)
+        import_totals.append(sum(r[3] for r in records if r[1] == 0) / 1000)
+        heavy_loaded.update(heavy)
+
+        paint = measure_paint(env, args.reruns)
+        if paint['errors']:
+            print(f"⚠️ Erros na página inicial: {paint['errors']}")
+        paints.append(paint['first_paint'] * 1000)
+        rerun_times.extend(t * 1000 for t in paint['reruns'])
+        heavy_loaded.update(paint['heavy'])
+
+    mode = "imediato (LAZY_IMPORTS=0)" if args.eager else "sob demanda"
+    print(f"Modo de import: {mode} | {args.runs} partidas a frio")
+    print(f"Import do app (importtime): mediana {np.median(import_totals):.0f} ms | "
+          f"processo completo {np.median(import_times) * 1000:.0f} ms")
+    print(f"Primeira renderização: mediana {np.median(paints):.0f} ms | máx {max(paints):.0f} ms")
+    if rerun_times:
+        print(f"Reruns: p50 {np.percentile(rerun_times, 50):.1f} ms | p95 {np.percentile(rerun_times, 95):.1f} ms")
+
+    print("\nPacotes mais caros no import (última partida, ms):")
+    for package, ms in package_totals(records)[:args.top]:
+        print(f"  {package:<28} {ms:8.1f}")
+
+    failed = False
+    if heavy_loaded:
+        print(f"\n❌ Dependências pesadas carregadas antes da primeira renderização: {', '.join(sorted(heavy_loaded))}")
+        failed = not args.eager
+    else:
+        print(f"\n✅ Nenhuma dependência pesada carregada na partida ({', '.join(HEAVY_MODULES)})")
+    if args.budget_ms is not None and np.median(paints) > args.budget_ms:
+        print(f"❌ Primeira renderização acima do orçamento ({np.median(paints):.0f} > {args.budget_ms:.0f} ms)")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()